@@ -0,0 +1,221 @@
+from gpt_controller.util.utils import request_key
+from gpt_controller.config import *
+from typing import Callable
+import threading
+import openai
+import copy
+import json
+import time
+import os
+
+# Function that builds a completion in the OpenAI response format containing a text reply
+def text_completion(content: str) -> dict:
+    return {
+        "choices": [{
+            "index": 0,
+            "finish_reason": "stop",
+            "message": {"role": "assistant", "content": content}
+        }]
+    }
+
+# Function that builds a completion in the OpenAI response format containing a function call
+def function_call_completion(name: str, arguments: dict | str) -> dict:
+    return {
+        "choices": [{
+            "index": 0,
+            "finish_reason": "function_call",
+            "message": {
+                "role": "assistant",
+                "content": None,
+                "function_call": {
+                    "name": name,
+                    "arguments": arguments if isinstance(arguments, str) else json.dumps(arguments)
+                }
+            }
+        }]
+    }
+
+# Function that splits a completion into the chunks of a streamed completion in the OpenAI response format
+# Text content and function call arguments are split into chunks of `size` characters
+def completion_chunks(completion: dict, size: int = 4):
+    choice = completion["choices"][0]
+    message = choice["message"]
+    yield {"choices": [{"index": 0, "delta": {"role": message.get("role", "assistant")}, "finish_reason": None}]}
+    content = message.get("content") or ""
+    for start in range(0, len(content), size):
+        yield {"choices": [{"index": 0, "delta": {"content": content[start:start + size]}, "finish_reason": None}]}
+    if message.get("function_call"):
+        arguments = message["function_call"]["arguments"]
+        yield {"choices": [{"index": 0, "delta": {"function_call": {"name": message["function_call"]["name"], "arguments": ""}}, "finish_reason": None}]}
+        for start in range(0, len(arguments), size):
+            yield {"choices": [{"index": 0, "delta": {"function_call": {"arguments": arguments[start:start + size]}}, "finish_reason": None}]}
+    yield {"choices": [{"index": 0, "delta": {}, "finish_reason": choice["finish_reason"]}]}
+
+class CompletionBackend():
+
+    # Function that returns a chat completion in the OpenAI response format
+    # `timeout` bounds the request (in seconds), None to wait indefinitely
+    def create(self, model: str, messages: list[dict], functions: list[dict] = None, timeout: float = None) -> dict:
+        raise NotImplementedError
+
+    # Function that yields the chunks of a streamed chat completion in the OpenAI response format
+    # Backends without native streaming deliver the chunks once the whole completion is available
+    def stream(self, model: str, messages: list[dict], functions: list[dict] = None, timeout: float = None):
+        yield from completion_chunks(self.create(model, messages, functions, timeout))
+
+class OpenAIBackend(CompletionBackend):
+
+    def __init__(self, api_key: str = OPENAI_API_KEY):
+        openai.api_key = api_key
+
+    def create(self, model: str, messages: list[dict], functions: list[dict] = None, timeout: float = None) -> dict:
+        options = {"request_timeout": timeout} if timeout is not None else {}
+        if functions is None:
+            return openai.ChatCompletion.create(model=model, messages=messages, **options)
+        return openai.ChatCompletion.create(model=model, messages=messages, functions=functions, **options)
+
+    def stream(self, model: str, messages: list[dict], functions: list[dict] = None, timeout: float = None):
+        options = {"request_timeout": timeout} if timeout is not None else {}
+        if functions is None:
+            return openai.ChatCompletion.create(model=model, messages=messages, stream=True, **options)
+        return openai.ChatCompletion.create(model=model, messages=messages, functions=functions, stream=True, **options)
+
+# Local stand-in for the completion API
+# Replays recorded cassettes (keyed by messages and functions) and serves scripted responses.
+# When `record_from` is given, requests without a cassette are forwarded to that backend and recorded.
+# `latency` is spent before a completion (or its first streamed chunk), `chunk_latency` between streamed chunks.
+class OfflineBackend(CompletionBackend):
+
+    def __init__(self, cassette_path: str = None, latency: float = 0.0, record_from: CompletionBackend = None,
+                 chunk_latency: float = 0.0):
+        self.cassette_path = cassette_path
+        self.latency = latency
+        self.chunk_latency = chunk_latency
+        self.record_from = record_from
+
+        self.cassettes : dict[str, list[dict]] = {}
+        self.scripts : list[dict] = []
+        self.replay_positions : dict[str, int] = {}
+        self.calls : int = 0
+        self.lock = threading.Lock()
+
+        if cassette_path is not None and os.path.exists(cassette_path):
+            self.load(cassette_path)
+
+    # Function that registers a scripted response
+    # `response` is either a completion or a callable (messages, functions) -> completion
+    # `match` selects the requests it applies to, `contains` matches the content of the last message
+    # `times` limits how often it is served (default: unlimited)
+    def script(self, response: dict | Callable, match: Callable = None, contains: str = None,
+               latency: float = None, times: int = None):
+        self.scripts.append({
+            "response": response,
+            "match": match,
+            "contains": contains,
+            "latency": latency,
+            "remaining": times
+        })
+
+    def create(self, model: str, messages: list[dict], functions: list[dict] = None, timeout: float = None) -> dict:
+        response, latency = self._lookup(messages, functions)
+        if response is not None:
+            self._wait(latency, None if timeout is None else time.monotonic() + timeout)
+            return self._build(response, messages, functions)
+        return self._forward(model, messages, functions, timeout)
+
+    # The timeout bounds the whole stream, not only its first chunk
+    def stream(self, model: str, messages: list[dict], functions: list[dict] = None, timeout: float = None):
+        response, latency = self._lookup(messages, functions)
+        if response is None:
+            yield from completion_chunks(self._forward(model, messages, functions, timeout))
+            return
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self._wait(latency, deadline)
+        for index, chunk in enumerate(completion_chunks(self._build(response, messages, functions))):
+            if index > 0:
+                self._wait(self.chunk_latency, deadline)
+            yield chunk
+
+    # Function that stores a completion as the cassette for a request
+    def record(self, messages: list[dict], functions: list[dict], completion: dict):
+        key = request_key(messages, functions)
+        with self.lock:
+            self.cassettes.setdefault(key, []).append(json.loads(json.dumps(completion, default=str)))
+
+    def load(self, path: str):
+        with open(path, "r") as f:
+            entries = json.load(f)
+        for entry in entries:
+            self.cassettes.setdefault(entry["key"], []).extend(entry["responses"])
+
+    def save(self, path: str = None):
+        path = path if path is not None else self.cassette_path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump([{"key": key, "responses": responses} for key, responses in self.cassettes.items()], f, indent=4)
+
+    # Function that finds the cassette or scripted response for a request and its latency
+    def _lookup(self, messages: list[dict], functions: list[dict]) -> tuple[dict | Callable, float]:
+        key = request_key(messages, functions)
+        with self.lock:
+            self.calls += 1
+            if key in self.cassettes:
+                return self._replay(key), self.latency
+            for script in self.scripts:
+                if self._matches(script, messages, functions):
+                    if script["remaining"] is not None:
+                        script["remaining"] -= 1
+                    return script["response"], self.latency if script["latency"] is None else script["latency"]
+        return None, 0.0
+
+    # Function that spends a latency, raising a timeout instead if it would end after the deadline
+    @staticmethod
+    def _wait(latency: float, deadline: float = None):
+        if deadline is not None and time.monotonic() + latency > deadline:
+            time.sleep(max(deadline - time.monotonic(), 0))
+            raise TimeoutError("The request timed out")
+        time.sleep(latency)
+
+    @staticmethod
+    def _build(response: dict | Callable, messages: list[dict], functions: list[dict]) -> dict:
+        if callable(response):
+            response = response(messages, functions)
+        return copy.deepcopy(response)
+
+    def _forward(self, model: str, messages: list[dict], functions: list[dict], timeout: float = None) -> dict:
+        if self.record_from is None:
+            raise Exception("No cassette or scripted response matches the request")
+        completion = self.record_from.create(model, messages, functions, timeout=timeout)
+        self.record(messages, functions, completion)
+        return completion
+
+    # Recorded responses for the same request are replayed in order, repeating the last one
+    def _replay(self, key: str) -> dict:
+        responses = self.cassettes[key]
+        position = self.replay_positions.get(key, 0)
+        self.replay_positions[key] = position + 1
+        return copy.deepcopy(responses[min(position, len(responses) - 1)])
+
+    @staticmethod
+    def _matches(script: dict, messages: list[dict], functions: list[dict]) -> bool:
+        if script["remaining"] is not None and script["remaining"] <= 0:
+            return False
+        if script["contains"] is not None:
+            last_content = messages[-1].get("content") if messages else None
+            if not isinstance(last_content, str) or script["contains"] not in last_content:
+                return False
+        if script["match"] is not None and not script["match"](messages, functions):
+            return False
+        return True
+
+# Function that creates the backend selected in the configuration
+def create_backend(name: str = COMPLETION_BACKEND) -> CompletionBackend:
+    if name == "openai":
+        return OpenAIBackend()
+    elif name == "offline":
+        return OfflineBackend(CASSETTE_PATH, OFFLINE_LATENCY, chunk_latency=OFFLINE_CHUNK_LATENCY)
+    elif name == "record":
+        return OfflineBackend(CASSETTE_PATH, record_from=OpenAIBackend())
+    else:
+        raise Exception("Completion backend {} not found".format(name))
@@ -0,0 +1,112 @@
+from gpt_controller.util.tokens import count_tokens, schema_tokens
+from gpt_controller.config import *
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+# Function that returns the number of tokens of a context entry
+# Entries repeat from one prompt to the next, so their counts are cached
+@lru_cache(maxsize=8192)
+def entry_tokens(entry: str) -> int:
+    return count_tokens(entry)
+
+ELISION_MARKER = "({} entries omitted)\n"
+ELISION_TOKENS = 8
+
+# Section of a prompt, such as the activity logs or the environment knowledge
+# Entries are ordered from lowest to highest value (e.g. oldest to most recent), so the first entries are dropped first
+@dataclass
+class ContextSection:
+    name : str
+    header : str
+    entries : list[str] = field(default_factory=list)
+    priority : int = 1
+
+    # Function that creates a section from a loaded text, treating its first line as header and every other line as an entry
+    @classmethod
+    def from_text(cls, name: str, text: str, priority: int = 1):
+        lines = text.splitlines(keepends=True)
+        if not lines:
+            return cls(name, "", [], priority)
+        return cls(name, lines[0], lines[1:], priority)
+
+    def render(self, kept: list[int]) -> str:
+        dropped = len(self.entries) - len(kept)
+        text = self.header
+        if dropped:
+            text += ELISION_MARKER.format(dropped)
+        return text + "".join(self.entries[index] for index in sorted(kept))
+
+@dataclass
+class BudgetReport:
+    budget : int
+    used : int = 0
+    dropped : dict[str, int] = field(default_factory=dict)
+
+    def summary(self) -> str:
+        return ", ".join("{} {} entries".format(count, name) for name, count in self.dropped.items() if count)
+
+# Fits the context sections of a prompt into a token budget
+# Every section gets a share of the budget proportional to its priority and keeps its most valuable
+# entries within that share. Budget left over by small sections is then handed out by priority.
+class ContextBudget():
+
+    def __init__(self, budget: int = CONTEXT_BUDGET):
+        self.budget = budget
+
+    # Function that returns the number of tokens taken by the parts of a prompt that are not trimmed
+    # `message_counts` are the token counts of the messages, already known for the messages of a conversation
+    @staticmethod
+    def reserved_tokens(message_counts: list[int], functions: list[dict] = None) -> int:
+        reserved = 2  # every reply is primed with <im_start>assistant
+        reserved += sum(message_counts)
+        if functions is not None:
+            reserved += sum(schema_tokens(function) for function in functions)
+        return reserved
+
+    # Function that returns the rendered sections fitting the budget and a report of what was dropped
+    # A smaller `budget` than the configured one can be given, e.g. to save tokens
+    def fit(self, sections: list[ContextSection], reserved: int = 0, budget: int = None) -> tuple[list[str], BudgetReport]:
+        budget = budget if budget is not None else self.budget
+        report = BudgetReport(budget)
+        available = budget - reserved - 4 * len(sections)
+        costs = [[entry_tokens(entry) for entry in section.entries] for section in sections]
+        header_costs = [entry_tokens(section.header) for section in sections]
+        total = sum(header_costs) + sum(sum(section_costs) for section_costs in costs)
+
+        if total <= available:
+            report.used = reserved + total
+            return [section.render(range(len(section.entries))) for section in sections], report
+
+        # Headers and elision markers are always kept
+        available -= sum(header_costs) + ELISION_TOKENS * len(sections)
+        priorities = sum(section.priority for section in sections)
+        kept : list[list[int]] = [[] for _ in sections]
+        used = 0
+
+        # Every section keeps its most valuable entries within its share of the budget
+        for position, section in enumerate(sections):
+            share = available * section.priority / priorities if priorities else 0
+            spent = 0
+            for index in reversed(range(len(section.entries))):
+                if spent + costs[position][index] > share:
+                    break
+                spent += costs[position][index]
+                kept[position].append(index)
+            used += spent
+
+        # The budget left over is handed out to the sections by priority
+        for position in sorted(range(len(sections)), key=lambda position: sections[position].priority, reverse=True):
+            section = sections[position]
+            next_index = len(section.entries) - len(kept[position]) - 1
+            for index in range(next_index, -1, -1):
+                if used + costs[position][index] > available:
+                    break
+                used += costs[position][index]
+                kept[position].append(index)
+
+        rendered = []
+        for position, section in enumerate(sections):
+            report.dropped[section.name] = len(section.entries) - len(kept[position])
+            rendered.append(section.render(kept[position]))
+        report.used = reserved + sum(header_costs) + used
+        return rendered, report
@@ -0,0 +1,131 @@
+from gpt_controller.util.utils import request_key
+from gpt_controller.config import *
+from collections import OrderedDict
+import threading
+import copy
+import json
+import time
+import os
+
+# Content-addressed cache of completions
+# Entries are keyed by a hash of the model, the message contents and the function schemas.
+# The in-memory tier is an LRU of at most `max_entries` entries, backed by an optional
+# persistent tier of one JSON file per entry in `path`, holding at most `max_disk_entries` entries.
+class CompletionCache():
+
+    def __init__(self, path: str = COMPLETION_CACHE_PATH, max_entries: int = COMPLETION_CACHE_SIZE,
+                 max_disk_entries: int = COMPLETION_CACHE_DISK_SIZE, ttl: float = COMPLETION_CACHE_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+
+        self.memory : OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self.disk_index : dict[str, float] = {}
+        self.lock = threading.Lock()
+
+        self.hits : int = 0
+        self.disk_hits : int = 0
+        self.misses : int = 0
+        self.evictions : int = 0
+
+        if self.path is not None:
+            os.makedirs(self.path, exist_ok=True)
+            for file_name in os.listdir(self.path):
+                if file_name.endswith(".json"):
+                    self.disk_index[file_name[:-len(".json")]] = os.path.getmtime(os.path.join(self.path, file_name))
+
+    @staticmethod
+    def key(model: str, messages: list[dict], functions: list[dict] = None) -> str:
+        return request_key(messages, functions, model)
+
+    # Function that returns the cached completion for a key or None if it is missing or expired
+    def get(self, key: str) -> dict:
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                if self._expired(entry[0]):
+                    self._remove(key)
+                else:
+                    self.memory.move_to_end(key)
+                    self.hits += 1
+                    return copy.deepcopy(entry[1])
+
+            if key in self.disk_index:
+                entry = self._read(key)
+                if entry is not None and not self._expired(entry[0]):
+                    self._remember(key, entry)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return copy.deepcopy(entry[1])
+                self._remove(key)
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, completion: dict):
+        entry = (time.time(), json.loads(json.dumps(completion, default=str)))
+        with self.lock:
+            self._remember(key, entry)
+            if self.path is not None:
+                self._write(key, entry)
+
+    def clear(self):
+        with self.lock:
+            for key in list(self.disk_index.keys()):
+                self._remove(key)
+            self.memory.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "memory_entries": len(self.memory),
+            "disk_entries": len(self.disk_index)
+        }
+
+    def _expired(self, timestamp: float) -> bool:
+        return self.ttl is not None and time.time() - timestamp > self.ttl
+
+    def _remember(self, key: str, entry: tuple[float, dict]):
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+            self.evictions += 1
+
+    def _remove(self, key: str):
+        self.memory.pop(key, None)
+        if self.disk_index.pop(key, None) is not None:
+            try:
+                os.remove(os.path.join(self.path, key + ".json"))
+            except OSError:
+                pass
+
+    def _read(self, key: str) -> tuple[float, dict]:
+        try:
+            with open(os.path.join(self.path, key + ".json"), "r") as f:
+                entry = json.load(f)
+            return (entry["timestamp"], entry["completion"])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _write(self, key: str, entry: tuple[float, dict]):
+        try:
+            with open(os.path.join(self.path, key + ".json"), "w") as f:
+                json.dump({"timestamp": entry[0], "completion": entry[1]}, f)
+        except OSError:
+            return
+        self.disk_index[key] = entry[0]
+        while len(self.disk_index) > self.max_disk_entries:
+            oldest = min(self.disk_index, key=self.disk_index.get)
+            self.disk_index.pop(oldest)
+            try:
+                os.remove(os.path.join(self.path, oldest + ".json"))
+            except OSError:
+                pass
+            self.evictions += 1
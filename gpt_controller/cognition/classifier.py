@@ -0,0 +1,122 @@
+from gpt_controller.util.labels import *
+from gpt_controller.config import *
+from collections import deque
+import threading
+import re
+
+# Keyword rules applied to the lowercased input: (pattern, label name, confidence)
+# The first matching rule wins, so more specific rules come first
+LABEL_RULES : dict[str, list[tuple[str, str, float]]] = {
+    UserInputLabel.__name__: [
+        (r"^(stop|abort|halt|freeze|cancel)\b[\w\s]{0,30}[.!]?$", "ABORT", 0.95),
+        (r"\b(usual|usually|on average|average|in general|generally|typically)\b.*\?$", "QUESTION_GEN_KNOWLEDGE", 0.9),
+        (r"^(where|which)\b.*\?$", "QUESTION_ENV_KNOWLEDGE", 0.95),
+        (r"^(what|how|is|are|do|does)\b.*\?$", "QUESTION_ENV_KNOWLEDGE", 0.6),
+        (r"\b(cannot|can't|can not|must not|mustn't|should not|shouldn't|do not|don't|never|not allowed)\b", "LIMITATION", 0.9),
+        (r"\b(should|could|better to|make sure)\b", "METHODOLOGY", 0.85),
+        (r"^(please )?(pick|place|put|take|go|move|bring|give|hand|open|close|cut|slice|grab|fetch|get|find|wash|clean|turn|fill|pour|throw)\b", "TASK", 0.9),
+        (r"^there (is|are)\b", "OBJECT_INFORMATION", 0.9),
+        (r"^(the|a|an|this|that)\b[\w\s]* (is|are)\b", "OBJECT_INFORMATION", 0.8)
+    ],
+    TaskLabel.__name__: [
+        (r"^ask\b", "INQUIRY", 0.95),
+        (r"^(go|move|navigate|walk|drive|approach|return)\b", "NAVIGATION", 0.95),
+        (r"^(look|detect|search|scan|locate|inspect|check|find|observe)\b", "PERCEPTION", 0.9),
+        (r"^(recall|remember|estimate|reason|think|memorize|determine|calculate|plan)\b", "COGNITION", 0.9),
+        (r"^(pick|place|put|open|close|cut|slice|grab|take|drop|release|hand|give|pour|push|pull|lift)\b", "MANIPULATION", 0.9)
+    ]
+}
+
+# Local classifier that labels trivially classifiable inputs without a completion
+# It combines keyword rules with a nearest-neighbour vote over previously labelled inputs.
+class FastLabelClassifier():
+
+    def __init__(self, threshold: float = FAST_LABEL_THRESHOLD, neighbours: int = FAST_LABEL_NEIGHBOURS,
+                 memory_size: int = FAST_LABEL_MEMORY):
+        self.threshold = threshold
+        self.neighbours = neighbours
+        self.memory_size = memory_size
+
+        self.examples : dict[str, deque[tuple[frozenset[str], Label]]] = {}
+        self.consulted : dict[str, int] = {}
+        self.bypassed : dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def tokenize(input: str) -> frozenset[str]:
+        return frozenset(re.findall(r"[a-z0-9_']+", input.lower()))
+
+    # Function that returns the most likely label of an input with its confidence score (0 to 1)
+    def classify(self, input: str, tags: Label) -> tuple[Label, float]:
+        rule_label, rule_confidence = self.classify_with_rules(input, tags)
+        neighbour_label, neighbour_confidence = self.classify_with_neighbours(input, tags)
+
+        if rule_label is None or (neighbour_label is not None and neighbour_confidence > rule_confidence):
+            label, confidence = neighbour_label, neighbour_confidence
+            if rule_label is not None and rule_label != neighbour_label:
+                confidence -= rule_confidence / 2
+        else:
+            label, confidence = rule_label, rule_confidence
+            if neighbour_label is not None:
+                if neighbour_label == rule_label:
+                    confidence += (1 - confidence) * neighbour_confidence
+                else:
+                    confidence -= neighbour_confidence / 2
+        return label, max(confidence, 0.0)
+
+    # Function that returns the label of an input if it can be trusted without a completion, otherwise None
+    def fast_label(self, input: str, tags: Label, threshold: float = None) -> Label:
+        threshold = threshold if threshold is not None else self.threshold
+        label, confidence = self.classify(input, tags)
+        with self.lock:
+            self.consulted[tags.__name__] = self.consulted.get(tags.__name__, 0) + 1
+            if label is None or confidence < threshold:
+                return None
+            self.bypassed[tags.__name__] = self.bypassed.get(tags.__name__, 0) + 1
+        return label
+
+    # Function that remembers the label assigned to an input by the language model
+    def learn(self, input: str, label: Label):
+        tokens = self.tokenize(input)
+        if not tokens:
+            return
+        with self.lock:
+            examples = self.examples.setdefault(type(label).__name__, deque(maxlen=self.memory_size))
+            examples.append((tokens, label))
+
+    def classify_with_rules(self, input: str, tags: Label) -> tuple[Label, float]:
+        sentence = input.strip().lower()
+        for pattern, label_name, confidence in LABEL_RULES.get(tags.__name__, []):
+            if label_name in tags.__members__ and re.search(pattern, sentence):
+                return tags[label_name], confidence
+        return None, 0.0
+
+    # The confidence is the similarity-weighted share of the vote, scaled by the closest similarity
+    def classify_with_neighbours(self, input: str, tags: Label) -> tuple[Label, float]:
+        examples = self.examples.get(tags.__name__)
+        tokens = self.tokenize(input)
+        if not examples or not tokens:
+            return None, 0.0
+        similarities = []
+        with self.lock:
+            for example_tokens, label in examples:
+                similarity = len(tokens & example_tokens) / len(tokens | example_tokens)
+                if similarity > 0:
+                    similarities.append((similarity, label))
+        if not similarities:
+            return None, 0.0
+        nearest = sorted(similarities, key=lambda entry: entry[0], reverse=True)[:self.neighbours]
+        votes : dict[Label, float] = {}
+        for similarity, label in nearest:
+            votes[label] = votes.get(label, 0.0) + similarity
+        label = max(votes, key=votes.get)
+        return label, votes[label] / sum(votes.values()) * nearest[0][0]
+
+    def stats(self) -> dict:
+        consulted = sum(self.consulted.values())
+        bypassed = sum(self.bypassed.values())
+        return {
+            "consulted": dict(self.consulted),
+            "bypassed": dict(self.bypassed),
+            "bypass_rate": bypassed / consulted if consulted else 0.0
+        }
@@ -0,0 +1,49 @@
+from gpt_controller.config import *
+from collections import OrderedDict
+import threading
+
+# Cache of the prompt fragments describing objects and robot components
+# Entries are keyed by the described item and the described attributes, and hold the version of the item
+# they were rendered from: an entry is reused until the version of its item changes. The cache is an LRU
+# of at most `max_entries` entries, and keeps its items so their identity cannot be reused while cached.
+class FragmentCache():
+
+    def __init__(self, max_entries: int = FRAGMENT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries : OrderedDict[tuple[int, tuple[str, ...]], tuple[object, int, str]] = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits : int = 0
+        self.misses : int = 0
+
+    # Function that returns the description of an item for the attributes, rendered only if the item changed
+    def describe(self, item, attributes: list[str] = None) -> str:
+        key = (id(item), tuple(attributes) if attributes is not None else None)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] is item and entry[1] == item.version:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+        version = item.version
+        description = item.verbose_description(attributes)
+        with self.lock:
+            self.entries[key] = (item, version, description)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return description
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self.entries)
+        }
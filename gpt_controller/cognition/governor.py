@@ -0,0 +1,81 @@
+from gpt_controller.config import *
+from colorama import Fore, Style
+from dataclasses import dataclass
+from enum import IntEnum
+from typing import Callable
+import threading
+import time
+
+# Degradation tiers of the token budget, each one including the restrictions of the previous ones
+class BudgetTier(IntEnum):
+    NORMAL = 0
+    NO_EXTENDED_MODEL = 1   # CHATGPT_MODEL_EXTENDED is no longer used
+    SHRINK_CONTEXT = 2      # context sections are trimmed to a fraction of the context budget
+    LOCAL_FIRST = 3         # local fast paths are preferred over completions whenever possible
+    EXHAUSTED = 4           # no new tasks are accepted, the machine stops once its current tasks finish
+
+@dataclass
+class TierChange:
+    previous : BudgetTier
+    tier : BudgetTier
+    used : int
+    limit : int
+    timestamp : float
+
+# Tracks the tokens spent by all completions against TOKEN_LIMIT and degrades the machine gracefully
+# The tier changes when the tokens spent cross the fractions of the limit given by `thresholds`.
+# Every change is kept in `changes` and passed to the listeners.
+class BudgetGovernor():
+
+    def __init__(self, limit: int = TOKEN_LIMIT, thresholds: list[float] = TOKEN_LIMIT_TIERS,
+                 context_scale: float = BUDGET_CONTEXT_SCALE):
+        self.limit = limit
+        self.thresholds = sorted(thresholds)
+        self.context_scale = context_scale
+        self.used : int = 0
+        self.tier : BudgetTier = BudgetTier.NORMAL
+        self.changes : list[TierChange] = []
+        self.listeners : list[Callable[[TierChange], None]] = []
+        self.lock = threading.Lock()
+
+    def subscribe(self, listener: Callable[[TierChange], None]):
+        self.listeners.append(listener)
+
+    # Function that adds the tokens of a completion to the tokens spent and updates the tier
+    def spend(self, tokens: int):
+        with self.lock:
+            self.used += tokens
+            tier = self.tier_of(self.used)
+            if tier <= self.tier:
+                return
+            change = TierChange(self.tier, tier, self.used, self.limit, time.time())
+            self.tier = tier
+            self.changes.append(change)
+        print(Fore.YELLOW + "Token budget: {} of {} tokens spent, degrading from {} to {}".format(change.used, change.limit, change.previous.name, change.tier.name) + Style.RESET_ALL)
+        for listener in self.listeners:
+            listener(change)
+
+    def tier_of(self, used: int) -> BudgetTier:
+        if self.limit is None:
+            return BudgetTier.NORMAL
+        tier = BudgetTier.NORMAL
+        for level, threshold in enumerate(self.thresholds[:len(BudgetTier) - 1], start=1):
+            if used >= threshold * self.limit:
+                tier = BudgetTier(level)
+        return tier
+
+    def remaining(self) -> int:
+        return None if self.limit is None else max(self.limit - self.used, 0)
+
+    def allows_extended_model(self) -> bool:
+        return self.tier < BudgetTier.NO_EXTENDED_MODEL
+
+    # Function that returns the context budget to use in the current tier
+    def context_budget(self, budget: int) -> int:
+        return int(budget * self.context_scale) if self.tier >= BudgetTier.SHRINK_CONTEXT else budget
+
+    def prefers_local(self) -> bool:
+        return self.tier >= BudgetTier.LOCAL_FIRST
+
+    def exhausted(self) -> bool:
+        return self.tier >= BudgetTier.EXHAUSTED
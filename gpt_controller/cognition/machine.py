@@ -1,323 +1,265 @@
 from gpt_controller.playground.environment import Environment
 from gpt_controller.playground.robot import Robot
+from gpt_controller.cognition.backend import CompletionBackend, create_backend
+from gpt_controller.cognition.cache import CompletionCache
+from gpt_controller.cognition.classifier import FastLabelClassifier
+from gpt_controller.cognition.streaming import StreamAccumulator, FunctionDispatch, replay_message
+from gpt_controller.cognition.retry import RetryPolicy, CompletionError
+from gpt_controller.cognition.budget import ContextBudget, ContextSection, BudgetReport
+from gpt_controller.cognition.prompts import PromptRegistry
+from gpt_controller.cognition.telemetry import Telemetry, CompletionRecord
+from gpt_controller.cognition.governor import BudgetGovernor, BudgetTier
+from gpt_controller.cognition.ratelimit import RateLimiter
+from gpt_controller.cognition.retrieval import ObjectRetriever
+from gpt_controller.cognition.fragments import FragmentCache
 from datetime import datetime, timedelta
 from gpt_controller.util.models import *
+from gpt_controller.util.tokens import schema_tokens, message_tokens
+from gpt_controller.util.schemas import FunctionRegistry, action
+from gpt_controller.util.store import ObjectStore
+from gpt_controller.util.activity import ActivityLog, TaskStack
+from gpt_controller.util.persistence import SQLiteMemory
+from gpt_controller.util.tracing import tracer, traced
 from gpt_controller.util.labels import *
 from gpt_controller.config import *
 from colorama import Fore, Style
-from inspect import signature
-import tiktoken
-import openai
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+import threading
 import json
-import os
+import time
+import re
 
-openai.api_key = OPENAI_API_KEY
+# Object attributes that can be extracted from the user's input when memorizing or updating an object
+OBJECT_PROPERTIES = {
+    "name": {
+        "type": "string",
+        "description": "The name of the object"
+    },
+    "color": {
+        "type": "string",
+        "description": "The color of the object"
+    },
+    "shape": {
+        "type": "string",
+        "description": "The shape of the object",
+        "enum": list(Shape.__members__.keys())
+    },
+    "material": {
+        "type": "string",
+        "description": "The material of the object",
+        "enum": list(Material.__members__.keys())
+    },
+    "width": {
+        "type": "number",
+        "description": "The width of the object"
+    },
+    "height": {
+        "type": "number",
+        "description": "The height of the object"
+    },
+    "length": {
+        "type": "number",
+        "description": "The depth of the object"
+    },
+    "x": {
+        "type": "number",
+        "description": "The x coordinate of the object"
+    },
+    "y": {
+        "type": "number",
+        "description": "The y coordinate of the object"
+    },
+    "z": {
+        "type": "number",
+        "description": "The z coordinate of the object"
+    },
+    "support_surface": {
+        "type": "string",
+        "description": "The support surface of the object. Can be the name of another object or the name of a location"
+    },
+    "contains": {
+        "type": "array",
+        "description": "The object names that this object contains",
+        "items": {
+            "type": "string"
+        }
+    }
+}
+
+# Prompts used by the machine, checked when it starts
+PROMPTS = [
+    "segment_input.txt",
+    "label_input.txt",
+    "label_inputs.txt",
+    "question_about_context.txt",
+    "decision_making.txt",
+    "decide_and_classify.txt",
+    "act.txt",
+    "memorize_object.txt"
+]
+
+# Rate limit priority of the conversation types, user-facing labelling first and background recall last
+PRIORITIES = {
+    ConversationType.CHAT: 0,
+    ConversationType.LABELLING: 0,
+    ConversationType.UNDERSTANDING: 1,
+    ConversationType.DECIDING: 1,
+    ConversationType.ACTING: 1,
+    ConversationType.MEMORIZING: 2,
+    ConversationType.RECALLING: 2
+}
 
 class Machine():
-    conversations : list[Conversation] = []
-    advices : list[Advice] = []
-    task_stack : list[Task] = []
+    conversations : list[Conversation] = None
+    advices : list[Advice] = None
+    task_stack : TaskStack = None
 
     learning_stack : list[Function] = []
     learned_functions : list[Function] = []
 
-    object_knowledge : list[Object] = []
+    object_knowledge : ObjectStore = None
 
-    def __init__(self, environment: Environment):
+    def __init__(self, environment: Environment, backend: CompletionBackend = None, cache: CompletionCache = None,
+                 retry_policy: RetryPolicy = None, rate_limiter: RateLimiter = None, memory: SQLiteMemory = None):
         self.robot = Robot(environment)
-        # DO NOT CHANGE THE ORDER OF THIS LIST AND ADD NEW FUNCTIONS TO THE END, SYNCHRONISED WITH THE SCHEMA SEQUENCE `cognitive_function_schemas`
-        self.cognitive_functions = {
-            "memorize_object": self.memorize_object,
-            "update_object": self.update_object,
-            "recall" : self.recall,
-            "load_environment_knowledge": self.load_environment_knowledge,
-            "load_body_status": self.load_body_status,
-            "load_activity_logs": self.load_activity_logs,
-            "process_complex_input": self.process_tagged_input,
-            "think": self.think
-        }
-        # ADD BUT DO NOT CHANGE THE ORDER
-        self.cognitive_function_schemas = [
-            {
-                "name": "memorize_object",
-                "description": "Memorize an object with all the attributes that you can extract from the user's input",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "name": {
-                            "type": "string",
-                            "description": "The name of the object"
-                        },
-                        "color": {
-                            "type": "string",
-                            "description": "The color of the object"
-                        },
-                        "shape": {
-                            "type": "string",
-                            "description": "The shape of the object",
-                            "enum": list(Shape.__members__.keys())
-                        },
-                        "material": {
-                            "type": "string",
-                            "description": "The material of the object",
-                            "enum": list(Material.__members__.keys())
-                        },
-                        "width": {
-                            "type": "number",
-                            "description": "The width of the object"
-                        },
-                        "height": {
-                            "type": "number",
-                            "description": "The height of the object"
-                        },
-                        "length": {
-                            "type": "number",
-                            "description": "The depth of the object"
-                        },
-                        "x": {
-                            "type": "number",
-                            "description": "The x coordinate of the object"
-                        },
-                        "y": {
-                            "type": "number",
-                            "description": "The y coordinate of the object"
-                        },
-                        "z": {
-                            "type": "number",
-                            "description": "The z coordinate of the object"
-                        },
-                        "support_surface": {
-                            "type": "string",
-                            "description": "The support surface of the object. Can be the name of another object or the name of a location"
-                        },
-                        "contains": {
-                            "type": "array",
-                            "description": "The object names that this object contains",
-                            "items": {
-                                "type": "string"
-                            }
-                        }
-                    }
-                }
-            },
-            {
-                "name": "update_object",
-                "description": '''Update the knowledge of an object with the attributes 
-                                that you can extract from the user's input as well as the already known attributes existent in memory''',
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "name": {
-                            "type": "string",
-                            "description": "The name of the object based on the name of the object that you recalled previously"
-                        },
-                        "color": {
-                            "type": "string",
-                            "description": "The color of the object"
-                        },
-                        "shape": {
-                            "type": "string",
-                            "description": "The shape of the object",
-                            "enum": list(Shape.__members__.keys())
-                        },
-                        "material": {
-                            "type": "string",
-                            "description": "The material of the object",
-                            "enum": list(Material.__members__.keys())
-                        },
-                        "width": {
-                            "type": "number",
-                            "description": "The width of the object"
-                        },
-                        "height": {
-                            "type": "number",
-                            "description": "The height of the object"
-                        },
-                        "length": {
-                            "type": "number",
-                            "description": "The depth of the object"
-                        },
-                        "x": {
-                            "type": "number",
-                            "description": "The x coordinate of the object"
-                        },
-                        "y": {
-                            "type": "number",
-                            "description": "The y coordinate of the object"
-                        },
-                        "z": {
-                            "type": "number",
-                            "description": "The z coordinate of the object"
-                        },
-                        "support_surface": {
-                            "type": "string",
-                            "description": "The support surface of the object. Can be the name of another object or the name of a location"
-                        },
-                        "contains": {
-                            "type": "array",
-                            "description": "The object names that this object contains",
-                            "items": {
-                                "type": "string"
-                            }
-                        }
+        self.conversations = []
+        self.advices = []
+        self.task_stack = TaskStack()
+        self.activity_log : ActivityLog = self.task_stack.log
+        self.object_knowledge = ObjectStore()
+        self.memory = memory if memory is not None or PERSISTENCE_PATH is None else SQLiteMemory()
+        if self.memory is not None:
+            self.memory.load(self)
+        self.retriever = ObjectRetriever(self.object_knowledge) if RETRIEVAL else None
+        self.fragments = FragmentCache()
+        self.prompts = PromptRegistry(required=PROMPTS)
+        self.backend = backend if backend is not None else create_backend()
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        # Error of the last failed completion, kept per thread since labels are requested concurrently
+        self.errors = threading.local()
+        self.context_budget = ContextBudget()
+        self.last_budget_report : BudgetReport = None
+        self.cache = cache if cache is not None or not COMPLETION_CACHE else CompletionCache()
+        self.classifier = FastLabelClassifier() if FAST_LABEL else None
+        self.telemetry = Telemetry() if TELEMETRY else None
+        self.governor = BudgetGovernor()
+        self.accounting_lock = threading.Lock()
+        self.rate_limiter = rate_limiter if rate_limiter is not None or not RATE_LIMIT else RateLimiter()
+        self.cognitive_registry = FunctionRegistry(self)
+        self.cognitive_functions = self.cognitive_registry.select()
+
+        self.label_batch_schemas : dict[str, dict] = {}
+
+        # Schema of the fused decision, reporting the next step together with its label and the DONE signal
+        self.decision_schema = {
+            "name": "decide",
+            "description": "Report whether the current goal is fulfilled and otherwise the next action of the robot",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "done": {
+                        "type": "boolean",
+                        "description": "Whether the current goal is already fulfilled"
                     },
-                    "required": ["name"]
-                }
-            },
-            {
-                "name": "recall",
-                "description": "Recall your knowledge of an object or location",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "name": {
-                            "type": "string",
-                            "description": "The description of the object or location to recall in an inquisitive format."
-                        }
-                    }
-                }
-            },
-            {
-                "name": "load_environment_knowledge",
-                "description": "Load environment knowledge depending on the required attributes specified by the user",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "attributes": {
-                            "type": "array", 
-                            "description": "The attributes of the objects that should be loaded. (e.g. 'name', 'color', 'shape')",
-                            "items": {
-                                "type": "string", 
-                                "enum": list(Object.__annotations__.keys())
-                            }
-                        }
-                    }
-                }
-            },
-            {
-                "name": "load_body_status",
-                "description": "Load status of the robot",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "attributes": {
-                            "type": "array",
-                            "description": "The attributes of the robot that should be loaded.",
-                            "items": {
-                                "type": "string",
-                                "enum": ['manipulator', 'vision', 'navigator']
-                            }
-                        }
-                    }
-                }
-            },
-            {
-                "name": "load_activity_logs",
-                "description": "Load the activity logs of the system such as user inputs, robot actions, dialogue, reasoning process",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "time_span": {
-                            "type": "integer", 
-                            "description": "From how far back in time the should these logs be loaded (in seconds). Can be ignored to load all logs.",
-                            "exclusiveMaximum":  (datetime.now() - self.task_stack[0].start_time).total_seconds() if len(self.task_stack) else 0
-                        },
-                        "frame_size": {
-                            "type": "integer",
-                            "description": "The number of logs to be loaded in one frame. Can be ignored to load all logs.",
-                            "exclusiveMaximum": len(self.task_stack)
-                        }
-                    }   
-                }
-            },
-            {
-                "name": "process_tagged_input",
-                "description": "Process the set of sub-inputs resulted from the user's input based on their label.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "subphrases": {
-                            "type": "array",
-                            "description": "The derived sub-inputs from the user's input. with their labels.",
-                            "items": {
-                                "type": "object",
-                                "properties": {
-                                    "label": {
-                                        "type": "string",
-                                        "enum": list(UserInputLabel.__annotations__.keys())
-                                    },
-                                    "phrase": {
-                                        "type": "string"
-                                    }
-                                },
-                                "required": ["label", "phrase"]
-                            }
-                        }
-                    }
-                }
-            },
-            {
-                "name": "think",
-                "description": "Think about the input and try to reason about it to find an answer.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "input": {
-                            "type": "string",
-                            "description": "The input to reason about."
-                        }
+                    "decision": {
+                        "type": "string",
+                        "description": "The next action of the robot as a simple sentence. Empty if the goal is fulfilled."
+                    },
+                    "label": {
+                        "type": "string",
+                        "description": "The type of the next action. " + TaskLabel.get_prompt_content(),
+                        "enum": [label for label in TaskLabel.__members__.keys() if label != TaskLabel.USER_INPUT.name]
                     }
-                }
+                },
+                "required": ["done"]
             }
-        ]
+        }
 
         self.act_functions = {
-            "search_in_container": self.robot.vision.search_in_container,
-            "move_to_object": self.robot.navigator.move_to_object,
-            "pick_up_object": self.robot.actuator.pick_up_object,
-            "place_object": self.robot.actuator.place_object,
-            "cut_object": self.robot.actuator.cut_object,
-            "put_object_in_container": self.robot.actuator.put_object_in_container,
-            "open_container": self.robot.actuator.open_container
+            **self.robot.vision.functions.select(),
+            **self.robot.navigator.functions.select(),
+            **self.robot.actuator.functions.select()
+        }
+
+    @action("Load environment knowledge depending on the required attributes specified by the user", parameters={
+        "type": "object",
+        "properties": {
+            "attributes": {
+                "type": "array",
+                "description": "The attributes of the objects that should be loaded. (e.g. 'name', 'color', 'shape')",
+                "items": {
+                    "type": "string",
+                    "enum": list(Object.__annotations__.keys())
+                }
+            }
         }
+    })
+    def load_environment_knowledge(self, attributes: list[str]=None, goal: str=None):
+        return "Object Memory\n" + "".join(self.environment_knowledge_entries(attributes, goal))
 
-    def load_environment_knowledge(self, attributes: list[str]=None):
-        object_memory : str = "Object Memory\n"
-        for object in self.object_knowledge:
-            object_memory += object.verbose_description(attributes) + "\n"
-        return object_memory
+    # Function that returns one entry of environment knowledge per known object
+    # Given a goal, only the objects relevant to it are returned, least relevant first, or a note if none is
+    # Descriptions are rendered again only for the objects that changed since they were last described
+    def environment_knowledge_entries(self, attributes: list[str]=None, goal: str=None) -> list[str]:
+        if goal is not None and self.retriever is not None:
+            objects = list(reversed(self.retriever.retrieve(goal)))
+            if not objects:
+                return ["No known object is relevant to the goal\n"]
+        else:
+            objects = self.object_knowledge
+        return [self.fragments.describe(object, attributes) + "\n" for object in objects]
 
+    @action("Load status of the robot", parameters={
+        "type": "object",
+        "properties": {
+            "components": {
+                "type": "array",
+                "description": "The components of the robot whose status should be loaded.",
+                "items": {
+                    "type": "string",
+                    "enum": ['manipulator', 'vision', 'navigator']
+                }
+            }
+        }
+    })
     def load_body_status(self, components:list[str]=None):
-        robot_knowledge : str = "Current Robot State:\n"
+        robot_knowledge : list[str] = ["Current Robot State:\n"]
         if not components:
-            robot_knowledge += self.robot.actuator.verbose_description()
+            robot_knowledge.append(self.fragments.describe(self.robot.actuator))
         else:
             for component in components:
                 if component == "manipulator":
-                    robot_knowledge += self.robot.actuator.verbose_description() + "\n"
+                    robot_knowledge.append(self.fragments.describe(self.robot.actuator) + "\n")
                 if component == "vision":
-                    robot_knowledge += self.robot.vision.verbose_description() + "\n"
+                    robot_knowledge.append(self.fragments.describe(self.robot.vision) + "\n")
                 if component == "navigator":
-                    robot_knowledge += self.robot.navigator.verbose_description() + "\n"
-        return robot_knowledge
+                    robot_knowledge.append(self.fragments.describe(self.robot.navigator) + "\n")
+        return "".join(robot_knowledge)
     
     # Function that loads the activity logs of the system such as user inputs, robot actions, dialogue, reasoning process
-    def load_activity_logs(self, specifications : dict[str, int]=None):
-        time_span = MAX_TIMESPAN
-        frame_size = len(self.task_stack)
-        if specifications is not None:
-            if specifications['time_span']:
-                time_span = int(specifications['time_span'])
-            if specifications['frame_size']:
-                frame_size = int(specifications['frame_size'])
-        log : str = "Task History:\n"
-        for task in self.task_stack:
-            if task.start_time > datetime.now()-timedelta(seconds=time_span):
-                log += task.get_context() + "\n"
-                frame_size -= 1
-            if frame_size == 0:
-                break
-        return log     
+    @action("Load the activity logs of the system such as user inputs, robot actions, dialogue, reasoning process",
+            time_span="From how far back in time the should these logs be loaded (in seconds). Can be ignored to load all logs.",
+            frame_size="The number of logs to be loaded in one frame. Can be ignored to load all logs.")
+    def load_activity_logs(self, time_span: int = None, frame_size: int = None):
+        return "Task History:\n" + "".join(self.activity_log_entries(time_span, frame_size))
+
+    # Function that returns one entry per task logged within the time span, for the most recent tasks of the frame,
+    # from oldest to most recent
+    def activity_log_entries(self, time_span: int = None, frame_size: int = None) -> list[str]:
+        time_span = int(time_span) if time_span else MAX_TIMESPAN
+        frame_size = int(frame_size) if frame_size else None
+        return [task.get_context() + "\n" for task in self.activity_log.window(time_span, frame_size)]
+
+    # Function that trims the context sections of a prompt to fit the context budget
+    # The messages and functions sent along with the sections are not trimmed but count against the budget
+    def fit_context(self, sections: list[ContextSection], fixed_messages: list[Message], functions: list[dict] = None) -> list[str]:
+        reserved = ContextBudget.reserved_tokens([message.token_count for message in fixed_messages], functions)
+        rendered, report = self.context_budget.fit(sections, reserved, self.governor.context_budget(self.context_budget.budget))
+        self.last_budget_report = report
+        if report.summary():
+            print(Fore.YELLOW + "Context budget: dropped {}".format(report.summary()) + Style.RESET_ALL)
+        return rendered
     
     # Function that loads the user's useful inputs
     def load_advice(self):
@@ -337,20 +279,28 @@ class Machine():
         return context
 
     # Function that segments the users input and dispatches it to the appropriate processing function
+    @traced()
     def parse_user_input(self, input:str) -> bool:
+        if self.governor.exhausted():
+            print(Fore.YELLOW + "Robot: My token budget is spent, I will finish my current tasks and stop." + Style.RESET_ALL)
+            return False
         try:
             conversation = Conversation(ConversationType.LABELLING)
-            conversation.messages.append(Message(Role.SYSTEM, self.load_prompt('segment_input.txt')))
+            conversation.messages.append(self.prompt_message('segment_input.txt'))
             conversation.messages.append(Message(Role.USER, input))
 
-            completion = self.process(conversation.messages)
+            # Once local fast paths are preferred, the input is split into sentences without a completion
+            if self.governor.prefers_local():
+                completion = {"role": "assistant", "content": "\n".join(sentence for sentence in re.split(r"(?<=[.!?])\s+", input.strip()) if sentence)}
+            else:
+                completion = self.process(conversation.messages, conversation=conversation)
             if completion is None:
                 raise Exception("I failed to parse user input: {}".format(input))
             else:
                 list_of_sentences = completion['content'].split('\n')
                 try:
-                    for sentence in list_of_sentences:
-                        label = self.label(sentence, UserInputLabel)
+                    labels = self.label_all(list_of_sentences, UserInputLabel)
+                    for sentence, label in zip(list_of_sentences, labels):
                         self.process_tagged_input(label, sentence)
                 except Exception as e:
                     print(Fore.RED + "ERROR: {}".format(e) + Style.RESET_ALL)
@@ -363,6 +313,10 @@ class Machine():
             return False
     
     # Function that processes a sub-input resulted from the user's input based on their label.
+    @action("Process a sub-input resulted from the user's input based on its label.",
+            label="The label of the sub-input.",
+            sentence="The sub-input derived from the user's input.")
+    @traced()
     def process_tagged_input(self, label : UserInputLabel, sentence : str) -> None:
         if label == UserInputLabel.TASK:
             task = Task(TaskLabel.USER_INPUT, sentence)
@@ -405,68 +359,209 @@ class Machine():
         return
 
     # Generalized labelling function for any input
-    def label(self, input:str, tags:Label) -> Label:
+    # `fast` is False for inputs the fast-path classifier already declined
+    @traced()
+    def label(self, input:str, tags:Label, fast:bool=True) -> Label:
+        label, conversation = self.request_label(input, tags, fast)
+        if conversation is not None:
+            self.conversations.append(conversation)
+        return label
+
+    # Function that labels a list of inputs, returning the labels in the order of the inputs
+    # With LABEL_BATCHING, all inputs are labelled in a single completion and only the inputs
+    # that failed validation are labelled one by one. The fast-path classifier is consulted once per input.
+    @traced()
+    def label_all(self, inputs:list[str], tags:Label) -> list[Label]:
+        labels : list[Label] = [self.fast_label(input, tags) for input in inputs]
+        missing = [index for index, label in enumerate(labels) if label is None]
+        if LABEL_BATCHING and len(missing) > 1:
+            for index, label in zip(missing, self.label_batch([inputs[index] for index in missing], tags)):
+                labels[index] = label
+            missing = [index for index, label in enumerate(labels) if label is None]
+        for index, label in zip(missing, self.label_concurrently([inputs[index] for index in missing], tags, False)):
+            labels[index] = label
+        return labels
+
+    # Function that labels an input locally if the fast-path classifier is confident enough, otherwise returns None
+    def fast_label(self, input:str, tags:Label) -> Label:
+        if self.classifier is None:
+            return None
+        return self.classifier.fast_label(input, tags, BUDGET_FAST_LABEL_THRESHOLD if self.governor.prefers_local() else None)
+
+    # Function that labels a list of inputs in a single completion
+    # Inputs that did not receive a valid label are returned as None
+    @traced()
+    def label_batch(self, inputs:list[str], tags:Label) -> list[Label]:
+        labels : list[Label] = [None] * len(inputs)
+        schema = self.label_batch_schema(tags)
+
+        conversation = Conversation(ConversationType.LABELLING)
+        conversation.messages.append(self.prompt_message('label_inputs.txt'))
+        conversation.messages.append(Message(Role.USER, tags.get_prompt_content()))
+        conversation.messages.append(Message(Role.ASSISTANT, "OK, provide the texts to be labelled"))
+        conversation.messages.append(Message(Role.USER, "\n".join("{}: {}".format(index, input) for index, input in enumerate(inputs))))
+        completion = self.process(conversation.messages, [schema], True, conversation=conversation,
+                                  validate=lambda completion: self.valid_batch_labels(completion, len(inputs), tags))
+        if completion is None:
+            print(Fore.RED + "ERROR: I failed to think of labels for your inputs" + Style.RESET_ALL)
+        else:
+            conversation.messages.append(Message(Role.ASSISTANT, completion))
+            try:
+                entries = json.loads(completion["function_call"]["arguments"])["labels"]
+                for entry in entries:
+                    index = entry.get("index") if isinstance(entry, dict) else None
+                    if isinstance(index, int) and 0 <= index < len(inputs) and entry.get("label") in tags.__members__:
+                        labels[index] = tags[entry["label"]]
+                        if self.classifier is not None:
+                            self.classifier.learn(inputs[index], labels[index])
+            except (KeyError, TypeError, ValueError) as e:
+                print(Fore.RED + "ERROR: I assigned bad labels to your inputs: {}".format(e) + Style.RESET_ALL)
+        conversation.finish()
+        self.conversations.append(conversation)
+        return labels
+
+    # Function that returns whether a batched labelling completion assigns a valid label to every input
+    @staticmethod
+    def valid_batch_labels(completion:dict, count:int, tags:Label) -> bool:
+        try:
+            entries = json.loads(completion["function_call"]["arguments"])["labels"]
+            indices = {entry["index"] for entry in entries if entry.get("label") in tags.__members__}
+        except (KeyError, TypeError, ValueError, AttributeError):
+            return False
+        return indices == set(range(count))
+
+    # Function that returns the schema of the batched labelling function for a set of labels, built once per set
+    def label_batch_schema(self, tags:Label) -> dict:
+        if tags.__name__ not in self.label_batch_schemas:
+            schema = {
+                "name": "assign_labels",
+                "description": "Assign a label to every text provided by the user",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "labels": {
+                            "type": "array",
+                            "description": "One entry for every text provided by the user.",
+                            "items": {
+                                "type": "object",
+                                "properties": {
+                                    "index": {
+                                        "type": "integer",
+                                        "description": "The index of the labelled text"
+                                    },
+                                    "label": {
+                                        "type": "string",
+                                        "enum": list(tags.__members__.keys())
+                                    }
+                                },
+                                "required": ["index", "label"]
+                            }
+                        }
+                    },
+                    "required": ["labels"]
+                }
+            }
+            self.label_batch_schemas[tags.__name__] = schema
+        return self.label_batch_schemas[tags.__name__]
+
+    # Function that labels a list of inputs concurrently (at most LABEL_CONCURRENCY requests in flight)
+    # The labels and their conversations are returned in the order of the inputs
+    @traced()
+    def label_concurrently(self, inputs:list[str], tags:Label, fast:bool=True) -> list[Label]:
+        if LABEL_CONCURRENCY <= 1 or len(inputs) <= 1:
+            return [self.label(input, tags, fast) for input in inputs]
+        with ThreadPoolExecutor(max_workers=min(LABEL_CONCURRENCY, len(inputs))) as executor:
+            results = list(executor.map(tracer.propagate(lambda input: self.request_label(input, tags, fast)), inputs))
+        for _, conversation in results:
+            if conversation is not None:
+                self.conversations.append(conversation)
+        return [label for label, _ in results]
+
+    # Function that requests a label for an input without recording the conversation
+    # Inputs labelled by the fast-path classifier have no conversation, the classifier is skipped unless `fast`
+    @traced()
+    def request_label(self, input:str, tags:Label, fast:bool=True) -> tuple[Label, Conversation]:
+        label = self.fast_label(input, tags) if fast else None
+        if label is not None:
+            return label, None
+
         conversation = Conversation(ConversationType.LABELLING)
-        conversation.messages.append(Message(Role.SYSTEM, self.load_prompt('label_input.txt')))
+        conversation.messages.append(self.prompt_message('label_input.txt'))
         conversation.messages.append(Message(Role.USER, tags.get_prompt_content()))
         conversation.messages.append(Message(Role.ASSISTANT, "OK, provide the text to be labelled"))
         conversation.messages.append(Message(Role.USER, input))
         label = None
-        completion = self.process(conversation.messages)
+        completion = self.process(conversation.messages, conversation=conversation,
+                                  validate=lambda completion: completion.get('content') in tags.__members__)
         if completion is None:
             print(Fore.RED + "ERROR: I failed to think of a label for your input: {}".format(input) + Style.RESET_ALL)
         else:
             try:
                 label = getattr(tags, completion['content'])
                 conversation.messages.append(Message(Role.ASSISTANT, completion))
+                if self.classifier is not None:
+                    self.classifier.learn(input, label)
             except AttributeError as e:
                 print(Fore.RED + "ERROR: I assigned a bad label to your input: {}".format(e.args[0]) + Style.RESET_ALL)
                 pass
-
-        self.conversations.append(conversation)
-        return label
+        conversation.finish()
+        return label, conversation
     
     # Function that tries to think of a response to the input from general knowledge
+    @action("Think about the input and try to reason about it to find an answer.",
+            input="The input to reason about.")
+    @traced()
     def think(self, input:str) -> None:
         conversation = Conversation(ConversationType.CHAT)
         conversation.messages.append(Message(Role.USER, input))
-            
-        completion = self.process(conversation.messages)
+
+        if STREAM_COMPLETIONS:
+            print(Fore.YELLOW + "Robot: ", end="", flush=True)
+        completion = self.process(conversation.messages, stream=STREAM_COMPLETIONS, on_content=self.print_token, conversation=conversation)
         if completion is None:
             print(Fore.RED + "Robot: I have failed to think about your request '{}'.".format(input) + Style.RESET_ALL)
+        elif STREAM_COMPLETIONS:
+            print(Style.RESET_ALL)
         else:
             print(Fore.YELLOW + "Robot: {}".format(completion['content']) + Style.RESET_ALL)
         conversation.messages.append(Message(Role.ASSISTANT, completion['content']))
         self.conversations.append(conversation)
         return
 
+    # Function that prints a streamed token as soon as it arrives
+    @staticmethod
+    def print_token(token:str) -> None:
+        print(token, end="", flush=True)
+
     # Function that tries to recall information from the robot's memory
+    @action("Recall your knowledge of an object or location",
+            input="The description of the object or location to recall in an inquisitive format.")
+    @traced()
     def recall(self, input:str) -> bool:
-        schemas = [1, 3, 4, 5]
+        schemas = ["update_object", "load_environment_knowledge", "load_body_status", "load_activity_logs"]
 
         try:
             activity = Task(TaskLabel.COGNITION, input)
 
             conversation = Conversation(ConversationType.RECALLING)
-            conversation.messages.append(Message(Role.SYSTEM, self.load_prompt("question_about_context.txt")))
+            conversation.messages.append(self.prompt_message("question_about_context.txt"))
             conversation.messages.append(Message(Role.USER, input))
-            completion = self.process(conversation.messages, [self.cognitive_function_schemas[idx] for idx in schemas], True)
+            completion = self.process(conversation.messages, self.cognitive_registry.schemas(schemas), True, conversation=conversation)
             if completion is None:
                 raise Exception("I have failed to recall the required information")
             else:
                 function_name = completion["function_call"]["name"]
                 function_args : dict = json.loads(completion["function_call"]["arguments"])
 
-                function_to_call = self.cognitive_functions[function_name]
                 try:
-                    function_response = function_to_call(list(function_args.values())[0])
+                    function_response = FunctionDispatch(self.cognitive_functions).result(function_name, function_args)
                 except Exception as e:
                     raise Exception("I failed to execute the function for loading memory: {}".format(e.args[0]))
                 
                 conversation.messages.append(Message(Role.ASSISTANT_FUNCTION_CALL,
                                                     {"role": "function", "name": function_name, "content": function_response})) 
 
-            completion = self.process(conversation.messages)
+            completion = self.process(conversation.messages, conversation=conversation)
             if completion is None:
                 raise Exception("I have failed to recall the required information")
             
@@ -480,34 +575,73 @@ class Machine():
             self.task_stack.append(activity)
             return activity.status
     
+    # Function that returns whether a fused decision completion either signals DONE or holds a decision
+    @staticmethod
+    def valid_decision(completion:dict) -> bool:
+        try:
+            decision_args = json.loads(completion["function_call"]["arguments"])
+        except (KeyError, TypeError, ValueError):
+            return False
+        return isinstance(decision_args, dict) and (decision_args.get("done") is True or bool(decision_args.get("decision")))
+
     # Function that drives the robot to decide its next step in the sequence of actions
+    @traced()
     def make_decision(self, task_index: int) -> TaskStatus:
         try:
             activity = Task(TaskLabel.COGNITION, "Deciding what to do next...")
             activity.start()
             conversation = Conversation(ConversationType.DECIDING)
-            conversation.messages.append(Message(Role.SYSTEM, self.load_prompt("decision_making.txt")))
-            conversation.messages.append(Message(Role.USER, self.load_activity_logs()))
-            conversation.messages.append(Message(Role.USER, self.load_body_status()))
-            conversation.messages.append(Message(Role.USER, self.load_advice()))
-            conversation.messages.append(Message(Role.USER, "Your current goal: " + self.task_stack[task_index].goal))
+            system_message = self.prompt_message("decision_making.txt")
+            goal_message = Message(Role.USER, "Your current goal: " + self.task_stack[task_index].goal)
+            fixed_messages = [system_message, goal_message]
+            if FUSED_DECISION:
+                fixed_messages.append(self.prompt_message("decide_and_classify.txt"))
+            context = self.fit_context([
+                ContextSection("activity logs", "Task History:\n", self.activity_log_entries(), 3),
+                ContextSection.from_text("body status", self.load_body_status(), 2),
+                ContextSection.from_text("advice", self.load_advice(), 2)
+            ], fixed_messages, [self.decision_schema] if FUSED_DECISION else None)
 
+            conversation.messages.append(system_message)
+            for section in context:
+                conversation.messages.append(Message(Role.USER, section))
+            conversation.messages.append(goal_message)
 
             # Get the completion
-            completion = self.process(conversation.messages)
-            if completion is None:
-                raise Exception("I have failed to make a decision.")
-            elif "DONE" in completion['content']:
+            # With FUSED_DECISION, the decision, its label and the DONE signal come from a single function call
+            label = None
+            if FUSED_DECISION:
+                conversation.messages.append(fixed_messages[-1])
+                completion = self.process(conversation.messages, [self.decision_schema], True, conversation=conversation,
+                                          validate=self.valid_decision)
+                if completion is None:
+                    raise Exception("I have failed to make a decision.")
+                decision_args : dict = json.loads(completion["function_call"]["arguments"])
+                done = decision_args.get("done") is True
+                decision = decision_args.get("decision") or ""
+                if decision_args.get("label") in TaskLabel.__members__ and decision_args["label"] != TaskLabel.USER_INPUT.name:
+                    label = TaskLabel[decision_args["label"]]
+            else:
+                completion = self.process(conversation.messages, conversation=conversation)
+                if completion is None:
+                    raise Exception("I have failed to make a decision.")
+                done = "DONE" in completion['content']
+                decision = completion['content']
+
+            if done:
                 self.task_stack[task_index].complete("Done", True)
                 activity.complete("The task {} is complete".format(self.task_stack[task_index].goal), True)
+            elif not decision:
+                raise Exception("I have failed to make a decision.")
             else:
-                label = self.label(completion['content'], TaskLabel)
+                if label is None:
+                    label = self.label(decision, TaskLabel)
                 if label is None:
                     raise Exception("I have failed to classify my decision.")
                 else:
-                    activity.complete("Decision: {}".format(completion['content']), True)
+                    activity.complete("Decision: {}".format(decision), True)
                     self.task_stack.append(activity)
-                    self.task_stack.append(Task(label, completion['content']))
+                    self.task_stack.append(Task(label, decision))
                     conversation.messages.append(Message(Role.ASSISTANT, completion))
                     conversation.finish()
         except Exception as e:
@@ -520,24 +654,26 @@ class Machine():
 
     # Function that drives the robot to act on the task at hand.
     # If it does not end with a function call, it will append a new Function entry to the learning stack.
+    @traced()
     def act(self) -> bool:
         conclusion = None
         try:
             conversation = Conversation(ConversationType.ACTING)
             if self.task_stack[-1].type == TaskLabel.COGNITION:
-                conversation.messages.append(Message(Role.SYSTEM, self.load_prompt("question_about_context.txt")))
+                conversation.messages.append(self.prompt_message("question_about_context.txt"))
                 conversation.messages.append(Message(Role.USER, self.task_stack[-1].goal))
-                schemas = [2, 7]
-                completion = self.process(conversation.messages, [self.cognitive_function_schemas[idx] for idx in schemas], True)
+                schemas = ["recall", "think"]
+                dispatch = FunctionDispatch(self.cognitive_functions)
+                completion = self.process(conversation.messages, self.cognitive_registry.schemas(schemas), True,
+                                          stream=STREAM_COMPLETIONS, on_function_call=dispatch, conversation=conversation)
                 if completion is None:
                     raise Exception("I have failed to choose the correct action.")
                 else:
                     function_name = completion["function_call"]["name"]
                     function_args = json.loads(completion["function_call"]["arguments"])
 
-                    function_to_call = self.cognitive_functions[function_name]
                     try:
-                        function_response = function_to_call(list(function_args.values())[0])
+                        function_response = dispatch.result(function_name, function_args)
                     except Exception as e:
                         raise Exception("I failed to execute `{}` because: {}".format(function_name, e.args[0]))
                     
@@ -547,7 +683,7 @@ class Machine():
             elif self.task_stack[-1].type == TaskLabel.INQUIRY:
                 conversation.messages.append(Message(Role.SYSTEM, "You must formulate a question based on the user input."))
                 conversation.messages.append(Message(Role.USER, self.task_stack[-1].goal))
-                completion = self.process(conversation.messages)
+                completion = self.process(conversation.messages, conversation=conversation)
                 if completion is None:
                     raise Exception("I have failed to ask the user about '{}'.".format(self.task_stack[-1].goal))
                 else:
@@ -557,28 +693,51 @@ class Machine():
                 conclusion = self.task_stack[-1].conclusion
                 self.task_stack.pop()
             else:
-                conversation.messages.append(Message(Role.SYSTEM, self.load_prompt("act.txt")))
-                conversation.messages.append(Message(Role.USER, self.load_environment_knowledge()))
-                conversation.messages.append(Message(Role.USER, self.load_body_status()))
-                conversation.messages.append(Message(Role.USER, self.task_stack[-1].goal))
-                schemas = self.robot.actuator.manipulation_schemas if self.task_stack[-1].type == TaskLabel.MANIPULATION else self.robot.navigator.navigation_schemas
-                completion = self.process(conversation.messages, schemas, True)
-                if completion is None:
-                    raise Exception("I have failed to choose the correct action.")
+                component = self.robot.actuator if self.task_stack[-1].type == TaskLabel.MANIPULATION else self.robot.navigator
+                names = component.functions.feasible(known=self.object_knowledge) if SCHEMA_PRUNING else component.functions.names()
+                if not names:
+                    raise Exception("None of my actions can be performed in my current state.")
+                function_args = component.functions.infer_arguments(names[0], self.task_stack[-1].goal, self.object_knowledge) if len(names) == 1 else None
+                if function_args is not None:
+                    # The only feasible action is called directly when the goal determines its arguments
+                    try:
+                        function_response = FunctionDispatch(self.act_functions).result(names[0], function_args)
+                    except Exception as e:
+                        raise Exception("I failed to execute `{}` because: {}".format(names[0], e.args[0]))
+                    conversation.messages.append(Message(Role.ASSISTANT_FUNCTION_CALL,
+                                                         {"role": "function", "name": names[0], "content": function_response}))
+                    conclusion = function_response
                 else:
-                    if completion["function_call"]:
-                        function_name = completion["function_call"]["name"]
-                        function_args : dict = json.loads(completion["function_call"]["arguments"])
-                        function_to_call = self.act_functions[function_name]
-                        try:
-                            # print("Function called: " + function_name)
-                            # print("Provided arguments: " + str(function_args))
-                            function_response = function_to_call(**function_args)
-                        except Exception as e:
-                            raise Exception("I failed to execute `{}` because: {}".format(function_name, e.args[0]))
-                        conversation.messages.append(Message(Role.ASSISTANT_FUNCTION_CALL,
-                                                            {"role": "function", "name": function_name, "content": function_response}))
-                        conclusion : str = function_response 
+                    schemas = component.functions.schemas(names)
+                    system_message = self.prompt_message("act.txt")
+                    goal_message = Message(Role.USER, self.task_stack[-1].goal)
+                    context = self.fit_context([
+                        ContextSection("environment knowledge", "Object Memory\n", self.environment_knowledge_entries(goal=self.task_stack[-1].goal), 2),
+                        ContextSection.from_text("body status", self.load_body_status(), 3)
+                    ], [system_message, goal_message], schemas)
+                    conversation.messages.append(system_message)
+                    for section in context:
+                        conversation.messages.append(Message(Role.USER, section))
+                    conversation.messages.append(goal_message)
+                    dispatch = FunctionDispatch(self.act_functions)
+                    completion = self.process(conversation.messages, schemas, True, stream=STREAM_COMPLETIONS, on_function_call=dispatch, conversation=conversation)
+                    if completion is None:
+                        raise Exception("I have failed to choose the correct action.")
+                    else:
+                        if completion["function_call"]:
+                            function_name = completion["function_call"]["name"]
+                            function_args : dict = json.loads(completion["function_call"]["arguments"])
+                            if self.retriever is not None:
+                                self.retriever.observe([value for value in function_args.values() if isinstance(value, str)])
+                            try:
+                                # print("Function called: " + function_name)
+                                # print("Provided arguments: " + str(function_args))
+                                function_response = dispatch.result(function_name, function_args)
+                            except Exception as e:
+                                raise Exception("I failed to execute `{}` because: {}".format(function_name, e.args[0]))
+                            conversation.messages.append(Message(Role.ASSISTANT_FUNCTION_CALL,
+                                                                {"role": "function", "name": function_name, "content": function_response}))
+                            conclusion : str = function_response 
         except Exception as e:
             conclusion = "Error: " + e.args[0]
         finally:
@@ -591,17 +750,18 @@ class Machine():
         # self.learning_stack.append(Function(task.type, task.goal, task.goal_predicates))
         
     # Function that memorizes information in the robot's memory
+    @traced()
     def memorize(self, input:str) -> bool:
         try:
-            schemas = [0, 1]
+            schemas = ["memorize_object", "update_object"]
             activity = Task(TaskLabel.COGNITION, input)
 
             conversation = Conversation(ConversationType.MEMORIZING)
-            conversation.messages.append(Message(Role.SYSTEM, self.load_prompt("memorize_object.txt")))
-            conversation.messages.append(Message(Role.USER, self.load_environment_knowledge()))
+            conversation.messages.append(self.prompt_message("memorize_object.txt"))
+            conversation.messages.append(Message(Role.USER, self.load_environment_knowledge(goal=input)))
             conversation.messages.append(Message(Role.USER, input))
             
-            completion = self.process(conversation.messages, [self.cognitive_function_schemas[idx] for idx in schemas], True)
+            completion = self.process(conversation.messages, self.cognitive_registry.schemas(schemas), True, conversation=conversation)
 
             if completion is None:
                 raise Exception("I have failed to memorize this information: {}".format(input))
@@ -622,15 +782,27 @@ class Machine():
             self.task_stack.append(activity)
             return activity.status
 
+    @action("Memorize an object with all the attributes that you can extract from the user's input", parameters={
+        "type": "object",
+        "properties": OBJECT_PROPERTIES
+    })
     def memorize_object(self, object_attributes:dict):
-        self.object_knowledge.append(Object(object_attributes))
+        self.object_knowledge.add(Object(object_attributes))
         return "I have memorized this object."    
 
+    @action("Update the knowledge of an object with the attributes that you can extract from the user's input as well as the already known attributes existent in memory", parameters={
+        "type": "object",
+        "properties": {
+            **OBJECT_PROPERTIES,
+            "name": {
+                "type": "string",
+                "description": "The name of the object based on the name of the object that you recalled previously"
+            }
+        },
+        "required": ["name"]
+    })
     def update_object(self, object_attributes:dict):
-        object_of_interest = None
-        for object in self.object_knowledge:
-            if object.name == object_attributes["name"]:
-                object_of_interest = object
+        object_of_interest = self.object_knowledge.get(object_attributes["name"])
         if object_of_interest is None:
             return "I have failed to update the knowledge of this object."
         else:        
@@ -638,84 +810,222 @@ class Machine():
                 setattr(object_of_interest, attribute, object_attributes[attribute])
             return "I have updated the knowledge of this object."
      
+    # Error of the last failed completion requested by the calling thread
+    @property
+    def last_error(self) -> CompletionError:
+        return getattr(self.errors, "error", None)
+
+    @last_error.setter
+    def last_error(self, error: CompletionError):
+        self.errors.error = error
+
     # Function that calls for either completions or function calls
     # If it succeeds, it returns the completion or function call
-    # If it fails, it returns None
-    def process(self, messages: list[Message], function_library: list[dict] = None, must_call: bool = False) -> dict:
-        for iteration in range(int(MAX_RETRIES)):
+    # If it fails, it returns None and the reason is available in `last_error` for the calling thread
+    # Failed requests are retried following the retry policy, fatal errors are not retried
+    # When streaming, text is forwarded to `on_content` as it arrives and the function call is dispatched
+    # to `on_function_call` as soon as its arguments are complete
+    # The model, tokens, latency and retries of every call are recorded. Every request sent is billed to the token
+    # budget, the token quota of the conversation and the rate limiter as soon as it completes, including hedged
+    # requests that lost and requests abandoned at the deadline, which get records of their own
+    # Completions are cached only once `validate` accepted them, and never for acting conversations, whose
+    # function calls move the robot and must not be replayed without asking the model
+    @traced()
+    def process(self, messages: list[Message], function_library: list[dict] = None, must_call: bool = False,
+                stream: bool = False, on_content: Callable = None, on_function_call: Callable = None,
+                conversation: Conversation = None, validate: Callable[[dict], bool] = None) -> dict:
+        start_time = time.monotonic()
+        record = CompletionRecord(conversation.type.value if conversation is not None else "Unknown", timestamp=time.time())
+        priority = PRIORITIES.get(conversation.type, 1) if conversation is not None else 1
+        cacheable = conversation is None or conversation.type != ConversationType.ACTING
+        closed = threading.Event()
+        completion = self.request_completion(messages, function_library, must_call, stream, on_content, on_function_call, record, priority,
+                                             validate, cacheable, conversation, closed)
+        with self.accounting_lock:
+            closed.set()
+        record.success = completion is not None
+        if self.telemetry is not None:
+            self.telemetry.finish(record, start_time)
+        tracer.annotate(type=record.type, model=record.model, prompt_tokens=record.prompt_tokens, completion_tokens=record.completion_tokens,
+                        retries=record.retries, finish_reason=record.finish_reason, cached=record.cached)
+        return completion
+
+    def request_completion(self, messages: list[Message], function_library: list[dict], must_call: bool,
+                           stream: bool, on_content: Callable, on_function_call: Callable, record: CompletionRecord,
+                           priority: int = 1, validate: Callable[[dict], bool] = None, cacheable: bool = True,
+                           conversation: Conversation = None, closed: threading.Event = None) -> dict:
+        closed = closed if closed is not None else threading.Event()
+        contents = [message.content for message in messages]
+        prompt_tokens = self.num_tokens_from_messages(messages, function_library)
+        model = CHATGPT_MODEL if prompt_tokens < CHATGPT_CONTEXT_FRAME or not self.governor.allows_extended_model() else CHATGPT_MODEL_EXTENDED
+        record.model = model
+
+        cache_key = None
+        if self.cache is not None and cacheable:
+            cache_key = self.cache.key(model, contents, function_library)
+            cached_completion = self.cache.get(cache_key)
+            if cached_completion is not None:
+                record.cached = True
+                record.finish_reason = "function_call" if cached_completion.get("function_call") else "stop"
+                if stream:
+                    replay_message(cached_completion, on_content, on_function_call)
+                return cached_completion
+
+        policy = self.retry_policy
+        start_time = time.monotonic()
+        reason = None
+        for iteration in range(policy.max_retries):
+            record.retries = iteration
             try:
-                if function_library is None:
-                    model = CHATGPT_MODEL if self.num_tokens_from_messages(messages) < CHATGPT_CONTEXT_FRAME else CHATGPT_MODEL_EXTENDED
-                    completion = openai.ChatCompletion.create(model=model, messages=[message.content for message in messages])
+                if stream:
+                    remaining = policy.remaining(start_time)
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError("The request deadline was exceeded")
+                    reserved = self.acquire_rate_limit(prompt_tokens, priority, remaining)
+                    accumulator = StreamAccumulator(on_content, on_function_call)
+                    try:
+                        for chunk in self.backend.stream(model, contents, function_library, remaining):
+                            accumulator.feed(chunk)
+                            remaining = policy.remaining(start_time)
+                            if remaining is not None and remaining <= 0 and not accumulator.dispatched:
+                                raise TimeoutError("The request deadline was exceeded")
+                    except Exception:
+                        # Once its function call is dispatched, the stream is kept as received so far
+                        if not accumulator.dispatched:
+                            self.settle_rate_limit(reserved, 0)
+                            raise
+                    completion = accumulator.completion()
+                    self.charge_attempt(completion, prompt_tokens, reserved, record, conversation, closed, time.monotonic())
+                    # A dispatched function call has already been acted upon and must not be retried
+                    if accumulator.dispatched:
+                        return self.cache_completion(cache_key, completion["choices"][0]["message"], validate)
                 else:
-                    model = CHATGPT_MODEL if self.num_tokens_from_messages(messages, function_library) < CHATGPT_CONTEXT_FRAME else CHATGPT_MODEL_EXTENDED
-                    completion = openai.ChatCompletion.create(model=model, messages=[message.content for message in messages], functions=function_library)
-                    
+                    # Every request sent, hedged or not, reserves and bills its own tokens
+                    def send():
+                        sent = time.monotonic()
+                        reserved = self.acquire_rate_limit(prompt_tokens, priority, policy.remaining(start_time))
+                        try:
+                            completion = self.backend.create(model, contents, function_library, timeout=policy.remaining(start_time))
+                        except Exception:
+                            self.settle_rate_limit(reserved, 0)
+                            raise
+                        self.charge_attempt(completion, prompt_tokens, reserved, record, conversation, closed, sent)
+                        return completion
+                    completion = policy.call(send, policy.remaining(start_time), hedge=self.governor.tier == BudgetTier.NORMAL)
+                    record.finish_reason = completion["choices"][0]["finish_reason"]
+
                 finish_reason = completion["choices"][0]["finish_reason"]
                 if finish_reason == "stop":
-                    return completion["choices"][0]["message"]
+                    return self.cache_completion(cache_key, completion["choices"][0]["message"], validate)
                 elif finish_reason == "function_call":
                     try:
                         json.loads(completion["choices"][0]["message"]["function_call"]["arguments"])
                     except json.JSONDecodeError:
-                        print(Fore.RED + "Error: Getting completion ({}/{}) failed with reason: Faulty JSON object returned.".format(iteration + 1, MAX_RETRIES) + Style.RESET_ALL)
+                        reason = "Faulty JSON object returned."
+                        print(Fore.RED + "Error: Getting completion ({}/{}) failed with reason: {}".format(iteration + 1, policy.max_retries, reason) + Style.RESET_ALL)
                         continue
-                    return completion["choices"][0]["message"]
+                    return self.cache_completion(cache_key, completion["choices"][0]["message"], validate)
                 elif must_call:
-                    print(Fore.RED + "Error: Getting completion ({}/{}) failed with reason: Expected function call.".format(iteration + 1, MAX_RETRIES) + Style.RESET_ALL)
+                    reason = "Expected function call."
+                    print(Fore.RED + "Error: Getting completion ({}/{}) failed with reason: {}".format(iteration + 1, policy.max_retries, reason) + Style.RESET_ALL)
                 else:
-                    return completion["choices"][0]["message"]
+                    return self.cache_completion(cache_key, completion["choices"][0]["message"], validate)
             except Exception as e:
-                print(Fore.RED + "Error: Getting completion ({}/{}) failed with reason: {}".format(iteration + 1, MAX_RETRIES, e) + Style.RESET_ALL)
-                if not function_library:
-                    continue
-                else:
-                    exit(0)
+                reason = str(e)
+                print(Fore.RED + "Error: Getting completion ({}/{}) failed with reason: {}".format(iteration + 1, policy.max_retries, e) + Style.RESET_ALL)
+                if not policy.is_retryable(e):
+                    self.last_error = CompletionError(reason, False, iteration + 1)
+                    return None
+                if iteration + 1 < policy.max_retries:
+                    delay = policy.delay(iteration)
+                    remaining = policy.remaining(start_time)
+                    if remaining is not None and remaining <= delay:
+                        break
+                    time.sleep(delay)
+        self.last_error = CompletionError(reason, True, policy.max_retries)
         return None
 
+    # Function that returns the prompt and completion tokens of a completion
+    # The usage reported by the API is used when available, otherwise the tokens are counted locally
+    @staticmethod
+    def completion_usage(completion: dict, prompt_tokens: int) -> tuple[int, int]:
+        usage = completion.get("usage")
+        if usage:
+            return (usage["prompt_tokens"], usage["completion_tokens"])
+        return (prompt_tokens, message_tokens(completion["choices"][0]["message"]))
+
+    # Function that bills a completed request to the token budget, the conversation and the rate limiter
+    # The tokens are added to the record of the call while it is open. A request completing after its call
+    # returned (a hedge that lost or a request abandoned at the deadline) is recorded on its own.
+    def charge_attempt(self, completion: dict, prompt_tokens: int, reserved: int, record: CompletionRecord,
+                       conversation: Conversation, closed: threading.Event, sent: float):
+        tokens = self.completion_usage(completion, prompt_tokens)
+        self.settle_rate_limit(reserved, sum(tokens))
+        self.governor.spend(sum(tokens))
+        with self.accounting_lock:
+            if conversation is not None:
+                conversation.token_quota += sum(tokens)
+            if not closed.is_set():
+                record.finish_reason = completion["choices"][0]["finish_reason"]
+                record.prompt_tokens += tokens[0]
+                record.completion_tokens += tokens[1]
+                return
+        if self.telemetry is not None:
+            late = CompletionRecord(record.type, record.model, tokens[0], tokens[1], retries=record.retries,
+                                    finish_reason="abandoned", timestamp=time.time())
+            self.telemetry.finish(late, sent)
+
+    # Function that waits for the rate limiter before a request is sent and returns the tokens reserved for it
+    def acquire_rate_limit(self, prompt_tokens: int, priority: int, remaining: float) -> int:
+        if self.rate_limiter is None:
+            return 0
+        tokens = prompt_tokens + RATE_LIMIT_COMPLETION_TOKENS
+        with tracer.span("RateLimiter.acquire", priority=priority, tokens=tokens):
+            if not self.rate_limiter.acquire(tokens, priority, remaining):
+                raise TimeoutError("The rate limit was not acquired before the request deadline")
+        return tokens
+
+    # Function that returns the difference between the tokens reserved for a request and its actual usage
+    def settle_rate_limit(self, reserved: int, tokens: int):
+        if self.rate_limiter is not None and reserved:
+            self.rate_limiter.adjust(tokens - reserved)
+
+    # Function that stores a completion in the completion cache if it is accepted by `validate`, and returns it
+    def cache_completion(self, cache_key: str, completion: dict, validate: Callable[[dict], bool] = None) -> dict:
+        if self.cache is not None and cache_key is not None and (validate is None or validate(completion)):
+            self.cache.put(cache_key, completion)
+        return completion
+
     def load_prompt(self, prompt_name:str) -> str:
-        for root, dirs, files in os.walk(PROMPT_PATH):
-            for name in files:
-                if prompt_name == name:
-                    prompt_location = os.path.abspath(os.path.join(root, name))
-                    try:
-                        with open(prompt_location, "r") as f:
-                            prompt = f.read()
-                            f.flush()
-                        return prompt
-                    except OSError as e:
-                        print(Fore.RED + "Error: Prompt {} could not be loaded with reason: {}".format(prompt_name, e.args[0]) + Style.RESET_ALL)
-                        return None
-        print(Fore.RED + "Error: Prompt {} not found following path:\n {}".format(prompt_name, os.path.abspath(os.path.join(root, name))) + Style.RESET_ALL)
-    
+        return self.prompts.get(prompt_name)
+
+    # Function that returns a system message holding a prompt, counted with the token count indexed with the prompt
+    def prompt_message(self, prompt_name:str) -> Message:
+        prompt = self.prompts.lookup(prompt_name)
+        return Message(Role.SYSTEM, prompt.text if prompt is not None else None, prompt.token_count if prompt is not None else None)
+
     # Function that returns the number of tokens used by a list of messages and optionally a list of functions
-    # Inspired from: https://platform.openai.com/docs/guides/gpt/managing-tokens
+    # Message token counts are memoized on creation and schema token counts are computed once per schema
     @staticmethod
     def num_tokens_from_messages(messages:list[Message], functions:list[dict]=None) -> int:
         """Returns the number of tokens used by a list of messages."""
-        try:
-            encoding = tiktoken.encoding_for_model(CHATGPT_MODEL)
-        except KeyError:
-            encoding = tiktoken.get_encoding("cl100k_base")
         if CHATGPT_MODEL == "gpt-3.5-turbo-0613":  # note: future models may deviate from this
-            num_tokens = 0
-            for message in messages:
-                num_tokens += 4  # every message follows <im_start>{role/name}\n{content}<im_end>\n
-                for key ,value in message.content.items():
-                    num_tokens += len(encoding.encode(value))
-                    if key == "name":  # if there's a name, the role is omitted
-                        num_tokens += -1  # role is always required and always 1 token
+            if isinstance(messages, MessageList):
+                num_tokens = messages.num_tokens
+            else:
+                num_tokens = sum(message.token_count for message in messages)
             num_tokens += 2  # every reply is primed with <im_start>assistant
 
             # I dont know if this is 100% accurate, but it should be close enough
             if functions is not None:
                 for function in functions:
-                    num_tokens += len(encoding.encode(json.dumps(function)))
+                    num_tokens += schema_tokens(function)
             return num_tokens
         else:
             raise NotImplementedError(f"""num_tokens_from_messages() is not presently implemented for model {CHATGPT_MODEL}.
         See https://github.com/openai/openai-python/blob/main/chatml.md for information on how messages are converted to tokens.""")
 
+    @traced()
     def step(self):
         # Read from most recent to oldest
         if self.task_stack:
@@ -731,8 +1041,15 @@ class Machine():
                     else: 
                         print(Fore.RED + "Error: Decision making failed. Retrying..." + Style.RESET_ALL)
                         break
+        # The changes of the turn are persisted in a single transaction
+        if self.memory is not None:
+            self.memory.save(self)
         return 
     
+    # Function that returns whether the token budget is spent and every task is finished, so the machine can close
+    def finished(self) -> bool:
+        return self.governor.exhausted() and all(task.status in (TaskStatus.COMPLETED, TaskStatus.FAILED) for task in self.task_stack)
+
     def fill_memory_with_objects(self, objects:list[Object], basic_knowledge:bool=False):
         for object in objects:
             if basic_knowledge:
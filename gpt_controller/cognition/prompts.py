@@ -0,0 +1,88 @@
+from gpt_controller.util.tokens import count_tokens
+from gpt_controller.config import *
+from colorama import Fore, Style
+from dataclasses import dataclass
+import threading
+import time
+import os
+
+@dataclass
+class Prompt:
+    name : str
+    location : str
+    text : str
+    token_count : int
+    modified_time : float
+    checked_time : float
+
+# Registry of the prompt files, indexed once and kept in memory
+# Edited prompts are picked up by checking their modification time at most every `reload_interval` seconds
+class PromptRegistry():
+
+    def __init__(self, path: str = PROMPT_PATH, reload_interval: float = PROMPT_RELOAD_INTERVAL, required: list[str] = None):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.prompts : dict[str, Prompt] = {}
+        self.lock = threading.Lock()
+        self.index()
+        if required is not None:
+            self.require(required)
+
+    # Function that indexes every prompt file under the prompt path
+    def index(self):
+        prompts : dict[str, Prompt] = {}
+        for root, dirs, files in os.walk(self.path):
+            dirs.sort()
+            for name in sorted(files):
+                if name not in prompts:
+                    prompt = self.read(name, os.path.abspath(os.path.join(root, name)))
+                    if prompt is not None:
+                        prompts[name] = prompt
+        with self.lock:
+            self.prompts = prompts
+
+    # Function that fails if any of the prompts is missing
+    def require(self, names: list[str]):
+        missing = [name for name in names if name not in self.prompts]
+        if missing:
+            raise Exception("Prompts {} not found following path: {}".format(", ".join(missing), os.path.abspath(self.path)))
+
+    def get(self, name: str) -> str:
+        prompt = self.lookup(name)
+        return prompt.text if prompt is not None else None
+
+    def lookup(self, name: str) -> Prompt:
+        prompt = self.prompts.get(name)
+        if prompt is None:
+            print(Fore.RED + "Error: Prompt {} not found following path:\n {}".format(name, os.path.abspath(self.path)) + Style.RESET_ALL)
+            return None
+        if self.reload_interval is not None and time.monotonic() - prompt.checked_time >= self.reload_interval:
+            prompt = self.refresh(prompt)
+        return prompt
+
+    # Function that reloads a prompt if its file changed since it was read
+    def refresh(self, prompt: Prompt) -> Prompt:
+        try:
+            modified_time = os.path.getmtime(prompt.location)
+        except OSError:
+            prompt.checked_time = time.monotonic()
+            return prompt
+        if modified_time != prompt.modified_time:
+            reloaded = self.read(prompt.name, prompt.location)
+            if reloaded is not None:
+                with self.lock:
+                    self.prompts[prompt.name] = reloaded
+                return reloaded
+        prompt.checked_time = time.monotonic()
+        return prompt
+
+    @staticmethod
+    def read(name: str, location: str) -> Prompt:
+        try:
+            modified_time = os.path.getmtime(location)
+            with open(location, "r") as f:
+                text = f.read()
+        except OSError as e:
+            print(Fore.RED + "Error: Prompt {} could not be loaded with reason: {}".format(name, e.args[0]) + Style.RESET_ALL)
+            return None
+        return Prompt(name, location, text, count_tokens(text), modified_time, time.monotonic())
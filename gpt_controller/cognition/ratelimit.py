@@ -0,0 +1,110 @@
+from gpt_controller.config import *
+from contextlib import contextmanager
+import itertools
+import threading
+import heapq
+import json
+import time
+import os
+
+try:
+    import fcntl
+except ImportError:  # the limiter is only shared between threads where file locks are not available
+    fcntl = None
+
+# Token-bucket rate limiter covering requests per minute and tokens per minute
+# With a `path`, the buckets live in a file guarded by a file lock and are shared by every process using it.
+# Within a process, waiting requests are served by priority (lowest first), then in arrival order.
+class RateLimiter():
+
+    def __init__(self, requests_per_minute: int = RATE_LIMIT_RPM, tokens_per_minute: int = RATE_LIMIT_TPM,
+                 path: str = RATE_LIMIT_PATH):
+        self.capacities = {"requests": requests_per_minute, "tokens": tokens_per_minute}
+        self.path = path if fcntl is not None else None
+        self.state = {name: [capacity, time.time()] for name, capacity in self.capacities.items()}
+        self.condition = threading.Condition()
+        self.queue : list[tuple[int, int]] = []
+        self.counter = itertools.count()
+        self.waited : float = 0.0
+        if self.path is not None and os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+    # Function that waits until a request of `tokens` tokens can be sent, returns False if `timeout` expires first
+    def acquire(self, tokens: int, priority: int = 0, timeout: float = None) -> bool:
+        tokens = min(tokens, self.capacities["tokens"])
+        ticket = (priority, next(self.counter))
+        start_time = time.monotonic()
+        with self.condition:
+            heapq.heappush(self.queue, ticket)
+            try:
+                while True:
+                    wait = None
+                    if self.queue[0] == ticket:
+                        wait = self.take(tokens)
+                        if wait == 0:
+                            return True
+                    if timeout is not None:
+                        remaining = timeout - (time.monotonic() - start_time)
+                        if remaining <= 0:
+                            return False
+                        wait = remaining if wait is None else min(wait, remaining)
+                    self.condition.wait(wait)
+            finally:
+                self.queue.remove(ticket)
+                heapq.heapify(self.queue)
+                self.waited += time.monotonic() - start_time
+                self.condition.notify_all()
+
+    # Function that corrects the tokens taken for a request once its actual usage is known
+    def adjust(self, tokens: int):
+        with self.condition:
+            with self.shared_state() as state:
+                level = state["tokens"][0] - tokens
+                state["tokens"][0] = min(level, self.capacities["tokens"])
+
+    # Function that takes a request and its tokens from the buckets if they are available
+    # Returns 0 on success, otherwise the time (in seconds) until they will be
+    def take(self, tokens: int) -> float:
+        with self.shared_state() as state:
+            now = time.time()
+            for name, capacity in self.capacities.items():
+                level, updated = state[name]
+                state[name] = [min(capacity, level + max(now - updated, 0) * capacity / 60), now]
+            wait = max((1 - state["requests"][0]) * 60 / self.capacities["requests"],
+                       (tokens - state["tokens"][0]) * 60 / self.capacities["tokens"], 0)
+            if wait == 0:
+                state["requests"][0] -= 1
+                state["tokens"][0] -= tokens
+            return wait
+
+    # Context manager that yields the state of the buckets, read from and written back to the shared file if any
+    @contextmanager
+    def shared_state(self):
+        if self.path is None:
+            yield self.state
+            return
+        with open(self.path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                state = self.read_state()
+                yield state
+                with open(self.path, "w") as f:
+                    json.dump(state, f)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def read_state(self) -> dict:
+        try:
+            with open(self.path, "r") as f:
+                state = json.load(f)
+            if all(name in state for name in self.capacities):
+                return state
+        except (OSError, ValueError):
+            pass
+        return {name: [capacity, time.time()] for name, capacity in self.capacities.items()}
+
+    def stats(self) -> dict:
+        with self.condition:
+            with self.shared_state() as state:
+                levels = {name: round(level, 1) for name, (level, updated) in state.items()}
+            return {"capacities": dict(self.capacities), "levels": levels, "queued": len(self.queue), "waited": round(self.waited, 3)}
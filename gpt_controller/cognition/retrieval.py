@@ -0,0 +1,134 @@
+from gpt_controller.util.models import Object
+from gpt_controller.util.store import ObjectStore
+from gpt_controller.config import *
+from enum import Enum
+import threading
+import math
+import re
+
+# Attributes describing an object in its retrieval document, with the weight of their terms
+DOCUMENT_ATTRIBUTES = {"name": 3, "color": 1, "shape": 1, "material": 1, "container": 1, "support_surface": 1}
+
+# Function that returns the words of a text
+def words(text: str) -> list[str]:
+    return re.findall(r"[a-z0-9]+", text.lower().replace("_", " "))
+
+# Function that returns the terms of a text: its words and the character n-grams of its words
+def terms(text: str, ngram: int = RETRIEVAL_NGRAM) -> list[str]:
+    features = words(text)
+    for word in list(features):
+        padded = "#{}#".format(word)
+        features.extend(padded[index:index + ngram] for index in range(max(len(padded) - ngram + 1, 0)))
+    return features
+
+# Retrieves the objects of a store that are relevant to a goal using TF-IDF over local object documents
+# The inverted index is rebuilt only when the store changed, and a query only visits the postings of its terms.
+# Character n-grams only rank the objects: an object is relevant only if one of its words appears in the goal.
+# Recall is measured on the objects actually used by the actions: an object used but not retrieved is a miss.
+class ObjectRetriever():
+
+    def __init__(self, store: ObjectStore, k: int = RETRIEVAL_TOP_K, ngram: int = RETRIEVAL_NGRAM):
+        self.store = store
+        self.k = k
+        self.ngram = ngram
+        self.version : int = None
+        self.postings : dict[str, dict[str, float]] = {}
+        self.word_postings : dict[str, set[str]] = {}
+        self.idf : dict[str, float] = {}
+        self.lock = threading.Lock()
+
+        self.retrieved : set[str] = set()
+        self.hits : int = 0
+        self.misses : int = 0
+
+    def document(self, object: Object) -> dict[str, float]:
+        counts : dict[str, float] = {}
+        for attribute, weight in DOCUMENT_ATTRIBUTES.items():
+            value = getattr(object, attribute, None)
+            if value is None:
+                continue
+            for term in terms(value.value if isinstance(value, Enum) else str(value), self.ngram):
+                counts[term] = counts.get(term, 0) + weight
+        for capability in object.capabilities.members():
+            counts[capability.name.lower()] = counts.get(capability.name.lower(), 0) + 1
+        return counts
+
+    # Function that rebuilds the inverted index of normalised TF-IDF weights if the store changed
+    def index(self):
+        if self.version == self.store.version:
+            return
+        documents = {object.name: self.document(object) for object in self.store}
+        frequencies : dict[str, int] = {}
+        for counts in documents.values():
+            for term in counts:
+                frequencies[term] = frequencies.get(term, 0) + 1
+        idf = {term: math.log((1 + len(documents)) / (1 + frequency)) + 1 for term, frequency in frequencies.items()}
+        postings : dict[str, dict[str, float]] = {}
+        word_postings : dict[str, set[str]] = {}
+        for object in self.store:
+            for attribute in DOCUMENT_ATTRIBUTES:
+                value = getattr(object, attribute, None)
+                if value is not None:
+                    for word in words(value.value if isinstance(value, Enum) else str(value)):
+                        word_postings.setdefault(word, set()).add(object.name)
+        for name, counts in documents.items():
+            weights = {term: (1 + math.log(count)) * idf[term] for term, count in counts.items()}
+            norm = math.sqrt(sum(weight * weight for weight in weights.values())) or 1
+            for term, weight in weights.items():
+                postings.setdefault(term, {})[name] = weight / norm
+        self.idf = idf
+        self.postings = postings
+        self.word_postings = word_postings
+        self.version = self.store.version
+
+    # Function that returns the names of the known objects relevant to the goal ranked by relevance
+    def rank(self, goal: str) -> list[tuple[str, float]]:
+        with self.lock:
+            self.index()
+            relevant : set[str] = set()
+            for word in words(goal):
+                relevant |= self.word_postings.get(word, set())
+            query : dict[str, float] = {}
+            for term in terms(goal, self.ngram):
+                if term in self.idf:
+                    query[term] = query.get(term, 0) + self.idf[term]
+            scores : dict[str, float] = {}
+            for term, weight in query.items():
+                for name, document_weight in self.postings[term].items():
+                    if name in relevant:
+                        scores[name] = scores.get(name, 0) + weight * document_weight
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+    # Function that returns the `k` objects most relevant to the goal, followed by their containers and supports
+    # No object is returned when the goal names none of the known objects
+    def retrieve(self, goal: str, k: int = None) -> list[Object]:
+        k = k if k is not None else self.k
+        selected = [name for name, score in self.rank(goal)[:k]]
+        for name in list(selected):
+            object = self.store.get(name)
+            for related in (object.container, object.support_surface):
+                if related is not None and related not in selected and related in self.store:
+                    selected.append(related)
+        self.retrieved = set(selected)
+        return [self.store.get(name) for name in selected]
+
+    # Function that records whether the objects used by an action were among the retrieved objects
+    def observe(self, names: list[str]):
+        for name in names:
+            if name in self.store:
+                if name in self.retrieved:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+
+    # Function that returns the share of the given relevant objects found within the objects retrieved for the goal
+    def recall(self, goal: str, relevant: list[str], k: int = None) -> float:
+        if not relevant:
+            return 1.0
+        retrieved = {object.name for object in self.retrieve(goal, k)}
+        return sum(1 for name in relevant if name in retrieved) / len(relevant)
+
+    def stats(self) -> dict:
+        observed = self.hits + self.misses
+        return {"k": self.k, "objects": len(self.store), "hits": self.hits, "misses": self.misses,
+                "recall": self.hits / observed if observed else None}
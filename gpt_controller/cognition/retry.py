@@ -0,0 +1,111 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from gpt_controller.config import *
+from collections import deque
+from typing import Callable
+import openai
+import random
+import time
+
+RETRYABLE_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.APIError,
+    openai.error.Timeout,
+    openai.error.APIConnectionError,
+    openai.error.ServiceUnavailableError,
+    openai.error.TryAgain,
+    TimeoutError,
+    ConnectionError
+)
+
+# Failure of a completion after its retries, returned to the caller instead of ending the process
+class CompletionError(Exception):
+
+    def __init__(self, reason: str, retryable: bool, attempts: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retryable = retryable
+        self.attempts = attempts
+
+# Policy deciding how failed requests are retried
+# Retries back off exponentially with jitter and stop at the deadline of the call.
+# Once enough latencies were observed, a duplicate (hedged) request is sent when the first one
+# takes longer than the `hedge_percentile` latency, and the first response to arrive is used.
+# Requests that lose the race or outlive the deadline keep running in the pool: callers must bill them as they complete.
+class RetryPolicy():
+
+    def __init__(self, max_retries: int = MAX_RETRIES, base_delay: float = RETRY_BASE_DELAY,
+                 max_delay: float = RETRY_MAX_DELAY, jitter: float = RETRY_JITTER,
+                 deadline: float = REQUEST_DEADLINE, hedge_percentile: float = HEDGE_PERCENTILE,
+                 hedge_min_samples: int = HEDGE_MIN_SAMPLES):
+        self.max_retries = int(max_retries)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.deadline = deadline
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+
+        self.latencies : deque[float] = deque(maxlen=500)
+        self.hedges : int = 0
+        self.executor : ThreadPoolExecutor = None
+
+    @staticmethod
+    def is_retryable(error: Exception) -> bool:
+        return isinstance(error, RETRYABLE_ERRORS)
+
+    # Function that returns the delay before the retry following the failed `attempt` (starting at 0)
+    def delay(self, attempt: int) -> float:
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return delay * (1 - self.jitter * random.random())
+
+    # Function that returns the time left (in seconds) for a call started at `start_time`, None without deadline
+    def remaining(self, start_time: float) -> float:
+        if self.deadline is None:
+            return None
+        return self.deadline - (time.monotonic() - start_time)
+
+    # Function that returns the latency after which a hedged request is sent, None if hedging is not possible yet
+    def hedge_delay(self) -> float:
+        if self.hedge_percentile is None or len(self.latencies) < self.hedge_min_samples:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * self.hedge_percentile / 100))]
+
+    # Function that performs a request within the remaining time, hedging it if it is slow and `hedge` is set
+    def call(self, request: Callable[[], dict], remaining: float = None, hedge: bool = True) -> dict:
+        if remaining is not None and remaining <= 0:
+            raise TimeoutError("The request deadline was exceeded")
+        hedge_delay = self.hedge_delay() if hedge else None
+        # Without a hedge the request runs in the calling thread and its deadline is left to the request itself
+        if hedge_delay is None:
+            return self.timed(request)
+
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(thread_name_prefix="completion")
+        deadline = None if remaining is None else time.monotonic() + remaining
+        pending = {self.executor.submit(self.timed, request)}
+        hedged = hedge_delay is None
+        errors = []
+        while pending:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            if not hedged:
+                timeout = hedge_delay if timeout is None else min(hedge_delay, timeout)
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                errors.append(future.exception())
+            if not done:
+                # A wait ending on the deadline rather than on the hedge delay does not hedge
+                if hedged or (deadline is not None and time.monotonic() >= deadline):
+                    raise TimeoutError("The request deadline was exceeded")
+                hedged = True
+                self.hedges += 1
+                pending.add(self.executor.submit(self.timed, request))
+        raise errors[0]
+
+    def timed(self, request: Callable[[], dict]) -> dict:
+        start_time = time.monotonic()
+        response = request()
+        self.latencies.append(time.monotonic() - start_time)
+        return response
@@ -0,0 +1,112 @@
+from typing import Callable
+import json
+
+# Accumulates the chunks of a streamed completion into a completion in the OpenAI response format
+# Content tokens are forwarded to `on_content` as they arrive and the function call is dispatched
+# to `on_function_call` as soon as its arguments form a complete and valid JSON object.
+class StreamAccumulator():
+
+    def __init__(self, on_content: Callable[[str], None] = None, on_function_call: Callable[[str, dict], None] = None):
+        self.on_content = on_content
+        self.on_function_call = on_function_call
+
+        self.role : str = "assistant"
+        self.content : list[str] = []
+        self.function_name : str = None
+        self.arguments : list[str] = []
+        self.finish_reason : str = None
+        self.dispatched : bool = False
+
+        # Scanner state of the function call arguments, so every character is only inspected once
+        self.depth : int = 0
+        self.in_string : bool = False
+        self.escaped : bool = False
+
+    def feed(self, chunk: dict):
+        choice = chunk["choices"][0]
+        delta = choice.get("delta", {})
+        if delta.get("role"):
+            self.role = delta["role"]
+        if delta.get("content"):
+            self.content.append(delta["content"])
+            if self.on_content is not None:
+                self.on_content(delta["content"])
+        if delta.get("function_call"):
+            if delta["function_call"].get("name"):
+                self.function_name = delta["function_call"]["name"]
+            if delta["function_call"].get("arguments"):
+                self.feed_arguments(delta["function_call"]["arguments"])
+        if choice.get("finish_reason"):
+            self.finish_reason = choice["finish_reason"]
+
+    def feed_arguments(self, fragment: str):
+        self.arguments.append(fragment)
+        if self.dispatched:
+            return
+        closed = False
+        for character in fragment:
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif character == "\\":
+                    self.escaped = True
+                elif character == '"':
+                    self.in_string = False
+            elif character == '"':
+                self.in_string = True
+            elif character == "{":
+                self.depth += 1
+            elif character == "}":
+                self.depth -= 1
+                closed = closed or self.depth == 0
+        if closed and self.function_name is not None:
+            try:
+                arguments = json.loads("".join(self.arguments))
+            except json.JSONDecodeError:
+                return
+            self.dispatched = True
+            if self.on_function_call is not None:
+                self.on_function_call(self.function_name, arguments)
+
+    def message(self) -> dict:
+        message = {"role": self.role, "content": "".join(self.content) if self.content else None}
+        if self.function_name is not None:
+            message["function_call"] = {"name": self.function_name, "arguments": "".join(self.arguments)}
+        return message
+
+    def completion(self) -> dict:
+        return {"choices": [{"index": 0, "finish_reason": self.finish_reason, "message": self.message()}]}
+
+# Function that replays a complete message through the streaming callbacks
+def replay_message(message: dict, on_content: Callable[[str], None] = None, on_function_call: Callable[[str, dict], None] = None):
+    if message.get("content") and on_content is not None:
+        on_content(message["content"])
+    if message.get("function_call") and on_function_call is not None:
+        on_function_call(message["function_call"]["name"], json.loads(message["function_call"]["arguments"]))
+
+# Executes a function call at most once, either early while the completion is streamed or once it is complete
+# `invoke` receives the function and its arguments, so callers decide how the arguments are passed
+class FunctionDispatch():
+
+    def __init__(self, functions: dict[str, Callable], invoke: Callable[[Callable, dict], any] = None):
+        self.functions = functions
+        self.invoke = invoke if invoke is not None else lambda function, arguments: function(**arguments)
+        self.called : bool = False
+        self.response = None
+        self.error : Exception = None
+
+    def __call__(self, function_name: str, arguments: dict):
+        if self.called:
+            return
+        self.called = True
+        try:
+            self.response = self.invoke(self.functions[function_name], arguments)
+        except Exception as e:
+            self.error = e
+
+    # Function that returns the response of the function call, executing it if it was not dispatched yet
+    def result(self, function_name: str, arguments: dict):
+        self(function_name, arguments)
+        if self.error is not None:
+            raise self.error
+        return self.response
@@ -0,0 +1,115 @@
+from gpt_controller.config import *
+from dataclasses import dataclass, asdict
+from collections import deque
+import threading
+import json
+import math
+import time
+import os
+
+PERCENTILES = (50, 95, 99)
+
+# Record of one call to Machine.process
+@dataclass
+class CompletionRecord:
+    type : str
+    model : str = None
+    prompt_tokens : int = 0
+    completion_tokens : int = 0
+    latency : float = 0.0
+    retries : int = 0
+    finish_reason : str = None
+    cached : bool = False
+    success : bool = False
+    timestamp : float = 0.0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+# Function that returns the given percentile of a list of values using the nearest-rank method
+def percentile(values: list[float], rank: float) -> float:
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, math.ceil(len(values) * rank / 100) - 1))]
+
+# Collects a record of every completion and aggregates them per conversation type
+# Records are appended to `completions.jsonl` in `path` as they arrive, and the aggregates
+# can be written as Prometheus text with `export`.
+class Telemetry():
+
+    def __init__(self, path: str = TELEMETRY_PATH, max_records: int = TELEMETRY_MAX_RECORDS):
+        self.path = path
+        self.records : deque[CompletionRecord] = deque(maxlen=max_records)
+        self.lock = threading.Lock()
+
+    # Function that completes a record with its latency and stores it
+    def finish(self, record: CompletionRecord, start_time: float):
+        record.latency = time.monotonic() - start_time
+        with self.lock:
+            self.records.append(record)
+            if self.path is not None:
+                os.makedirs(self.path, exist_ok=True)
+                with open(os.path.join(self.path, "completions.jsonl"), "a") as f:
+                    f.write(json.dumps(asdict(record)) + "\n")
+
+    # Function that returns the aggregates of the records per conversation type
+    def summary(self) -> dict[str, dict]:
+        with self.lock:
+            records = list(self.records)
+        grouped : dict[str, list[CompletionRecord]] = {}
+        for record in records:
+            grouped.setdefault(record.type, []).append(record)
+
+        summary = {}
+        for type, group in grouped.items():
+            billed = [record for record in group if not record.cached]
+            latencies = [record.latency for record in billed]
+            tokens = [record.total_tokens for record in billed]
+            summary[type] = {
+                "calls": len(group),
+                "cached": len(group) - len(billed),
+                "failures": sum(1 for record in group if not record.success),
+                "retries": sum(record.retries for record in group),
+                "prompt_tokens": sum(record.prompt_tokens for record in billed),
+                "completion_tokens": sum(record.completion_tokens for record in billed),
+                "latency": {"p{}".format(rank): percentile(latencies, rank) for rank in PERCENTILES},
+                "tokens": {"p{}".format(rank): percentile(tokens, rank) for rank in PERCENTILES},
+                "models": sorted({record.model for record in group if record.model is not None})
+            }
+        return summary
+
+    # Function that returns the aggregates in the Prometheus text exposition format
+    def prometheus(self) -> str:
+        lines = [
+            "# HELP gpt_controller_completions_total Completions requested per conversation type.",
+            "# TYPE gpt_controller_completions_total counter"
+        ]
+        summary = self.summary()
+        for type, aggregates in summary.items():
+            lines.append('gpt_controller_completions_total{{type="{}"}} {}'.format(type, aggregates["calls"]))
+        for name, help in (("cached", "Completions served from the cache"), ("failures", "Completions that failed after their retries"),
+                           ("retries", "Retried completion attempts"), ("prompt_tokens", "Prompt tokens billed"),
+                           ("completion_tokens", "Completion tokens billed")):
+            lines.append("# HELP gpt_controller_{}_total {} per conversation type.".format(name, help))
+            lines.append("# TYPE gpt_controller_{}_total counter".format(name))
+            for type, aggregates in summary.items():
+                lines.append('gpt_controller_{}_total{{type="{}"}} {}'.format(name, type, aggregates[name]))
+        for name, unit in (("latency", "seconds"), ("tokens", "tokens")):
+            lines.append("# HELP gpt_controller_completion_{} Completion {} per conversation type.".format(name, unit))
+            lines.append("# TYPE gpt_controller_completion_{} summary".format(name))
+            for type, aggregates in summary.items():
+                for rank in PERCENTILES:
+                    lines.append('gpt_controller_completion_{}{{type="{}",quantile="{}"}} {}'.format(name, type, rank / 100, aggregates[name]["p{}".format(rank)]))
+        return "\n".join(lines) + "\n"
+
+    # Function that writes the aggregates as Prometheus text, by default to `metrics.prom` in `path`
+    def export(self, location: str = None):
+        if location is None:
+            if self.path is None:
+                return
+            os.makedirs(self.path, exist_ok=True)
+            location = os.path.join(self.path, "metrics.prom")
+        with open(location, "w") as f:
+            f.write(self.prometheus())
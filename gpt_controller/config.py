@@ -4,6 +4,118 @@ CHATGPT_MODEL = 'gpt-3.5-turbo-0613'
 CHATGPT_CONTEXT_FRAME = 8129 # Tokens
 CHATGPT_MODEL_EXTENDED = 'gpt-3.5-turbo-16k'
 
+# Token budget of the decision and acting prompts, leaving room for the reply within CHATGPT_CONTEXT_FRAME (default: CHATGPT_CONTEXT_FRAME - 1024)
+# Context sections such as activity logs and environment knowledge are trimmed to fit it instead of switching to CHATGPT_MODEL_EXTENDED
+CONTEXT_BUDGET = CHATGPT_CONTEXT_FRAME - 1024
+
+# Completion backend used by the machine (default: 'openai')
+# 'openai': live API, 'offline': replay cassettes and scripted responses, 'record': live API recorded into cassettes
+COMPLETION_BACKEND = 'openai'
+
+# Path to the cassette file used by the offline and record backends (default: './cassettes/session.json')
+CASSETTE_PATH = './cassettes/session.json'
+
+# Simulated latency of the offline backend per completion (in seconds) (default: 0)
+OFFLINE_LATENCY = 0
+
+# Simulated latency of the offline backend between streamed chunks (in seconds) (default: 0)
+OFFLINE_CHUNK_LATENCY = 0
+
+# Whether to stream completions, printing text as it arrives and dispatching function calls
+# as soon as their arguments are complete (default: False)
+STREAM_COMPLETIONS = False
+
+# Whether to cache completions of identical requests (default: True)
+COMPLETION_CACHE = True
+
+# Directory of the persistent completion cache, None keeps the cache in memory only (default: './cache/')
+COMPLETION_CACHE_PATH = './cache/'
+
+# Maximum number of completions kept in memory (default: 512)
+COMPLETION_CACHE_SIZE = 512
+
+# Maximum number of completions kept on disk (default: 10000)
+COMPLETION_CACHE_DISK_SIZE = 10000
+
+# How long a cached completion stays valid (in seconds), None to never expire (default: 86400)
+COMPLETION_CACHE_TTL = 86400
+
+# Maximum number of labelling requests in flight when labelling the sentences of one user input (default: 4)
+LABEL_CONCURRENCY = 4
+
+# Whether to label the sentences of one user input in a single completion (default: True)
+LABEL_BATCHING = True
+
+# Whether to label trivially classifiable inputs locally instead of requesting a completion (default: True)
+FAST_LABEL = True
+
+# Minimum confidence of the local classifier to skip the completion (default: 0.9)
+FAST_LABEL_THRESHOLD = 0.9
+
+# Number of previously labelled inputs that vote on the label of a new input (default: 5)
+FAST_LABEL_NEIGHBOURS = 5
+
+# Maximum number of previously labelled inputs remembered per label set (default: 1000)
+FAST_LABEL_MEMORY = 1000
+
+# Whether to decide on the next step and classify it in a single completion (default: True)
+FUSED_DECISION = True
+
+# Whether to offer only the actions whose preconditions hold in the current state of the robot,
+# calling the only feasible action directly when its arguments can be inferred from the goal (default: True)
+SCHEMA_PRUNING = True
+
+# Whether to only put the known objects relevant to the goal in the acting and memorizing prompts (default: True)
+RETRIEVAL = True
+
+# Number of most relevant objects retrieved for a goal, their containers and supports are added to them (default: 8)
+RETRIEVAL_TOP_K = 8
+
+# Length of the character n-grams used to match the goal with the objects (default: 3)
+RETRIEVAL_NGRAM = 3
+
+# Whether to rate limit the completions to stay within the limits of the API key (default: True)
+RATE_LIMIT = True
+
+# Requests per minute allowed by the API key (default: 3500)
+RATE_LIMIT_RPM = 3500
+
+# Tokens per minute allowed by the API key (default: 90000)
+RATE_LIMIT_TPM = 90000
+
+# File shared by all machines rate limited together, None to only share the limits between threads (default: './cache/ratelimit.json')
+RATE_LIMIT_PATH = './cache/ratelimit.json'
+
+# Number of completion tokens reserved for a request until its actual usage is known (default: 256)
+RATE_LIMIT_COMPLETION_TOKENS = 256
+
+# SQLite database where the memory of the machine is persisted between runs, None to keep it in memory only (default: None)
+PERSISTENCE_PATH = None
+
+# Number of most recent tasks kept in memory once persisted, older ones are read from the database on demand (default: 200)
+PERSISTENCE_TASK_WINDOW = 200
+
+# Number of most recent conversations kept in memory once persisted (default: 50)
+PERSISTENCE_CONVERSATION_WINDOW = 50
+
+# Whether to record the model, tokens, latency and retries of every completion (default: True)
+TELEMETRY = True
+
+# Directory where completion records and metrics are exported, None keeps them in memory only (default: './telemetry/')
+TELEMETRY_PATH = './telemetry/'
+
+# Maximum number of completion records kept in memory for the aggregates (default: 10000)
+TELEMETRY_MAX_RECORDS = 10000
+
+# Whether to record nested trace spans of the cognition loop, completions and robot functions (default: True)
+TRACING = True
+
+# Directory where traces are exported on exit as Chrome trace events and OTLP JSON (default: './traces/')
+TRACE_PATH = './traces/'
+
+# Maximum number of finished spans kept in memory (default: 100000)
+TRACE_MAX_SPANS = 100000
+
 # How long to idle until the machine closes (in seconds) (default: 120)
 IDLE_TIMEOUT = 120
 
@@ -13,16 +125,62 @@ IDLE_TIMEOUT = 120
 # Used in SELF_TRAIN mode, to determine if, once reaching the idle state, the environment should be reset or not
 # PERSISTENT_ENVIRONMENTS = False
 
-# TOKEN_LIMIT: Maximum number of tokens to use in one run of SELF_TRAIN mode
-# If the number of tokens exceeds this limit, the machine will memorize its output and close.
+# TOKEN_LIMIT: Maximum number of tokens to use in one run, None for no limit (default: 100000)
+# If the number of tokens exceeds this limit, the machine will stop accepting new tasks and close.
 # This is not a hard limit, but rather a soft one, as the machine will try to finish its current task set before closing.
-# TOKEN_LIMIT = 100000
+TOKEN_LIMIT = 100000
+
+# Fractions of TOKEN_LIMIT at which the machine stops using CHATGPT_MODEL_EXTENDED, shrinks its context,
+# prefers local fast paths and finally stops accepting new tasks (default: [0.5, 0.7, 0.85, 1.0])
+TOKEN_LIMIT_TIERS = [0.5, 0.7, 0.85, 1.0]
+
+# Fraction of CONTEXT_BUDGET used once the context is shrunk to save tokens (default: 0.5)
+BUDGET_CONTEXT_SCALE = 0.5
+
+# Minimum confidence of the local classifier to skip the completion once local fast paths are preferred (default: 0.6)
+BUDGET_FAST_LABEL_THRESHOLD = 0.6
 
 # Number of retries if a completion fails (eg. wrong/broken format) (default: 3)
 MAX_RETRIES=3
 
+# Base delay of the exponential backoff between retries of failed requests (in seconds) (default: 1)
+RETRY_BASE_DELAY=1
+
+# Maximum delay between retries of failed requests (in seconds) (default: 20)
+RETRY_MAX_DELAY=20
+
+# Fraction of the backoff delay that is randomized to spread out retries of concurrent requests (default: 0.5)
+RETRY_JITTER=0.5
+
+# Deadline of one completion including its retries (in seconds), None to wait indefinitely (default: 60)
+REQUEST_DEADLINE=60
+
+# Latency percentile after which a duplicate (hedged) request is sent, None to disable hedging (default: None)
+HEDGE_PERCENTILE=None
+
+# Number of observed latencies required before requests are hedged (default: 20)
+HEDGE_MIN_SAMPLES=20
+
 # Maximum context timespan (in seconds) (default: 120)
 MAX_TIMESPAN=120
 
 # Path to prompt files (default: /gpt_controller/chat_gpt_interface/*)
 PROMPT_PATH = './prompts/'
+
+# How often an edited prompt file is picked up (in seconds), None to never reload prompts (default: 2)
+PROMPT_RELOAD_INTERVAL = 2
+
+# Whether the geometry of the environment objects is held in a NumPy table when NumPy is installed (default: True)
+OBJECT_TABLE = True
+
+# Number of rows allocated by an object table up front, doubled whenever it is full (default: 1024)
+OBJECT_TABLE_CAPACITY = 1024
+
+# Edge length of the cells of the spatial index of the environment objects (in meters) (default: 1.0)
+SPATIAL_CELL_SIZE = 1.0
+
+# Maximum number of rendered descriptions of objects and robot components kept for the prompts (default: 10000)
+FRAGMENT_CACHE_SIZE = 10000
+
+# Maximum number of tasks kept in the activity log, the oldest being dropped first (default: 10000)
+ACTIVITY_LOG_SIZE = 10000
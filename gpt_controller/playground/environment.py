@@ -1,10 +1,16 @@
 from gpt_controller.util.models import *
+from gpt_controller.util.store import ObjectStore
+from gpt_controller.util.table import ObjectTable, np
+from gpt_controller.util.spatial import SpatialGrid
 import math
 
 class Environment:
-    objects : list[Object] = []
+    objects : ObjectStore = None
+    spatial : SpatialGrid = None
 
     def __init__(self, scene:str):
+        self.spatial = SpatialGrid()
+        self.objects = ObjectStore(table=ObjectTable() if OBJECT_TABLE and np is not None else None, spatial=self.spatial)
         self.create_object({"name" : "floor", "color" : "brown", "shape" : Shape.CUBOIDAL, "material" : Material.WOOD, "x" : 0, "y" : 0, "z" : 0, "length" : 100, "width" : 100, "height" : 1, "capabilities" : Capability.FIXED, "support_surface" : None})
 
         if scene == "kitchen":
@@ -18,8 +24,8 @@ class Environment:
     def put_object_in(self, object_name:str, container_name:str):
         container = self.get_object(container_name)
         object = self.get_object(object_name)
-        object.capabilities.remove(Capability.VISIBLE)
-        container.contains.append(object_name)
+        object.remove_capability(Capability.VISIBLE)
+        container.add_content(object_name)
         self.place_object_on(object_name, container_name)
         object.container = container_name
     
@@ -27,36 +33,79 @@ class Environment:
     # Both objects must exist
     def place_object_on(self, object_name:str, support_name:str):
         support = self.get_object(support_name)
-        for obj in self.objects:
-            if obj.name == object_name:
-                obj.x = support.x
-                obj.y = support.y
-                obj.z = support.z
-                obj.support_surface = support_name
-                return True
+        obj = self.get_object(object_name)
+        if obj is not None:
+            obj.x = support.x
+            obj.y = support.y
+            obj.z = support.z
+            obj.support_surface = support_name
+            return True
 
     # Get object instance by name
     def get_object(self, name:str):
-        for obj in self.objects:
-            if obj.name == name:
-                return obj
-        return None
+        return self.objects.get(name)
     
     def remove_object(self, name:str):
-        for obj in self.objects:
-            if obj.name == name:
-                self.objects.remove(obj)
-                return True
-        return False
+        return self.objects.remove(name)
+
+    # Get the objects within a distance of a location, nearest first
+    def objects_within(self, location:tuple[float, float, float], distance:float):
+        return self.spatial.within(location, distance)
+
+    # Get the objects within a distance of another object, nearest first
+    def objects_near(self, name:str, distance:float):
+        object = self.get_object(name)
+        if object is None:
+            return []
+        return [obj for obj in self.spatial.within((object.x, object.y, object.z), distance) if obj is not object]
+
+    # Get the `count` objects nearest to a location, optionally no further than a distance
+    def nearest_objects(self, location:tuple[float, float, float], count:int, distance:float=None):
+        return self.spatial.nearest(location, count, distance)
+
+    # Get the objects located in the box between two opposite corners
+    def objects_in_box(self, minimum:tuple[float, float, float], maximum:tuple[float, float, float]):
+        return self.spatial.box(minimum, maximum)
+
+    # Get the table of the objects of the environment, required by the batch queries below
+    # The batch queries return NumPy arrays with one entry per row of the table, turned into objects with `table.select`
+    def object_table(self) -> ObjectTable:
+        if self.objects.table is None:
+            raise Exception("Batch queries require NumPy and OBJECT_TABLE")
+        return self.objects.table
+
+    # Get the distances from a location to every object
+    def distances(self, location:tuple[float, float, float]):
+        return self.object_table().distances(location)
+
+    # Get the mask of the objects within a distance of a location
+    def reach_mask(self, location:tuple[float, float, float], distance:float):
+        return self.object_table().reach_mask(location, distance)
+
+    # Get the mask of the objects having a capability
+    def capability_mask(self, capability:Capability):
+        return self.object_table().capability_mask(capability)
+
+    # Get the mask of the objects placed on a support surface
+    def support_mask(self, support_name:str):
+        return self.object_table().support_mask(support_name)
+
+    # Get the mask of the objects stored in a container
+    def containment_mask(self, container_name:str):
+        return self.object_table().containment_mask(container_name)
+
+    # Get the visible objects within a distance of a location, nearest first
+    def get_visible_objects(self, location:tuple[float, float, float], distance:float):
+        return [obj for obj in self.spatial.within(location, distance) if obj.check_capability(Capability.VISIBLE)]
 
     def create_object(self, object_attributes:dict):
-        self.objects.append(Object(object_attributes))
+        self.objects.add(Object(object_attributes))
         return "I have memorized this object." 
     
     def create_object_slices(self, object_name:str):
         object = self.get_object(object_name)
         new_object = Object({
-            "name" : "slice of " + object.name,
+            "name" : "slice 1 of " + object.name,
             "color" : object.color,
             "shape" : object.shape,
             "material" : object.material,
@@ -67,7 +116,7 @@ class Environment:
             "contains" : object.contains
         })
         new_object_2 = Object({
-            "name" : "slice of " + object.name,
+            "name" : "slice 2 of " + object.name,
             "color" : object.color,
             "shape" : object.shape,
             "material" : object.material,
@@ -78,8 +127,8 @@ class Environment:
             "contains" : object.contains
         })
         self.remove_object(object_name)
-        self.objects.append(new_object)
-        self.objects.append(new_object_2)
+        self.objects.add(new_object)
+        self.objects.add(new_object_2)
 
     # Load a kitchen environment
     def load_kitchen(self):
@@ -153,9 +202,8 @@ class Environment:
         self.place_object_on("tomato", "table")
         self.place_object_on("potato", "table")
 
-        for obj in self.objects:
-            if obj.material == Material.OTHER:
-                obj.add_capability(Capability.CUTTABLE)
+        for obj in self.objects.find(material=Material.OTHER):
+            obj.add_capability(Capability.CUTTABLE)
 
     def load_workstation(self):
         
@@ -1,12 +1,31 @@
 import math
+import re
 from gpt_controller.util.models import *
+from gpt_controller.util.store import ObjectStore
+from gpt_controller.util.schemas import FunctionRegistry, action, precondition
+from gpt_controller.util.tracing import traced
 from gpt_controller.playground.environment import Environment
 
+# Function that returns the only candidate object named in the goal, None if no candidate or several are named
+def named_in_goal(goal: str, candidates: list[Object]) -> Object:
+    goal = goal.lower().replace("_", " ")
+    named = [candidate for candidate in candidates
+             if re.search(r"\b{}\b".format(re.escape(candidate.name.lower().replace("_", " "))), goal)]
+    return named[0] if len(named) == 1 else None
+
+# Function that returns the candidates whose names are in the knowledge of the machine, all of them without knowledge
+def known_only(candidates: list[Object], known: ObjectStore = None) -> list[Object]:
+    return list(candidates) if known is None else [candidate for candidate in candidates if candidate.name in known]
+
 class Robot():
+
+    # Changes with every change of the state of the component, so its description can be cached until it changes
+    version : int = 0
+
     def __init__(self, environment: Environment):
         self.actuator = Manipulator(environment)
-        self.vision = Vision(environment)
         self.navigator = Navigator(environment)
+        self.vision = Vision(environment, self.navigator)
 
     def __str__(self, attributes: dict[str, bool]):
         robot_status : str = ""
@@ -17,13 +36,6 @@ class Robot():
             robot_status += "{} : {}".format(attribute, 'unknown' if getattr(self, attribute) is None else getattr(self, attribute))
         return
     
-    def _generate_function_calls(self):
-        function_calls = {}
-        for method in dir(self):
-            if not method.startswith('_') and callable(getattr(self, method)):
-                function_calls[method] = getattr(self, method)
-        return function_calls
-    
     def verbose_description(self, attributes: list[str]=None):
         object_description : str = "Robot Status:" + "\n"
         if attributes is None:
@@ -44,52 +56,38 @@ class Robot():
             elif isinstance(value, dict):
                 continue
         return object_description
+
+    def __setattr__(self, attribute: str, value):
+        super().__setattr__(attribute, value)
+        if attribute != "version":
+            super().__setattr__("version", self.version + 1)
     
 class Vision(Robot):
 
-    def __init__(self, environment: Environment):
+    view_distance : float = 5.0 # m
+
+    # The head is carried by the base, so the vision looks from the location of the navigator
+    def __init__(self, environment: Environment, navigator: "Navigator" = None):
         self.environment = environment
-        self.function_calls = self._generate_function_calls()
-
-        self.vision_schemas = [
-            {
-                "name": "look_around_for_object",
-                "description": "Look around you for an object.",
-                "parameters": {
-                    "type" : "object",
-                    "properties": {
-                        "object_name": {
-                            "type": "string",
-                            "description": "The name of the object you are looking for."
-                        }
-                    }
-                }
-            },
-            {
-                "name": "search_in_container",
-                "description": "Search in a container for an object.",
-                "parameters": {
-                    "type" : "object",
-                    "properties": {
-                        "container_name": {
-                            "type": "string",
-                            "description": "The name of the container you are looking in."
-                        },
-                        "object_name": {
-                            "type": "string",
-                            "description": "The name of the object you are looking for."
-                        }
-                    }
-                }
-            }
-        ]
+        self.navigator = navigator
+        self.functions = FunctionRegistry(self)
+        self.function_calls = self.functions.select()
+        self.vision_schemas = self.functions.schemas()
 
+    @action("Look around you for an object.",
+            object_name="The name of the object you are looking for.")
+    @traced()
     def look_around_for_object(self, object_name:str):
-        for obj in self.environment.get_visible_objects(self.head_orientation):
+        location = (self.navigator.x, self.navigator.y, self.navigator.z) if self.navigator is not None else (0, 0, 0)
+        for obj in self.environment.get_visible_objects(location, self.view_distance):
             if obj.name == object_name:
                 return "I see the {}. Its on the {}".format(object_name, obj.support_surface)
         return "I don't see the around me {}.".format(object_name)
     
+    @action("Search in a container for an object.",
+            container_name="The name of the container you are looking in.",
+            object_name="The name of the object you are looking for.")
+    @traced()
     def search_in_container(self, container_name:str, object_name:str):
         for obj in self.environment.get_object(container_name).contains:
             if obj.name == object_name:
@@ -103,24 +101,14 @@ class Navigator(Robot):
 
     def __init__(self, environment: Environment):
         self.environment = environment
-        self.function_calls = self._generate_function_calls()
-
-        self.navigation_schemas = [
-            {
-                "name": "move_to_object",
-                "description": "Move to a point of interest.",
-                "parameters": {
-                    "type" : "object",
-                    "properties": {
-                        "name": {
-                            "type": "string",
-                            "description": "The name of the object to move to."
-                        }
-                    }
-                }
-            }
-        ]
+        self.functions = FunctionRegistry(self)
+        self.function_calls = self.functions.select()
+        self.navigation_schemas = self.functions.schemas()
 
+    @action("Move to a point of interest.",
+            name="The name of the object to move to.")
+    @precondition(None, infer="infer_destination")
+    @traced()
     def move_to_object(self, name:str):
         point_of_interest = self.environment.get_object(name)
         if point_of_interest is not None:
@@ -131,6 +119,10 @@ class Navigator(Robot):
         else:
             return "Error: I could not find the {}.".format(name)
 
+    def infer_destination(self, goal: str, known: ObjectStore = None) -> dict:
+        destination = named_in_goal(goal, known_only(self.environment.objects, known))
+        return {"name": destination.name} if destination is not None else None
+
 class Manipulator(Robot):
 
     # Gripper Information
@@ -146,83 +138,17 @@ class Manipulator(Robot):
 
     def __init__(self, environment: Environment):
         self.environment = environment
-        self.function_calls = self._generate_function_calls()
-
-        self.manipulation_schemas = [
-            {
-                "name": "pick_up_object",
-                "description": "Pick up an object. Fails if the object is too heavy or too far away.",
-                "parameters": {
-                    "type" : "object",
-                    "properties": {
-                        "object_name": {
-                            "type": "string",
-                            "description": "The name of the object to pick up."
-                        }
-                    }
-                }
-            },
-            {
-                "name": "place_object",
-                "description": "Place an object on a support surface. Fails if the object is too far away.",
-                "parameters": {
-                    "type" : "object",
-                    "properties": {
-                        "object_name": {
-                            "type": "string",
-                            "description": "The name of the object to place."
-                        },
-                        "support_surface": {
-                            "type": "string",
-                            "description": "The name of the support surface to place the object on."
-                        }
-                    }
-                }
-            },
-            {
-                "name": "cut_object",
-                "description": "Cut an object using the object equipped in the gripper. Fails if the object is too far away or the object is not cuttable.",
-                "parameters": {
-                    "type" : "object",
-                    "properties": {
-                        "object_name": {
-                            "type": "string",
-                            "description": "The name of the object to cut."
-                        }
-                    }
-                }
-            },
-            {
-                "name": "put_object_in_container",
-                "description": "Put an object in a container. Fails if the object is too far away or the container is full/not a container.",
-                "parameters": {
-                    "type" : "object",
-                    "properties": {
-                        "object_name": {
-                            "type": "string",
-                            "description": "The name of the object to put in the container."
-                        },
-                        "container_name": {
-                            "type": "string",
-                            "description": "The name of the container to put the object in."
-                        }
-                    }
-                }
-            },
-            {
-                "name": "open_container",
-                "description": "Open an object to make its contents available. Fails if the container is too far away or already open.",
-                "parameters": {
-                    "type" : "object",
-                    "properties": {
-                        "container_name": {
-                            "type": "string",
-                        }
-                    }
-                }
-            }
-        ]
+        self.functions = FunctionRegistry(self)
+        self.function_calls = self.functions.select()
+        self.manipulation_schemas = self.functions.schemas()
+        # Masks of the known objects, rebuilt only when the knowledge or the objects of the environment change
+        self.known_masks : dict[int, tuple] = {}
 
+    @action("Place an object on a support surface. Fails if the object is too far away.",
+            object_name="The name of the object to place.",
+            support_surface="The name of the support surface to place the object on.")
+    @precondition("can_place_object", infer="infer_place_object")
+    @traced()
     def place_object(self, object_name:str, support_surface:str):
         if not self.in_reach(object_name, support_surface):
             return "Error: Target location too far away"
@@ -239,6 +165,10 @@ class Manipulator(Robot):
         else:
             return "Error: Target location not found"
 
+    @action("Pick up an object. Fails if the object is too heavy or too far away.",
+            object_name="The name of the object to pick up.")
+    @precondition("can_pick_up_object", infer="infer_pick_up_object")
+    @traced()
     def pick_up_object(self, object_name:str):
         try:
             if not self.in_reach(object_name):
@@ -263,6 +193,10 @@ class Manipulator(Robot):
         except AttributeError as e:
             print("Error: {}".format(e))
         
+    @action("Cut an object using the object equipped in the gripper. Fails if the object is too far away or the object is not cuttable.",
+            object_name="The name of the object to cut.")
+    @precondition("can_cut_object", infer="infer_cut_object")
+    @traced()
     def cut_object(self, object_name:str):
         if not self.in_reach(object_name):
             return "Error: Target object is too far away"
@@ -277,6 +211,10 @@ class Manipulator(Robot):
         else:
             return "Error: Object not found"
         
+    @action("Put the object held in the gripper in a container. Fails if the container is too far away or the container is full/not a container.",
+            container_name="The name of the container to put the object in.")
+    @precondition("can_put_object_in_container", infer="infer_put_object_in_container")
+    @traced()
     def put_object_in_container(self, container_name:str):
         if not self.in_reach(container_name):
             return "Error: Target container is too far away"
@@ -285,7 +223,7 @@ class Manipulator(Robot):
             if container_of_interest.check_capability(Capability.CONTAINER):
                 if self.object_held is not None:
                     return_string = "Object {} has been placed in {}".format(self.object_held.name, container_name)
-                    container_of_interest.contains.append(self.object_held.name)
+                    container_of_interest.add_content(self.object_held.name)
                     self.object_held.x = container_of_interest.x
                     self.object_held.y = container_of_interest.y
                     self.object_held.z = container_of_interest.z
@@ -298,6 +236,10 @@ class Manipulator(Robot):
         else:
             return "Error: Container not found"
         
+    @action("Open an object to make its contents available. Fails if the container is too far away or already open.",
+            container_name="The name of the container to open.")
+    @precondition("can_open_container", infer="infer_open_container")
+    @traced()
     def open_container(self, container_name:str):
         if not self.in_reach(container_name):
             return "Error: Target container is too far away"
@@ -305,7 +247,7 @@ class Manipulator(Robot):
         if container_of_interest is not None:
             if container_of_interest.check_capability(Capability.CONTAINER):
                 for contained_obj in container_of_interest.contains:
-                    self.environment.get_object(contained_obj).capabilities.add(Capability.VISIBLE)
+                    self.environment.get_object(contained_obj).add_capability(Capability.VISIBLE)
                 return "Container {} has been opened.".format(container_name)
             return "Error: {} is not a container.".format(container_name)
         else:
@@ -331,3 +273,96 @@ class Manipulator(Robot):
                              target.z]) > self.max_reach_distance:
                 return False
         return True
+
+    # Function that returns the objects within reach of the end effector, nearest first, except the object held
+    def objects_in_reach(self, known: ObjectStore = None) -> list[Object]:
+        location = (self.ee_location_x, self.ee_location_y, self.ee_location_z)
+        return [object for object in known_only(self.environment.objects_within(location, self.max_reach_distance), known)
+                if object is not self.object_held]
+
+    def pickable_in_reach(self, known: ObjectStore = None) -> list[Object]:
+        return [object for object in self.objects_in_reach(known)
+                if object.check_capability(Capability.VISIBLE) and not object.check_capability(Capability.FIXED)]
+
+    def cuttable_in_reach(self, known: ObjectStore = None) -> list[Object]:
+        return [object for object in self.objects_in_reach(known) if object.check_capability(Capability.CUTTABLE)]
+
+    def containers_in_reach(self, known: ObjectStore = None) -> list[Object]:
+        return [object for object in self.objects_in_reach(known) if object.check_capability(Capability.CONTAINER)]
+
+    # Batch queries over every object of the environment, one entry per row of its object table
+    # With `known`, only the objects whose names are in the knowledge of the machine are kept
+    def reach_mask(self, known: ObjectStore = None):
+        mask = self.environment.reach_mask((self.ee_location_x, self.ee_location_y, self.ee_location_z), self.max_reach_distance)
+        if self.object_held is not None and self.object_held.table is not None:
+            mask[self.object_held.row] = False
+        if known is not None:
+            mask &= self.known_mask(known)
+        return mask
+
+    def known_mask(self, known: ObjectStore):
+        objects = self.environment.objects
+        entry = self.known_masks.get(id(known))
+        if entry is not None and entry[0] is known and entry[1] == (known.version, objects.version):
+            return entry[2]
+        mask = objects.table.mask_of([self.environment.get_object(object.name) for object in known if object.name in objects])
+        self.known_masks.clear()
+        self.known_masks[id(known)] = (known, (known.version, objects.version), mask)
+        return mask
+
+    def pickable_mask(self, known: ObjectStore = None):
+        return self.reach_mask(known) & self.environment.capability_mask(Capability.VISIBLE) & ~self.environment.capability_mask(Capability.FIXED)
+
+    def cuttable_mask(self, known: ObjectStore = None):
+        return self.reach_mask(known) & self.environment.capability_mask(Capability.CUTTABLE)
+
+    def container_mask(self, known: ObjectStore = None):
+        return self.reach_mask(known) & self.environment.capability_mask(Capability.CONTAINER)
+
+    # Function that returns whether the batch queries are available
+    def batched(self) -> bool:
+        return self.environment.objects.table is not None
+
+    # Preconditions of the actions, checked before the actions are offered to the language model
+    # With `known`, the objects the actions apply to must be in the knowledge of the machine
+    def can_place_object(self, known: ObjectStore = None) -> bool:
+        return self.object_held is not None
+
+    def can_pick_up_object(self, known: ObjectStore = None) -> bool:
+        if self.object_held is not None:
+            return False
+        return bool(self.pickable_mask(known).any()) if self.batched() else len(self.pickable_in_reach(known)) > 0
+
+    def can_cut_object(self, known: ObjectStore = None) -> bool:
+        if self.object_held is None:
+            return False
+        return bool(self.cuttable_mask(known).any()) if self.batched() else len(self.cuttable_in_reach(known)) > 0
+
+    def can_put_object_in_container(self, known: ObjectStore = None) -> bool:
+        if self.object_held is None:
+            return False
+        return bool(self.container_mask(known).any()) if self.batched() else len(self.containers_in_reach(known)) > 0
+
+    def can_open_container(self, known: ObjectStore = None) -> bool:
+        return bool(self.container_mask(known).any()) if self.batched() else len(self.containers_in_reach(known)) > 0
+
+    # Arguments of the actions, inferred when the goal names exactly one suitable object
+    def infer_place_object(self, goal: str, known: ObjectStore = None) -> dict:
+        support = named_in_goal(goal, self.objects_in_reach(known))
+        return {"object_name": self.object_held.name, "support_surface": support.name} if support is not None else None
+
+    def infer_pick_up_object(self, goal: str, known: ObjectStore = None) -> dict:
+        target = named_in_goal(goal, self.pickable_in_reach(known))
+        return {"object_name": target.name} if target is not None else None
+
+    def infer_cut_object(self, goal: str, known: ObjectStore = None) -> dict:
+        target = named_in_goal(goal, self.cuttable_in_reach(known))
+        return {"object_name": target.name} if target is not None else None
+
+    def infer_put_object_in_container(self, goal: str, known: ObjectStore = None) -> dict:
+        container = named_in_goal(goal, self.containers_in_reach(known))
+        return {"container_name": container.name} if container is not None else None
+
+    def infer_open_container(self, goal: str, known: ObjectStore = None) -> dict:
+        container = named_in_goal(goal, self.containers_in_reach(known))
+        return {"container_name": container.name} if container is not None else None
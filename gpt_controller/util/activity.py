@@ -0,0 +1,125 @@
+from gpt_controller.util.models import Task
+from gpt_controller.config import *
+import bisect
+import time
+
+# Append-only log of the tasks of the machine, ordered by the time they were logged
+# The log is a ring buffer of at most `capacity` entries: once full, every new entry overwrites the oldest one.
+# Windows of the log are found by bisecting the timestamps, so a query costs O(log n + N) for N entries returned.
+# Discarded tasks keep their entry but are left out of the windows until they are logged again.
+class ActivityLog():
+
+    def __init__(self, capacity: int = ACTIVITY_LOG_SIZE):
+        self.capacity = capacity
+        self.timestamps : list[float] = [0.0] * capacity
+        self.entries : list[Task] = [None] * capacity
+        self.ids : set[int] = set()
+        self.discarded : set[int] = set()
+        self.start : int = 0
+        self.count : int = 0
+
+    # Function that logs a task, at the current time unless given, once per task
+    # Timestamps older than the most recent entry are raised to it to keep the log ordered
+    def append(self, task: Task, timestamp: float = None) -> bool:
+        if task.id in self.ids:
+            if task.id in self.discarded:
+                self.discarded.discard(task.id)
+                return True
+            return False
+        timestamp = time.time() if timestamp is None else timestamp
+        if self.count:
+            timestamp = max(timestamp, self.timestamps[self.position(self.count - 1)])
+        if self.count == self.capacity:
+            position = self.start
+            self.ids.discard(self.entries[position].id)
+            self.discarded.discard(self.entries[position].id)
+            self.start = (self.start + 1) % self.capacity
+        else:
+            position = self.position(self.count)
+            self.count += 1
+        self.timestamps[position] = timestamp
+        self.entries[position] = task
+        self.ids.add(task.id)
+        return True
+
+    # Function that returns the `limit` most recent tasks logged within the last `time_span` seconds, oldest first
+    def window(self, time_span: float = None, limit: int = None, now: float = None) -> list[Task]:
+        first = 0
+        if time_span is not None:
+            since = (time.time() if now is None else now) - time_span
+            first = bisect.bisect_right(self, since, key=lambda item: item[0])
+        if self.discarded:
+            return self.kept(first, limit)
+        if limit is not None:
+            first = max(first, self.count - limit)
+        return [self.entries[self.position(index)] for index in range(first, self.count)]
+
+    # Function that returns the `limit` most recent tasks not discarded from the index `first`, oldest first
+    def kept(self, first: int, limit: int = None) -> list[Task]:
+        tasks = []
+        for index in range(self.count - 1, first - 1, -1):
+            if limit is not None and len(tasks) >= limit:
+                break
+            task = self.entries[self.position(index)]
+            if task.id not in self.discarded:
+                tasks.append(task)
+        tasks.reverse()
+        return tasks
+
+    # Function that leaves a logged task out of the windows of the log
+    def discard(self, task: Task):
+        if task.id in self.ids:
+            self.discarded.add(task.id)
+
+    def position(self, index: int) -> int:
+        return (self.start + index) % self.capacity
+
+    def clear(self):
+        self.timestamps = [0.0] * self.capacity
+        self.entries = [None] * self.capacity
+        self.ids.clear()
+        self.discarded.clear()
+        self.start = 0
+        self.count = 0
+
+    def __getitem__(self, index: int) -> tuple[float, Task]:
+        if not 0 <= index < self.count:
+            raise IndexError("Activity log index out of range")
+        position = self.position(index)
+        return (self.timestamps[position], self.entries[position])
+
+    def __len__(self) -> int:
+        return self.count
+
+# Stack of tasks logging every task pushed onto it in an activity log
+# The log is a history of the tasks pushed, independent of the stack: tasks removed from the stack (remove, del,
+# slice assignment, trimming by the persistence) stay in the log until the ring buffer overwrites them, and a task
+# pushed again is logged only once. Only append, extend, insert and += log tasks.
+# A popped task was only an intermediate step of the task below it, so pop discards it from the log.
+class TaskStack(list):
+
+    def __init__(self, tasks: list[Task] = (), log: ActivityLog = None):
+        super().__init__()
+        self.log = log if log is not None else ActivityLog()
+        self.extend(tasks)
+
+    def append(self, task: Task, timestamp: float = None):
+        super().append(task)
+        self.log.append(task, timestamp)
+
+    def extend(self, tasks: list[Task]):
+        for task in tasks:
+            self.append(task)
+
+    def insert(self, index: int, task: Task):
+        super().insert(index, task)
+        self.log.append(task)
+
+    def __iadd__(self, tasks: list[Task]):
+        self.extend(tasks)
+        return self
+
+    def pop(self, index: int = -1) -> Task:
+        task = super().pop(index)
+        self.log.discard(task)
+        return task
@@ -1,8 +1,9 @@
 from dataclasses import dataclass, field
 from gpt_controller.config import *
 from gpt_controller.util.labels import *
+from gpt_controller.util.tokens import message_tokens
 from colorama import Fore, Style
-from enum import Enum
+from enum import Enum, IntFlag
 from uuid import uuid4
 from datetime import datetime, timedelta
 import json
@@ -14,13 +15,17 @@ class Shape(Enum):
     CONICAL     = 'conical'
     OTHER       = 'complex'
     
-class Capability(Enum):
-    FIXED = 'fixed'
-    CONTAINER = 'container'
-    EQUIPPABLE = 'equippable'
-    USABLE = 'usable'
-    VISIBLE = 'visible'
-    CUTTABLE = 'cuttable'
+class Capability(IntFlag):
+    FIXED = 1
+    CONTAINER = 2
+    EQUIPPABLE = 4
+    USABLE = 8
+    VISIBLE = 16
+    CUTTABLE = 32
+
+    # Function that returns the single capabilities set in the mask
+    def members(self) -> list["Capability"]:
+        return [capability for capability in Capability if capability & self == capability]
     
 class Material(Enum):
     WOOD    = 'wood'
@@ -32,40 +37,98 @@ class Material(Enum):
     ORGANIC = 'organic'
     OTHER   = 'other'
 
-@dataclass
-class Object:
+# Attributes of an object that are indexed by the stores holding it
+INDEXED_ATTRIBUTES = ("name", "id", "color", "shape", "material", "container", "support_surface", "capabilities")
+
+# Attributes of an object that move it in the spatial indices of the stores holding it
+POSITION_ATTRIBUTES = ("x", "y", "z")
+
+# Attributes of an object that only track where it is held and do not change its description
+BOOKKEEPING_ATTRIBUTES = ("stores", "table", "row", "version")
+
+# Attributes of an object held in the columns of an object table when the object is attached to one
+GEOMETRY_ATTRIBUTES = ("x", "y", "z", "length", "width", "height")
+
+# Function that returns a property reading and writing a geometry attribute from the table of the object if it has one
+def geometry(attribute: str) -> property:
+    column = GEOMETRY_ATTRIBUTES.index(attribute)
+    slot = "_" + attribute
+
+    def get(self):
+        if self.table is not None:
+            return self.table.columns[column, self.row].item()
+        return getattr(self, slot)
+
+    def put(self, value):
+        if self.table is not None:
+            self.table.columns[column, self.row] = value
+        else:
+            object.__setattr__(self, slot, value)
+
+    return property(get, put)
+
+# Objects use slots, so an instance carries no attribute dictionary. Capabilities are a bitmask,
+# `contains` and `stores` are tuples sharing the empty tuple until filled, and the geometry
+# lives either in the slots of the object or in the columns of the object table it is attached to.
+# `version` changes with every change of the object made through its attributes, so descriptions rendered
+# from the object can be cached until it changes. Writes made directly to the columns of a table do not change it.
+class Object():
+    __slots__ = ("name", "id", "color", "shape", "material", "weight", "support_surface",
+                 "capabilities", "contains", "container", "stores", "table", "row", "version",
+                 "_x", "_y", "_z", "_length", "_width", "_height")
     
     # Identifiers
     name : str
-    id : int = uuid4
-    color : str = None
-    shape : Shape = None
-    material : Material = None
-    weight : int = None
+    id : int
+    color : str
+    shape : Shape
+    material : Material
+    weight : int
 
     
     # Dimensions
-    length : int = 0
-    width : int = 0
-    height : int = 0
+    length : int
+    width : int
+    height : int
     
     # Location
-    x : int = 0
-    y : int = 0
-    z : int = 0
-    support_surface : str = 'ground'
+    x : int
+    y : int
+    z : int
+    support_surface : str
     
     # Capabilities
-    capabilities : set[Capability] = field(default_factory=set)
+    capabilities : Capability
     
     # Inventory
-    contains: list[str] = field(default_factory=list)
-    container : str = None
+    contains: tuple[str, ...]
+    container : str
+
+    length = geometry("length")
+    width = geometry("width")
+    height = geometry("height")
+    x = geometry("x")
+    y = geometry("y")
+    z = geometry("z")
     
     def __init__(self, attributes: dict[str, any]):
-        self.contains = []
-        self.capabilities = set()
-        self.capabilities.add(Capability.VISIBLE)
+        assign = object.__setattr__
+        assign(self, "version", 0)
+        assign(self, "stores", ())
+        assign(self, "table", None)
+        assign(self, "row", None)
+        assign(self, "name", None)
+        assign(self, "id", uuid4().int)
+        assign(self, "color", None)
+        assign(self, "shape", None)
+        assign(self, "material", None)
+        assign(self, "weight", None)
+        assign(self, "support_surface", 'ground')
+        assign(self, "capabilities", Capability.VISIBLE)
+        assign(self, "contains", ())
+        assign(self, "container", None)
+        for attribute in GEOMETRY_ATTRIBUTES:
+            assign(self, "_" + attribute, 0)
         for attribute, value in attributes.items():
             if attribute == 'name':
                 setattr(self, attribute, value)
@@ -74,50 +137,76 @@ class Object:
             elif attribute == 'material':
                 setattr(self, attribute, Material(value))
             elif attribute == 'dimensions':
-                setattr(self, self.length, value[0])
-                setattr(self, self.width, value[1])
-                setattr(self, self.height, value[2])
+                self.length, self.width, self.height = value[0], value[1], value[2]
             elif attribute == 'location':
-                setattr(self, self.x, value[0])
-                setattr(self, self.y, value[1])
-                setattr(self, self.z, value[2])
+                self.x, self.y, self.z = value[0], value[1], value[2]
             elif attribute == 'capabilities':
-                self.capabilities.add(value)
+                if isinstance(value, Capability):
+                    self.capabilities |= value
+                else:
+                    for capability in value:
+                        self.capabilities |= capability
             elif attribute == 'contains':
-                setattr(self, attribute, json.loads(value))
+                self.contains = tuple(json.loads(value) if isinstance(value, str) else value)
             elif attribute == 'support_surface':
                 setattr(self, attribute, value)
             else:
                 setattr(self, attribute, value)
 
     def verbose_description(self, attributes: list[str]=None):
-        object_description : str = "Object name: {} \n".format(self.name)
+        object_description : list[str] = ["Object name: {} \n".format(self.name)]
         if attributes is None:
-            return object_description
+            return object_description[0]
         for attribute in attributes:
             if attribute == 'name': continue
             else:
                 value = getattr(self, attribute)
-                if isinstance(value, Enum):
-                    object_description += "{} : {}".format(attribute, value.value)
-                elif isinstance(value, int):
-                    object_description += "{} : {}".format(attribute, value)
-                elif isinstance(value, set):
-                    object_description += "{} : {}".format(attribute, ", ".join([capability.value for capability in value]))
-                elif isinstance(value, list):
-                    object_description += "{} : {}".format(attribute, ", ".join(value))
+                if isinstance(value, Capability):
+                    object_description.append("{} : {}".format(attribute, ", ".join([capability.name.lower() for capability in value.members()])))
+                elif isinstance(value, Enum):
+                    object_description.append("{} : {}".format(attribute, value.value))
+                elif isinstance(value, (int, float)):
+                    object_description.append("{} : {}".format(attribute, value))
+                elif isinstance(value, (list, tuple)):
+                    object_description.append("{} : {}".format(attribute, ", ".join(value)))
                 elif isinstance(value, str):
-                    object_description += "{} : '{}'".format(attribute, value)
-        return object_description
+                    object_description.append("{} : '{}'".format(attribute, value))
+        return "".join(object_description)
     
+    # Function that keeps the indices of the stores holding the object current when an indexed attribute
+    # or the position of the object changes, and bumps the version of the object
+    def __setattr__(self, attribute: str, value):
+        if attribute not in BOOKKEEPING_ATTRIBUTES:
+            object.__setattr__(self, "version", self.version + 1)
+        stores = self.stores
+        if not stores or attribute not in INDEXED_ATTRIBUTES:
+            object.__setattr__(self, attribute, value)
+            if stores and attribute in POSITION_ATTRIBUTES:
+                for store in stores:
+                    store.move(self)
+            return
+        previous = getattr(self, attribute, None)
+        object.__setattr__(self, attribute, value)
+        for store in stores:
+            store.reindex(self, attribute, previous, value)
+
     def add_capability(self, capability:Capability):
-        self.capabilities.add(capability)
+        object.__setattr__(self, "version", self.version + 1)
+        object.__setattr__(self, "capabilities", self.capabilities | capability)
+        for store in self.stores:
+            store.reindex_capability(self, capability, True)
+
+    def remove_capability(self, capability:Capability):
+        object.__setattr__(self, "version", self.version + 1)
+        object.__setattr__(self, "capabilities", self.capabilities & ~capability)
+        for store in self.stores:
+            store.reindex_capability(self, capability, False)
     
     def check_capability(self, capability:Capability):
-        for own_capability in self.capabilities:
-            if capability == own_capability:
-                return True
-        return False
+        return self.capabilities & capability == capability
+
+    def add_content(self, name:str):
+        self.contains = self.contains + (name,)
     
     def __repr__(self):
         return self.name
@@ -134,14 +223,61 @@ class Message:
     role : Role
     content : json
     timestamp : datetime = None
+    token_count : int = 0
 
-    def __init__(self, role:Role, content:str | dict):
+    # `content_tokens` is the known token count of a text content, which is then not encoded again
+    def __init__(self, role:Role, content:str | dict, content_tokens:int = None):
         self.role = role
         self.timestamp = datetime.now()
         if isinstance(content, str):
             self.content = {"role": self.role.value, "content": content}
         else:
             self.content = content
+        if isinstance(content, str) and content_tokens is not None:
+            self.token_count = message_tokens({"role": self.role.value}) + content_tokens
+        else:
+            self.token_count = message_tokens(self.content)
+
+# List of messages keeping a running total of their tokens
+class MessageList(list):
+
+    def __init__(self, messages: list[Message] = ()):
+        super().__init__(messages)
+        self.num_tokens : int = sum(message.token_count for message in self)
+
+    def append(self, message: Message):
+        super().append(message)
+        self.num_tokens += message.token_count
+
+    def extend(self, messages: list[Message]):
+        messages = list(messages)
+        super().extend(messages)
+        self.num_tokens += sum(message.token_count for message in messages)
+
+    def insert(self, index: int, message: Message):
+        super().insert(index, message)
+        self.num_tokens += message.token_count
+
+    def pop(self, index: int = -1) -> Message:
+        message = super().pop(index)
+        self.num_tokens -= message.token_count
+        return message
+
+    def remove(self, message: Message):
+        super().remove(message)
+        self.num_tokens -= message.token_count
+
+    def clear(self):
+        super().clear()
+        self.num_tokens = 0
+
+    def __setitem__(self, index, value):
+        super().__setitem__(index, value)
+        self.num_tokens = sum(message.token_count for message in self)
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self.num_tokens = sum(message.token_count for message in self)
 
 class ConversationType(Enum):
     CHAT = "Chat"
@@ -164,8 +300,9 @@ class Conversation:
     token_quota : int = 0
     
     def __init__(self, type:ConversationType):
+        self.id = uuid4().int
         self.type = type
-        self.messages = []
+        self.messages = MessageList()
         self.start_time = datetime.now()
     
     def finish(self):
@@ -175,6 +312,10 @@ class Conversation:
     def get_messages(self):
         return self.messages
 
+    @property
+    def num_tokens(self) -> int:
+        return self.messages.num_tokens
+
 @dataclass
 class Advice:
     type : AdviceLabel
@@ -183,6 +324,7 @@ class Advice:
     timestamp : datetime = None
 
     def __init__(self, label : str | AdviceLabel, content : str):
+        self.id = uuid4().int
         if isinstance(label, str) : self.type = getattr(AdviceLabel, label)
         else : self.type = label
         self.content = content
@@ -217,6 +359,7 @@ class Task:
     total_time : timedelta = timedelta(seconds=0)
 
     def __init__(self, label : str | TaskLabel, goal : str):
+        self.id = uuid4().int
         self.goal_predicates = {}
         if isinstance(label, str) : self.type = getattr(TaskLabel, label)
         else: self.type = label
@@ -0,0 +1,309 @@
+from gpt_controller.util.models import *
+from gpt_controller.config import *
+from datetime import datetime, timedelta
+import threading
+import sqlite3
+import json
+import os
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    name TEXT PRIMARY KEY,
+    id TEXT,
+    color TEXT,
+    shape TEXT,
+    material TEXT,
+    container TEXT,
+    support_surface TEXT,
+    attributes TEXT
+);
+CREATE INDEX IF NOT EXISTS objects_color ON objects (color);
+CREATE INDEX IF NOT EXISTS objects_shape ON objects (shape);
+CREATE INDEX IF NOT EXISTS objects_material ON objects (material);
+CREATE INDEX IF NOT EXISTS objects_container ON objects (container);
+CREATE INDEX IF NOT EXISTS objects_support_surface ON objects (support_surface);
+
+CREATE TABLE IF NOT EXISTS tasks (
+    id TEXT PRIMARY KEY,
+    position INTEGER,
+    type TEXT,
+    goal TEXT,
+    status TEXT,
+    conclusion TEXT,
+    start_time REAL,
+    stop_time REAL,
+    attributes TEXT
+);
+CREATE INDEX IF NOT EXISTS tasks_start_time ON tasks (start_time);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status);
+CREATE INDEX IF NOT EXISTS tasks_position ON tasks (position);
+
+CREATE TABLE IF NOT EXISTS advice (
+    id TEXT PRIMARY KEY,
+    label TEXT,
+    content TEXT,
+    timestamp REAL
+);
+CREATE INDEX IF NOT EXISTS advice_label ON advice (label);
+
+CREATE TABLE IF NOT EXISTS conversations (
+    id TEXT PRIMARY KEY,
+    type TEXT,
+    start_time REAL,
+    finish_time REAL,
+    token_quota INTEGER
+);
+CREATE INDEX IF NOT EXISTS conversations_type ON conversations (type, start_time);
+
+CREATE TABLE IF NOT EXISTS messages (
+    conversation_id TEXT,
+    position INTEGER,
+    role TEXT,
+    content TEXT,
+    timestamp REAL,
+    PRIMARY KEY (conversation_id, position)
+);
+"""
+
+def timestamp(moment: datetime) -> float:
+    return moment.timestamp() if moment is not None else None
+
+def moment(timestamp: float) -> datetime:
+    return datetime.fromtimestamp(timestamp) if timestamp is not None else None
+
+# Persistent memory of a machine in an SQLite database in WAL mode
+# Objects and advice are loaded on start, only the most recent tasks are loaded and older tasks and
+# conversations are read on demand. Changes are written in one transaction per turn by `save`,
+# after which the history kept in memory is trimmed to the configured windows.
+class SQLiteMemory():
+
+    def __init__(self, path: str = PERSISTENCE_PATH, task_window: int = PERSISTENCE_TASK_WINDOW,
+                 conversation_window: int = PERSISTENCE_CONVERSATION_WINDOW):
+        self.path = path
+        self.task_window = task_window
+        self.conversation_window = conversation_window
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+        self.lock = threading.Lock()
+
+        # Rows last written, to only write what changed since
+        self.objects : dict[str, tuple] = {}
+        self.tasks : dict[str, tuple] = {}
+        self.advice : set[str] = set()
+        self.conversations : set[str] = set()
+        self.positions : dict[str, int] = {}
+        self.next_position : int = 0
+
+    # Function that loads the objects, the advice, the unfinished tasks and the most recent finished tasks filling the task window into a machine
+    def load(self, machine):
+        with self.lock:
+            for row in self.connection.execute("SELECT name, id, attributes FROM objects"):
+                object = self.object_from_row(row)
+                machine.object_knowledge.add(object)
+                self.objects[object.name] = self.object_row(object)
+            for row in self.connection.execute("SELECT id, label, content, timestamp FROM advice ORDER BY timestamp"):
+                machine.advices.append(self.advice_from_row(row))
+                self.advice.add(row[0])
+            # Unfinished tasks take their place in the window first, as they are never trimmed
+            rows = self.connection.execute("SELECT id, position, type, goal, status, conclusion, start_time, stop_time, attributes FROM tasks "
+                                           "WHERE status NOT IN ('COMPLETED', 'FAILED') "
+                                           "OR id IN (SELECT id FROM tasks WHERE status IN ('COMPLETED', 'FAILED') ORDER BY position DESC "
+                                           "LIMIT MAX(? - (SELECT COUNT(*) FROM tasks WHERE status NOT IN ('COMPLETED', 'FAILED')), 0)) "
+                                           "ORDER BY position", (self.task_window,)).fetchall()
+            for row in rows:
+                task = self.task_from_row(row)
+                machine.task_stack.append(task, task.start_time.timestamp() if task.start_time is not None else None)
+                self.positions[row[0]] = row[1]
+                self.tasks[row[0]] = self.task_row(task, row[1])
+            self.next_position = self.connection.execute("SELECT COALESCE(MAX(position), -1) FROM tasks").fetchone()[0] + 1
+
+    # Function that writes everything that changed in a machine in a single transaction and trims its history
+    def save(self, machine):
+        with self.lock:
+            object_rows = [self.object_row(object) for object in machine.object_knowledge]
+            changed_objects = [row for row in object_rows if self.objects.get(row[0]) != row]
+            names = {row[0] for row in object_rows}
+            removed_objects = [(name,) for name in self.objects if name not in names]
+
+            task_rows = [self.task_row(task, position) for task, position in zip(machine.task_stack, self.task_positions(machine.task_stack))]
+            changed_tasks = [row for row in task_rows if self.tasks.get(row[0]) != row]
+
+            new_advice = [advice for advice in machine.advices if self.key(advice.id) not in self.advice]
+            new_conversations = [conversation for conversation in machine.conversations if self.key(conversation.id) not in self.conversations]
+
+            with self.connection:
+                self.connection.executemany("INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?, ?, ?, ?)", changed_objects)
+                self.connection.executemany("DELETE FROM objects WHERE name = ?", removed_objects)
+                self.connection.executemany("INSERT OR REPLACE INTO tasks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", changed_tasks)
+                self.connection.executemany("INSERT OR REPLACE INTO advice VALUES (?, ?, ?, ?)",
+                                            [(self.key(advice.id), advice.type.name, advice.content, timestamp(advice.timestamp)) for advice in new_advice])
+                self.connection.executemany("INSERT OR REPLACE INTO conversations VALUES (?, ?, ?, ?, ?)",
+                                            [(self.key(conversation.id), conversation.type.name, timestamp(conversation.start_time),
+                                              timestamp(conversation.finish_time), conversation.token_quota) for conversation in new_conversations])
+                self.connection.executemany("INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?)",
+                                            [(self.key(conversation.id), position, message.role.name, json.dumps(message.content, default=str), timestamp(message.timestamp))
+                                             for conversation in new_conversations for position, message in enumerate(conversation.messages)])
+
+            for row in changed_objects:
+                self.objects[row[0]] = row
+            for (name,) in removed_objects:
+                del self.objects[name]
+            for row in changed_tasks:
+                self.tasks[row[0]] = row
+            self.advice.update(self.key(advice.id) for advice in new_advice)
+            self.conversations.update(self.key(conversation.id) for conversation in new_conversations)
+            self.trim(machine)
+
+    # Function that returns the positions of the tasks of a stack, ordered as the stack
+    # A task keeps its position unless it was moved before a task of a greater position, in which case it gets a new one
+    def task_positions(self, tasks: list[Task]) -> list[int]:
+        positions : list[int] = []
+        last = -1
+        for task in tasks:
+            key = self.key(task.id)
+            position = self.positions.get(key)
+            if position is None or position <= last:
+                position = self.next_position
+                self.next_position += 1
+                self.positions[key] = position
+            positions.append(position)
+            last = position
+        return positions
+
+    # Function that drops the oldest finished tasks beyond the task window and the oldest conversations from memory,
+    # as they are persisted. Tasks that are new, paused or in progress are kept whatever their age.
+    def trim(self, machine):
+        excess = len(machine.task_stack) - self.task_window
+        if excess > 0:
+            kept : list[Task] = []
+            for task in machine.task_stack:
+                if excess > 0 and task.status in (TaskStatus.COMPLETED, TaskStatus.FAILED):
+                    self.tasks.pop(self.key(task.id), None)
+                    self.positions.pop(self.key(task.id), None)
+                    excess -= 1
+                else:
+                    kept.append(task)
+            machine.task_stack[:] = kept
+        if len(machine.conversations) > self.conversation_window:
+            trimmed = len(machine.conversations) - self.conversation_window
+            for conversation in machine.conversations[:trimmed]:
+                self.conversations.discard(self.key(conversation.id))
+            del machine.conversations[:trimmed]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    # Functions that read older rows on demand
+    def tasks_between(self, start: datetime, end: datetime = None, status: TaskStatus = None, limit: int = 100) -> list[Task]:
+        query = "SELECT id, position, type, goal, status, conclusion, start_time, stop_time, attributes FROM tasks WHERE start_time >= ? AND start_time <= ?"
+        arguments = [timestamp(start), timestamp(end if end is not None else datetime.now())]
+        if status is not None:
+            query += " AND status = ?"
+            arguments.append(status.name)
+        query += " ORDER BY start_time DESC LIMIT ?"
+        arguments.append(limit)
+        with self.lock:
+            rows = self.connection.execute(query, arguments).fetchall()
+        return [self.task_from_row(row) for row in reversed(rows)]
+
+    def advice_with_label(self, label: AdviceLabel) -> list[Advice]:
+        with self.lock:
+            rows = self.connection.execute("SELECT id, label, content, timestamp FROM advice WHERE label = ? ORDER BY timestamp", (label.name,)).fetchall()
+        return [self.advice_from_row(row) for row in rows]
+
+    def objects_where(self, **criteria) -> list[Object]:
+        columns = [column for column in criteria if column in ("color", "shape", "material", "container", "support_surface")]
+        query = "SELECT name, id, attributes FROM objects" + (" WHERE " + " AND ".join("{} = ?".format(column) for column in columns) if columns else "")
+        arguments = [criteria[column].value if isinstance(criteria[column], Enum) else criteria[column] for column in columns]
+        with self.lock:
+            rows = self.connection.execute(query, arguments).fetchall()
+        return [self.object_from_row(row) for row in rows]
+
+    def conversations_of(self, type: ConversationType = None, limit: int = 20) -> list[Conversation]:
+        query = "SELECT id, type, start_time, finish_time, token_quota FROM conversations"
+        arguments = []
+        if type is not None:
+            query += " WHERE type = ?"
+            arguments.append(type.name)
+        query += " ORDER BY start_time DESC LIMIT ?"
+        arguments.append(limit)
+        with self.lock:
+            rows = self.connection.execute(query, arguments).fetchall()
+            conversations = []
+            for row in reversed(rows):
+                conversation = Conversation(ConversationType[row[1]])
+                conversation.id = int(row[0], 16)
+                conversation.start_time, conversation.finish_time = moment(row[2]), moment(row[3])
+                conversation.total_time = conversation.finish_time - conversation.start_time if conversation.finish_time else None
+                conversation.token_quota = row[4]
+                for role, content, sent in self.connection.execute("SELECT role, content, timestamp FROM messages WHERE conversation_id = ? ORDER BY position", (row[0],)):
+                    message = Message(Role[role], json.loads(content))
+                    message.timestamp = moment(sent)
+                    conversation.messages.append(message)
+                conversations.append(conversation)
+        return conversations
+
+    # Functions that convert the rows of the tables
+    @staticmethod
+    def key(id: int) -> str:
+        return format(id, "x")
+
+    def object_row(self, object: Object) -> tuple:
+        attributes = {attribute: getattr(object, attribute) for attribute in Object.__annotations__}
+        attributes = {attribute: value.value if isinstance(value, Enum) else value for attribute, value in attributes.items()}
+        attributes["capabilities"] = sorted(capability.name.lower() for capability in object.capabilities.members())
+        attributes["contains"] = list(object.contains)
+        return (object.name, self.key(object.id),
+                attributes.get("color"), attributes.get("shape"), attributes.get("material"),
+                object.container, object.support_surface, json.dumps(attributes, sort_keys=True, default=str))
+
+    @staticmethod
+    def object_from_row(row: tuple) -> Object:
+        attributes = json.loads(row[2])
+        object = Object({"name": row[0]})
+        for attribute, value in attributes.items():
+            if attribute in ("name", "id"):
+                continue
+            elif attribute == "shape" and value is not None:
+                value = Shape(value)
+            elif attribute == "material" and value is not None:
+                value = Material(value)
+            elif attribute == "capabilities":
+                value = Capability(sum(Capability[capability.upper()] for capability in set(value)))
+            elif attribute == "contains":
+                value = tuple(value)
+            setattr(object, attribute, value)
+        object.id = int(row[1], 16)
+        return object
+
+    def task_row(self, task: Task, position: int) -> tuple:
+        attributes = {"goal_predicates": task.goal_predicates, "function_name": task.function_name,
+                      "function_content": task.function_content, "total_time": task.total_time.total_seconds()}
+        return (self.key(task.id), position, task.type.name, task.goal, task.status.name, task.conclusion,
+                timestamp(task.start_time), timestamp(task.stop_time), json.dumps(attributes, default=str))
+
+    @staticmethod
+    def task_from_row(row: tuple) -> Task:
+        task = Task(TaskLabel[row[2]], row[3])
+        task.id = int(row[0], 16)
+        task.status = TaskStatus[row[4]]
+        task.conclusion = row[5]
+        task.start_time, task.stop_time = moment(row[6]), moment(row[7])
+        attributes = json.loads(row[8])
+        task.goal_predicates = attributes["goal_predicates"]
+        task.function_name = attributes["function_name"]
+        task.function_content = attributes["function_content"]
+        task.total_time = timedelta(seconds=attributes["total_time"])
+        return task
+
+    @staticmethod
+    def advice_from_row(row: tuple) -> Advice:
+        advice = Advice(AdviceLabel[row[1]], row[2])
+        advice.id = int(row[0], 16)
+        advice.timestamp = moment(row[3])
+        return advice
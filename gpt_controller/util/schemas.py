@@ -0,0 +1,137 @@
+from gpt_controller.util.tokens import schema_tokens
+from dataclasses import dataclass
+from inspect import signature, Parameter
+from typing import Callable, get_origin, get_args
+from enum import Enum
+import json
+
+JSON_TYPES = {
+    str: "string",
+    int: "integer",
+    float: "number",
+    bool: "boolean",
+    list: "array",
+    dict: "object"
+}
+
+# Decorator that registers a method as a function that can be called by the language model
+# The JSON schema of its parameters is generated from its signature, unless `parameters` is given.
+# `descriptions` holds the description of every parameter by name.
+def action(description: str, parameters: dict = None, **descriptions):
+    def register(function: Callable) -> Callable:
+        function.action = {
+            "name": function.__name__,
+            "description": description,
+            "parameters": parameters,
+            "descriptions": descriptions
+        }
+        return function
+    return register
+
+# Decorator that attaches a local precondition to an action, naming a method of the same object
+# The action is only offered when the precondition holds, or always if `check` is None. `infer` names a method that receives the goal
+# and the knowledge of the caller and returns the arguments of the action when they can be inferred without the language model, otherwise None.
+def precondition(check: str, infer: str = None):
+    def register(function: Callable) -> Callable:
+        function.precondition = check
+        function.infer = infer
+        return function
+    return register
+
+# Function that returns the JSON schema of a parameter annotation
+def annotation_schema(annotation) -> dict:
+    origin = get_origin(annotation) or annotation
+    if isinstance(origin, type) and issubclass(origin, Enum):
+        return {"type": "string", "enum": list(origin.__members__.keys())}
+    schema = {"type": JSON_TYPES.get(origin, "string")}
+    if origin is list and get_args(annotation):
+        schema["items"] = annotation_schema(get_args(annotation)[0])
+    return schema
+
+# Function that generates the JSON schema of the parameters of a function from its signature
+def parameters_schema(function: Callable, descriptions: dict[str, str] = None) -> dict:
+    descriptions = descriptions if descriptions is not None else {}
+    properties = {}
+    required = []
+    for parameter in signature(function).parameters.values():
+        if parameter.name == "self" or parameter.kind in (Parameter.VAR_POSITIONAL, Parameter.VAR_KEYWORD):
+            continue
+        property = annotation_schema(parameter.annotation) if parameter.annotation is not Parameter.empty else {"type": "string"}
+        if parameter.name in descriptions:
+            property["description"] = descriptions[parameter.name]
+        properties[parameter.name] = property
+        if parameter.default is Parameter.empty:
+            required.append(parameter.name)
+    schema = {"type": "object", "properties": properties}
+    if required:
+        schema["required"] = required
+    return schema
+
+@dataclass
+class FunctionSpec:
+    name : str
+    attribute : str
+    schema : dict
+    serialized : str
+    token_count : int
+    precondition : str = None
+    infer : str = None
+
+# Registry of the functions of an object that are registered with the `action` decorator
+# Schemas are generated, serialized and counted once per class, and are selected by name.
+class FunctionRegistry():
+    specs_by_class : dict[type, dict[str, FunctionSpec]] = {}
+
+    def __init__(self, instance: object):
+        self.instance = instance
+        self.specs = self.class_specs(type(instance))
+        self.functions : dict[str, Callable] = {name: getattr(instance, spec.attribute) for name, spec in self.specs.items()}
+
+    @classmethod
+    def class_specs(cls, owner: type) -> dict[str, FunctionSpec]:
+        if owner not in cls.specs_by_class:
+            specs : dict[str, FunctionSpec] = {}
+            for klass in reversed(owner.__mro__):
+                for attribute, member in vars(klass).items():
+                    if callable(member) and hasattr(member, "action"):
+                        action = member.action
+                        schema = {
+                            "name": action["name"],
+                            "description": action["description"],
+                            "parameters": action["parameters"] if action["parameters"] is not None else parameters_schema(member, action["descriptions"])
+                        }
+                        specs[action["name"]] = FunctionSpec(action["name"], attribute, schema, json.dumps(schema), schema_tokens(schema),
+                                                             getattr(member, "precondition", None), getattr(member, "infer", None))
+            cls.specs_by_class[owner] = specs
+        return cls.specs_by_class[owner]
+
+    def names(self) -> list[str]:
+        return list(self.specs.keys())
+
+    # Function that returns the schemas of the functions with the given names, or of all functions
+    def schemas(self, names: list[str] = None) -> list[dict]:
+        if names is None:
+            return [spec.schema for spec in self.specs.values()]
+        return [self.specs[name].schema for name in names]
+
+    # Function that returns the dispatch table of the functions with the given names, or of all functions
+    def select(self, names: list[str] = None) -> dict[str, Callable]:
+        if names is None:
+            return dict(self.functions)
+        return {name: self.functions[name] for name in names}
+
+    def tokens(self, names: list[str] = None) -> int:
+        names = names if names is not None else self.names()
+        return sum(self.specs[name].token_count for name in names)
+
+    # Function that returns the names of the functions whose preconditions currently hold
+    # `known` is the knowledge of the caller, passed to the preconditions so they only consider known objects
+    def feasible(self, names: list[str] = None, known=None) -> list[str]:
+        names = names if names is not None else self.names()
+        return [name for name in names if self.specs[name].precondition is None or getattr(self.instance, self.specs[name].precondition)(known)]
+
+    # Function that returns the arguments of a function inferred from the goal, or None if they cannot be inferred
+    def infer_arguments(self, name: str, goal: str, known=None) -> dict:
+        if self.specs[name].infer is None:
+            return None
+        return getattr(self.instance, self.specs[name].infer)(goal, known)
@@ -0,0 +1,108 @@
+from gpt_controller.util.models import Object
+from gpt_controller.config import *
+from typing import Iterator
+import itertools
+import math
+
+# Function that returns the position of an object
+def position(object: Object) -> tuple[float, float, float]:
+    return (object.x, object.y, object.z)
+
+# Uniform grid over the positions of objects, kept current by the stores holding the objects when they move.
+# Queries only visit the cells overlapping the queried region, or the occupied cells when there are fewer of them,
+# so their cost depends on the objects near the region and not on the number of objects in the scene.
+class SpatialGrid():
+
+    def __init__(self, cell_size: float = SPATIAL_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells : dict[tuple[int, int, int], dict[Object, None]] = {}
+        self.locations : dict[Object, tuple[int, int, int]] = {}
+
+    def cell(self, position: tuple[float, float, float]) -> tuple[int, int, int]:
+        return tuple(math.floor(coordinate / self.cell_size) for coordinate in position)
+
+    def insert(self, object: Object):
+        if object in self.locations:
+            return self.move(object)
+        cell = self.cell(position(object))
+        self.cells.setdefault(cell, {})[object] = None
+        self.locations[object] = cell
+
+    def remove(self, object: Object):
+        cell = self.locations.pop(object, None)
+        if cell is None:
+            return
+        bucket = self.cells[cell]
+        del bucket[object]
+        if not bucket:
+            del self.cells[cell]
+
+    # Function called when the position of an object changed
+    def move(self, object: Object):
+        previous = self.locations.get(object)
+        cell = self.cell(position(object))
+        if previous == cell:
+            return
+        if previous is not None:
+            self.remove(object)
+        self.cells.setdefault(cell, {})[object] = None
+        self.locations[object] = cell
+
+    # Function that returns the objects of the cells between two corner cells, scanning the occupied cells instead
+    # when the region holds more cells than there are occupied cells
+    def objects_between(self, lower: tuple[int, int, int], upper: tuple[int, int, int]) -> Iterator[Object]:
+        volume = math.prod(high - low + 1 for low, high in zip(lower, upper))
+        if volume > len(self.cells):
+            for cell, bucket in self.cells.items():
+                if all(low <= index <= high for low, index, high in zip(lower, cell, upper)):
+                    yield from bucket
+        else:
+            for cell in itertools.product(*(range(low, high + 1) for low, high in zip(lower, upper))):
+                yield from self.cells.get(cell, ())
+
+    # Function that returns the objects within `radius` of a position, nearest first
+    def within(self, center: tuple[float, float, float], radius: float) -> list[Object]:
+        lower = self.cell([coordinate - radius for coordinate in center])
+        upper = self.cell([coordinate + radius for coordinate in center])
+        found = [(math.dist(center, position(object)), object) for object in self.objects_between(lower, upper)]
+        return [object for distance, object in sorted(found, key=lambda item: item[0]) if distance <= radius]
+
+    # Function that returns the `k` objects nearest to a position, optionally no further than `radius`
+    # Rings of cells are visited outwards until the k-th nearest object found is closer than the visited rings reach
+    def nearest(self, center: tuple[float, float, float], k: int, radius: float = None) -> list[Object]:
+        if k <= 0 or not self.locations:
+            return []
+        origin = self.cell(center)
+        found : list[tuple[float, Object]] = []
+        ring = 0
+        while True:
+            if (2 * ring + 1) ** 3 > len(self.cells):
+                lower = tuple(index - ring + 1 for index in origin)
+                upper = tuple(index + ring - 1 for index in origin)
+                found.extend((math.dist(center, position(object)), object) for cell, bucket in self.cells.items()
+                             if not all(low <= index <= high for low, index, high in zip(lower, cell, upper))
+                             for object in bucket)
+                break
+            for cell in self.ring(origin, ring):
+                found.extend((math.dist(center, position(object)), object) for object in self.cells.get(cell, ()))
+            reach = ring * self.cell_size
+            found.sort(key=lambda item: item[0])
+            if (len(found) >= k and found[k - 1][0] <= reach) or (radius is not None and radius <= reach):
+                break
+            ring += 1
+        found.sort(key=lambda item: item[0])
+        return [object for distance, object in found if radius is None or distance <= radius][:k]
+
+    # Function that returns the objects whose position lies in the axis-aligned box between two corners
+    def box(self, minimum: tuple[float, float, float], maximum: tuple[float, float, float]) -> list[Object]:
+        return [object for object in self.objects_between(self.cell(minimum), self.cell(maximum))
+                if all(low <= coordinate <= high for low, coordinate, high in zip(minimum, position(object), maximum))]
+
+    @staticmethod
+    def ring(origin: tuple[int, int, int], ring: int) -> Iterator[tuple[int, int, int]]:
+        for offset in itertools.product(range(-ring, ring + 1), repeat=3):
+            if max(abs(index) for index in offset) == ring:
+                yield tuple(index + shift for index, shift in zip(origin, offset))
+
+    def __len__(self) -> int:
+        return len(self.locations)
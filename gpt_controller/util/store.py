@@ -0,0 +1,140 @@
+from gpt_controller.util.models import Object, Capability, INDEXED_ATTRIBUTES
+from typing import Iterator, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from gpt_controller.util.table import ObjectTable
+    from gpt_controller.util.spatial import SpatialGrid
+
+# Collection of objects indexed by name and id, with secondary indices on their indexed attributes
+# and capabilities. Objects notify the stores they belong to when an indexed attribute changes,
+# so the indices stay current when objects are mutated in place. `version` changes with every change of the indices.
+# With a `table`, the geometry of the objects of the store is held in the columns of the table and their
+# names, supports, containers and capabilities are mirrored in it,
+# and with a `spatial` index, the positions of the objects are indexed as they move.
+class ObjectStore():
+
+    def __init__(self, objects: list[Object] = None, table: "ObjectTable" = None, spatial: "SpatialGrid" = None):
+        self.table = table
+        self.spatial = spatial
+        self.membership : tuple[ObjectStore] = (self,)
+        self.version : int = 0
+        self.objects : dict[str, Object] = {}
+        self.ids : dict[int, Object] = {}
+        self.indices : dict[str, dict[any, dict[str, Object]]] = {attribute: {} for attribute in INDEXED_ATTRIBUTES if attribute not in ("name", "id", "capabilities")}
+        self.capabilities : dict[Capability, dict[str, Object]] = {}
+        if objects is not None:
+            for object in objects:
+                self.add(object)
+
+    # Function that adds an object, replacing the object with the same name if there is one
+    def add(self, object: Object) -> Object:
+        if object.name in self.objects:
+            self.remove(object.name)
+        self.objects[object.name] = object
+        self.ids[object.id] = object
+        for attribute, index in self.indices.items():
+            index.setdefault(getattr(object, attribute, None), {})[object.name] = object
+        for capability in object.capabilities.members():
+            self.capabilities.setdefault(capability, {})[object.name] = object
+        if self.table is not None:
+            self.table.attach(object)
+        if self.spatial is not None:
+            self.spatial.insert(object)
+        object.stores = object.stores + self.membership if object.stores else self.membership
+        self.version += 1
+        return object
+
+    def remove(self, name: str) -> bool:
+        object = self.objects.pop(name, None)
+        if object is None:
+            return False
+        self.ids.pop(object.id, None)
+        for attribute, index in self.indices.items():
+            self.unindex(index, getattr(object, attribute, None), name)
+        for capability in object.capabilities.members():
+            self.unindex(self.capabilities, capability, name)
+        if self.table is not None:
+            self.table.detach(object)
+        if self.spatial is not None:
+            self.spatial.remove(object)
+        object.stores = tuple(store for store in object.stores if store is not self)
+        self.version += 1
+        return True
+
+    def get(self, name: str) -> Object:
+        return self.objects.get(name)
+
+    def get_by_id(self, id: int) -> Object:
+        return self.ids.get(id)
+
+    # Function that returns the objects matching every criterion, e.g. find(color="red", capability=Capability.CUTTABLE)
+    def find(self, capability: Capability = None, **criteria) -> list[Object]:
+        buckets = []
+        if capability is not None:
+            buckets.append(self.capabilities.get(capability, {}))
+        for attribute, value in criteria.items():
+            if attribute not in self.indices:
+                raise Exception("Attribute {} is not indexed".format(attribute))
+            buckets.append(self.indices[attribute].get(value, {}))
+        if not buckets:
+            return list(self.objects.values())
+        buckets.sort(key=len)
+        return [object for name, object in buckets[0].items() if all(name in bucket for bucket in buckets[1:])]
+
+    # Function called by an object of the store when one of its indexed attributes changed
+    def reindex(self, object: Object, attribute: str, previous, value):
+        self.version += 1
+        if self.table is not None:
+            self.table.update(object, attribute)
+        if attribute == "name":
+            if self.objects.get(previous) is not object:
+                return
+            del self.objects[previous]
+            self.objects[value] = object
+            for index in list(self.indices.values()) + [self.capabilities]:
+                for bucket in index.values():
+                    if previous in bucket:
+                        bucket[value] = bucket.pop(previous)
+        elif attribute == "id":
+            self.ids.pop(previous, None)
+            self.ids[value] = object
+        elif attribute == "capabilities":
+            for capability in previous.members() if previous is not None else ():
+                self.unindex(self.capabilities, capability, object.name)
+            for capability in value.members():
+                self.capabilities.setdefault(capability, {})[object.name] = object
+        elif attribute in self.indices:
+            self.unindex(self.indices[attribute], previous, object.name)
+            self.indices[attribute].setdefault(value, {})[object.name] = object
+
+    # Function called by an object of the store when it gained or lost a capability
+    def reindex_capability(self, object: Object, capability: Capability, present: bool):
+        self.version += 1
+        if self.table is not None:
+            self.table.update(object, "capabilities")
+        if present:
+            self.capabilities.setdefault(capability, {})[object.name] = object
+        else:
+            self.unindex(self.capabilities, capability, object.name)
+
+    # Function called by an object of the store when its position changed
+    def move(self, object: Object):
+        if self.spatial is not None:
+            self.spatial.move(object)
+
+    @staticmethod
+    def unindex(index: dict, value, name: str):
+        bucket = index.get(value)
+        if bucket is not None:
+            bucket.pop(name, None)
+            if not bucket:
+                del index[value]
+
+    def __iter__(self) -> Iterator[Object]:
+        return iter(list(self.objects.values()))
+
+    def __len__(self) -> int:
+        return len(self.objects)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.objects
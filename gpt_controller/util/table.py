@@ -0,0 +1,138 @@
+from gpt_controller.util.models import Object, Capability, GEOMETRY_ATTRIBUTES
+from gpt_controller.config import *
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Attributes of an object naming an object, held in the table as codes of the names
+REFERENCE_ATTRIBUTES = ("name", "support_surface", "container")
+
+# Struct-of-arrays table holding the geometry of the objects attached to it: one contiguous float column
+# per attribute of GEOMETRY_ATTRIBUTES, one row per object. Attached objects read and write their geometry
+# through the table, rows of detached objects are reused and the table doubles its capacity when full.
+# The names, supports, containers and capabilities of the objects are mirrored in integer columns by the
+# store holding them, so queries over every object of the table are computed in single vectorized calls.
+# Arrays returned by the queries have one entry per allocated row; `select` turns a mask into objects.
+class ObjectTable():
+
+    def __init__(self, capacity: int = OBJECT_TABLE_CAPACITY):
+        if np is None:
+            raise Exception("NumPy is required for the object table")
+        self.columns = np.zeros((len(GEOMETRY_ATTRIBUTES), capacity), dtype=np.float64)
+        self.references = np.full((len(REFERENCE_ATTRIBUTES), capacity), -1, dtype=np.int64)
+        self.capabilities = np.zeros(capacity, dtype=np.int64)
+        self.occupied = np.zeros(capacity, dtype=bool)
+        self.objects : list[Object] = [None] * capacity
+        self.free : list[int] = []
+        self.size : int = 0
+        self.codes : dict[str, int] = {}
+
+    # Function that moves the geometry of an object into a row of the table
+    def attach(self, object: Object) -> int:
+        if object.table is self:
+            return object.row
+        if object.table is not None:
+            raise Exception("Object {} is attached to another table".format(object.name))
+        row = self.free.pop() if self.free else self.allocate()
+        for column, attribute in enumerate(GEOMETRY_ATTRIBUTES):
+            self.columns[column, row] = getattr(object, attribute)
+            setattr(object, "_" + attribute, 0)
+        self.occupied[row] = True
+        self.objects[row] = object
+        object.row = row
+        object.table = self
+        for attribute in REFERENCE_ATTRIBUTES + ("capabilities",):
+            self.update(object, attribute)
+        return row
+
+    # Function that moves the geometry of an object back into the object and frees its row
+    def detach(self, object: Object):
+        if object.table is not self:
+            return
+        values = [self.columns[column, object.row].item() for column in range(len(GEOMETRY_ATTRIBUTES))]
+        row = object.row
+        object.table = None
+        object.row = None
+        for attribute, value in zip(GEOMETRY_ATTRIBUTES, values):
+            setattr(object, attribute, value)
+        self.references[:, row] = -1
+        self.capabilities[row] = 0
+        self.occupied[row] = False
+        self.objects[row] = None
+        self.free.append(row)
+
+    # Function called by the store of an attached object when one of its indexed attributes changed
+    def update(self, object: Object, attribute: str):
+        if object.table is not self:
+            return
+        if attribute in REFERENCE_ATTRIBUTES:
+            self.references[REFERENCE_ATTRIBUTES.index(attribute), object.row] = self.code(getattr(object, attribute))
+        elif attribute == "capabilities":
+            self.capabilities[object.row] = int(object.capabilities)
+
+    # Function that returns the code of a name, -1 for no name
+    def code(self, name: str) -> int:
+        if name is None:
+            return -1
+        return self.codes.setdefault(name, len(self.codes))
+
+    def allocate(self) -> int:
+        if self.size == len(self.objects):
+            capacity = max(2 * self.size, 1)
+            self.columns = self.grow(self.columns, capacity, 0)
+            self.references = self.grow(self.references, capacity, -1)
+            self.capabilities = self.grow(self.capabilities, capacity, 0)
+            self.occupied = self.grow(self.occupied, capacity, False)
+            self.objects.extend([None] * (capacity - self.size))
+        self.size += 1
+        return self.size - 1
+
+    def grow(self, array, capacity: int, fill):
+        grown = np.full(array.shape[:-1] + (capacity,), fill, dtype=array.dtype)
+        grown[..., :self.size] = array[..., :self.size]
+        return grown
+
+    # Function that returns the column of an attribute over the allocated rows, free rows included
+    def column(self, attribute: str):
+        return self.columns[GEOMETRY_ATTRIBUTES.index(attribute), :self.size]
+
+    # Function that returns the distances from a location to every object, infinite for free rows
+    def distances(self, location: tuple[float, float, float]):
+        offsets = self.columns[:3, :self.size] - np.asarray(location, dtype=np.float64).reshape(3, 1)
+        distances = np.sqrt(np.einsum("ij,ij->j", offsets, offsets))
+        distances[~self.occupied[:self.size]] = np.inf
+        return distances
+
+    def reach_mask(self, location: tuple[float, float, float], distance: float):
+        return self.distances(location) <= distance
+
+    # Function that returns the mask of the objects having every capability of `capability`
+    def capability_mask(self, capability: Capability):
+        return (self.capabilities[:self.size] & int(capability)) == int(capability)
+
+    # Functions that return the masks of the objects supported by or contained in the named object
+    def support_mask(self, name: str):
+        return self.reference_mask("support_surface", name)
+
+    def containment_mask(self, name: str):
+        return self.reference_mask("container", name)
+
+    def reference_mask(self, attribute: str, name: str):
+        code = self.codes.get(name)
+        if code is None:
+            return np.zeros(self.size, dtype=bool)
+        return self.references[REFERENCE_ATTRIBUTES.index(attribute), :self.size] == code
+
+    # Function that returns the mask of the given objects, ignoring the objects not attached to the table
+    def mask_of(self, objects: list[Object]):
+        mask = np.zeros(self.size, dtype=bool)
+        mask[[object.row for object in objects if object.table is self]] = True
+        return mask
+
+    def select(self, mask) -> list[Object]:
+        return [self.objects[row] for row in np.flatnonzero(mask)]
+
+    def __len__(self) -> int:
+        return self.size - len(self.free)
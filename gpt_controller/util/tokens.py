@@ -0,0 +1,42 @@
+from gpt_controller.config import *
+from functools import lru_cache
+import threading
+import tiktoken
+import json
+
+_schema_tokens : dict[str, tuple[dict, int]] = {}
+_schema_lock = threading.Lock()
+
+# Function that returns the tokenizer of a model, loaded only once per model
+@lru_cache(maxsize=None)
+def get_encoding(model: str = CHATGPT_MODEL):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+def count_tokens(text: str) -> int:
+    return len(get_encoding().encode(text))
+
+# Function that returns the number of tokens of a message in the chat format
+# Inspired from: https://platform.openai.com/docs/guides/gpt/managing-tokens
+def message_tokens(content: dict) -> int:
+    num_tokens = 4  # every message follows <im_start>{role/name}\n{content}<im_end>\n
+    for key, value in content.items():
+        if value is None:
+            continue
+        num_tokens += count_tokens(value if isinstance(value, str) else json.dumps(value, default=str))
+        if key == "name":  # if there's a name, the role is omitted
+            num_tokens += -1  # role is always required and always 1 token
+    return num_tokens
+
+# Function that returns the number of tokens of a function schema
+# The count is computed once per schema object and reused until a different schema with the same name is seen
+def schema_tokens(schema: dict) -> int:
+    cached = _schema_tokens.get(schema["name"])
+    if cached is not None and cached[0] is schema:
+        return cached[1]
+    num_tokens = count_tokens(json.dumps(schema))
+    with _schema_lock:
+        _schema_tokens[schema["name"]] = (schema, num_tokens)
+    return num_tokens
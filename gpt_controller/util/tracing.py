@@ -0,0 +1,170 @@
+from gpt_controller.config import *
+from dataclasses import dataclass, field
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable
+import threading
+import secrets
+import json
+import time
+import os
+
+@dataclass
+class Span:
+    name : str
+    trace_id : str
+    span_id : str
+    parent_id : str = None
+    start_time : int = 0 # ns since epoch
+    end_time : int = 0 # ns since epoch
+    thread_id : int = 0
+    attributes : dict = field(default_factory=dict)
+
+# Records nested spans of the work done in a turn, with one span stack per thread
+# Finished spans are kept in memory and exported as Chrome trace events (viewable in Perfetto)
+# or as OTLP JSON.
+class Tracer():
+
+    def __init__(self, enabled: bool = TRACING, path: str = TRACE_PATH, max_spans: int = TRACE_MAX_SPANS):
+        self.enabled = enabled
+        self.path = path
+        self.spans : deque[Span] = deque(maxlen=max_spans)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def stack(self) -> list[Span]:
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    def current(self) -> Span:
+        stack = self.stack()
+        return stack[-1] if stack else None
+
+    # Context manager that records a span, nested in the current span of the thread or in `parent`
+    @contextmanager
+    def span(self, name: str, parent: Span = None, **attributes):
+        if not self.enabled:
+            yield None
+            return
+        parent = parent if parent is not None else self.current()
+        span = Span(name,
+                    parent.trace_id if parent is not None else secrets.token_hex(16),
+                    secrets.token_hex(8),
+                    parent.span_id if parent is not None else None,
+                    time.time_ns(),
+                    thread_id=threading.get_ident(),
+                    attributes=attributes)
+        stack = self.stack()
+        stack.append(span)
+        try:
+            yield span
+        except Exception as e:
+            span.attributes["error"] = str(e)
+            raise
+        finally:
+            span.end_time = time.time_ns()
+            stack.pop()
+            with self.lock:
+                self.spans.append(span)
+
+    # Function that adds attributes to the current span
+    def annotate(self, **attributes):
+        span = self.current()
+        if span is not None:
+            span.attributes.update(attributes)
+
+    # Function that wraps a function submitted to another thread so that its spans nest in the current span
+    def propagate(self, function: Callable) -> Callable:
+        parent = self.current()
+        if parent is None:
+            return function
+        @wraps(function)
+        def run(*args, **kwargs):
+            stack = self.stack()
+            stack.append(parent)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                stack.pop()
+        return run
+
+    def clear(self):
+        with self.lock:
+            self.spans.clear()
+
+    # Function that returns the finished spans as Chrome trace events
+    def chrome_trace(self) -> dict:
+        with self.lock:
+            spans = list(self.spans)
+        events = []
+        for span in spans:
+            events.append({
+                "name": span.name,
+                "cat": span.name.split(".")[0],
+                "ph": "X",
+                "ts": span.start_time / 1000,
+                "dur": (span.end_time - span.start_time) / 1000,
+                "pid": os.getpid(),
+                "tid": span.thread_id,
+                "args": {key: value if isinstance(value, (str, int, float, bool)) else str(value) for key, value in span.attributes.items()}
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    # Function that returns the finished spans in the OTLP JSON format
+    def otlp_trace(self) -> dict:
+        with self.lock:
+            spans = list(self.spans)
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "gpt_controller"}}]},
+            "scopeSpans": [{
+                "scope": {"name": "gpt_controller.util.tracing"},
+                "spans": [{
+                    "traceId": span.trace_id,
+                    "spanId": span.span_id,
+                    "parentSpanId": span.parent_id or "",
+                    "name": span.name,
+                    "kind": 1,
+                    "startTimeUnixNano": str(span.start_time),
+                    "endTimeUnixNano": str(span.end_time),
+                    "attributes": [{"key": key, "value": otlp_value(value)} for key, value in span.attributes.items()],
+                    "status": {"code": 2, "message": span.attributes["error"]} if "error" in span.attributes else {}
+                } for span in spans]
+            }]
+        }]}
+
+    # Function that writes the Chrome and OTLP traces to `trace.json` and `trace.otlp.json` in `path`
+    def export(self, path: str = None):
+        path = path if path is not None else self.path
+        if path is None or not self.spans:
+            return
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "trace.json"), "w") as f:
+            json.dump(self.chrome_trace(), f)
+        with open(os.path.join(path, "trace.otlp.json"), "w") as f:
+            json.dump(self.otlp_trace(), f)
+
+def otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+tracer = Tracer()
+
+# Decorator that records a span around every call of a function, named after the function by default
+def traced(name: str = None):
+    def register(function: Callable) -> Callable:
+        span_name = name if name is not None else function.__qualname__
+        @wraps(function)
+        def run(*args, **kwargs):
+            if not tracer.enabled:
+                return function(*args, **kwargs)
+            with tracer.span(span_name):
+                return function(*args, **kwargs)
+        return run
+    return register
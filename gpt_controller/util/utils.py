@@ -0,0 +1,9 @@
+import hashlib
+import json
+
+# Function that computes a stable content hash of a completion request
+# The same messages and function schemas always produce the same key
+def request_key(messages: list[dict], functions: list[dict] = None, model: str = None) -> str:
+    payload = {"model": model, "messages": messages, "functions": functions}
+    serialized = json.dumps(payload, sort_keys=True, default=str, separators=(',', ':'))
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
@@ -1,14 +1,18 @@
 import random
 from colorama import Fore, Style
 from gpt_controller.cognition.machine import Machine
+from gpt_controller.cognition.backend import OfflineBackend
 from gpt_controller.playground.environment import Environment
+from gpt_controller.util.tracing import tracer
 
 if __name__ == "__main__":
     environment = Environment('kitchen')
     machine = Machine(environment)
 
     # You can change the information that the machine should start with in mind by setting basic_knowledge
-    machine.fill_memory_with_objects(environment.objects, basic_knowledge=True)
+    # A machine with a persistent memory keeps the knowledge it had at its last run
+    if len(machine.object_knowledge) == 0:
+        machine.fill_memory_with_objects(environment.objects, basic_knowledge=True)
 
     try:
         while True:
@@ -19,9 +23,8 @@ if __name__ == "__main__":
                     for object in machine.object_knowledge:
                         print(object)
                 elif user_input == "--objects_unknown":
-                    objects = [object.name for object in machine.object_knowledge]
                     for object in environment.objects:
-                        if object.name not in objects:
+                        if object.name not in machine.object_knowledge:
                             print(object)
                 elif user_input == "--objects_in_environment":
                     for object in environment.objects:
@@ -29,19 +32,56 @@ if __name__ == "__main__":
                 elif user_input == "--tasks":
                     for task in machine.task_stack:
                         print(task)
+                elif user_input == "--cache":
+                    if machine.cache is not None:
+                        print(machine.cache.stats())
+                elif user_input == "--fast_labels":
+                    if machine.classifier is not None:
+                        print(machine.classifier.stats())
+                elif user_input == "--telemetry":
+                    if machine.telemetry is not None:
+                        for type, aggregates in machine.telemetry.summary().items():
+                            print("{}: {}".format(type, aggregates))
+                elif user_input == "--budget":
+                    print("{} tokens spent of {}, tier {}".format(machine.governor.used, machine.governor.limit, machine.governor.tier.name))
+                elif user_input == "--rate_limit":
+                    if machine.rate_limiter is not None:
+                        print(machine.rate_limiter.stats())
+                elif user_input == "--retrieval":
+                    if machine.retriever is not None:
+                        print(machine.retriever.stats())
                 elif user_input == "--help":
                     print("Available commands:")
                     print("--objects_known: list all objects")
                     print("--objects_unknown: list all objects that are not known to the machine")
                     print("--objects_in_environment: list all objects in the environment")
                     print("--tasks: list all tasks")
+                    print("--cache: show completion cache statistics")
+                    print("--fast_labels: show how often the local classifier bypassed the model")
+                    print("--telemetry: show latency and token percentiles per conversation type")
+                    print("--budget: show the tokens spent and the degradation tier of the token budget")
+                    print("--rate_limit: show the state of the shared rate limiter")
+                    print("--retrieval: show how often the objects acted upon were among the retrieved objects")
                 continue
             else:
-                if user_input != "":
-                    print(Fore.CYAN + "User: {}".format(user_input))
-                    machine.parse_user_input(user_input)
-                machine.step()
+                with tracer.span("turn", input=user_input):
+                    if user_input != "":
+                        print(Fore.CYAN + "User: {}".format(user_input))
+                        machine.parse_user_input(user_input)
+                    machine.step()
                 if machine.task_stack: machine.task_stack[-1].print_conclusion()
+                if machine.finished():
+                    print(Fore.YELLOW + "Robot: My token budget is spent and my tasks are finished." + Style.RESET_ALL)
+                    break
 
     except EOFError:
-        print(Fore.RED + "\nExiting..." + Style.RESET_ALL)
\ No newline at end of file
+        pass
+    if isinstance(machine.backend, OfflineBackend) and machine.backend.record_from is not None:
+        machine.backend.save()
+    if machine.telemetry is not None:
+        machine.telemetry.export()
+    tracer.export()
+    if machine.memory is not None:
+        machine.memory.save(machine)
+        machine.memory.close()
+    print(Fore.RED + "\nExiting..." + Style.RESET_ALL)
\ No newline at end of file
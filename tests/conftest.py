@@ -0,0 +1,13 @@
+import shutil
+import os
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Working directory of a test creating a machine, holding a copy of the prompts
+# The cache, telemetry and traces written by the machine end up in it instead of the repository
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    shutil.copytree(os.path.join(ROOT, "prompts"), tmp_path / "prompts")
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
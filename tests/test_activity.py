@@ -0,0 +1,82 @@
+from gpt_controller.util.activity import ActivityLog, TaskStack
+from gpt_controller.util.models import Task
+from gpt_controller.util.labels import TaskLabel
+import pytest
+
+def tasks(count: int) -> list[Task]:
+    return [Task(TaskLabel.COGNITION, "Task {}".format(index)) for index in range(count)]
+
+def goals(entries: list[Task]) -> list[str]:
+    return [task.goal for task in entries]
+
+# Log of ten tasks logged one second apart, at times 100 to 109
+@pytest.fixture
+def log():
+    log = ActivityLog(capacity=20)
+    for index, task in enumerate(tasks(10)):
+        log.append(task, 100.0 + index)
+    return log
+
+# A window holds the tasks logged after `now - time_span`: a task logged exactly `time_span` ago is left out
+def test_window_holds_the_tasks_logged_within_the_time_span(log):
+    assert goals(log.window(3, now=109)) == ["Task 7", "Task 8", "Task 9"]
+    assert goals(log.window(2.5, now=109)) == ["Task 7", "Task 8", "Task 9"]
+    assert goals(log.window(0, now=109)) == []
+    assert goals(log.window(0.5, now=108.5)) == ["Task 9"]
+    assert goals(log.window(100, now=109)) == goals(log.window())
+    assert goals(log.window(9, now=109)) == goals(log.window())[1:]
+    assert log.window(5, now=200) == []
+
+def test_window_limit_keeps_the_most_recent_tasks(log):
+    assert goals(log.window(limit=2)) == ["Task 8", "Task 9"]
+    assert goals(log.window(5, limit=2, now=109)) == ["Task 8", "Task 9"]
+    assert goals(log.window(2, limit=5, now=109)) == ["Task 8", "Task 9"]
+    assert log.window(limit=0) == []
+    assert len(log.window(limit=50)) == 10
+
+def test_full_log_overwrites_its_oldest_entries():
+    log = ActivityLog(capacity=4)
+    for index, task in enumerate(tasks(10)):
+        log.append(task, float(index))
+    assert len(log) == 4
+    assert goals(log.window()) == ["Task 6", "Task 7", "Task 8", "Task 9"]
+    assert goals(log.window(1.5, now=9)) == ["Task 8", "Task 9"]
+    assert [timestamp for timestamp, task in log] == [6.0, 7.0, 8.0, 9.0]
+    with pytest.raises(IndexError):
+        log[4]
+
+def test_tasks_are_logged_once_and_in_order():
+    log = ActivityLog(capacity=10)
+    first, second = tasks(2)
+    assert log.append(first, 10.0)
+    assert not log.append(first, 11.0)
+    log.append(second, 5.0)
+    assert [timestamp for timestamp, task in log] == [10.0, 10.0]
+    log.clear()
+    assert len(log) == 0 and log.append(first, 1.0)
+
+# The log of a stack is the history of the tasks pushed onto it, kept when they are trimmed from the stack
+def test_task_stack_logs_every_pushed_task():
+    stack = TaskStack()
+    first, second, third = tasks(3)
+    stack.append(first)
+    stack += [second]
+    stack.insert(0, third)
+    stack.append(first)
+    del stack[:]
+    assert stack == []
+    assert goals(stack.log.window()) == ["Task 0", "Task 1", "Task 2"]
+
+# Popped tasks, such as the recall tasks of the machine, are left out of the log until they are pushed again
+def test_popped_tasks_leave_the_log():
+    stack = TaskStack()
+    first, second, third = tasks(3)
+    stack += [first, second, third]
+    assert stack.pop() is third
+    assert goals(stack.log.window()) == ["Task 0", "Task 1"]
+    assert goals(stack.log.window(limit=1)) == ["Task 1"]
+    stack.pop(0)
+    assert goals(stack.log.window()) == ["Task 1"]
+    stack.append(third)
+    assert goals(stack.log.window()) == ["Task 1", "Task 2"]
+    assert goals(stack.log.window(limit=5)) == ["Task 1", "Task 2"]
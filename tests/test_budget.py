@@ -0,0 +1,61 @@
+from gpt_controller.cognition.budget import ContextBudget, ContextSection, entry_tokens, ELISION_MARKER
+from gpt_controller.util.tokens import schema_tokens
+
+# Function that returns a section of `count` entries of similar length, numbered from oldest to most recent
+def section(name: str, count: int, priority: int = 1) -> ContextSection:
+    return ContextSection(name, name.capitalize() + ":\n", ["{} entry number {}\n".format(name, index) for index in range(count)], priority)
+
+def cost(section: ContextSection) -> int:
+    return entry_tokens(section.header) + sum(entry_tokens(entry) for entry in section.entries)
+
+def test_sections_fitting_the_budget_are_kept_whole():
+    sections = [section("logs", 5), section("objects", 5)]
+    rendered, report = ContextBudget(10000).fit(sections, reserved=100)
+    assert rendered == [item.header + "".join(item.entries) for item in sections]
+    assert report.summary() == ""
+    assert report.used == 100 + sum(cost(item) for item in sections)
+
+def test_least_valuable_entries_are_dropped_first():
+    logs = section("logs", 50)
+    rendered, report = ContextBudget(cost(logs) // 2).fit([logs])
+    assert 0 < report.dropped["logs"] < 50
+    kept = logs.entries[report.dropped["logs"]:]
+    assert rendered[0] == logs.header + ELISION_MARKER.format(report.dropped["logs"]) + "".join(kept)
+    assert report.used <= report.budget
+
+def test_reserved_tokens_count_against_the_budget():
+    logs = section("logs", 50)
+    budget = ContextBudget(cost(logs) + 50)
+    assert budget.fit([logs])[1].dropped.get("logs", 0) == 0
+    assert budget.fit([logs], reserved=cost(logs) // 2)[1].dropped["logs"] > 0
+
+# Sections share the budget by priority, and the share left over by a small section goes to the others
+def test_budget_is_shared_by_priority():
+    logs, objects = section("logs", 60, priority=1), section("objects", 60, priority=3)
+    rendered, report = ContextBudget((cost(logs) + cost(objects)) // 2).fit([logs, objects])
+    assert report.dropped["logs"] > report.dropped["objects"]
+    assert report.used <= report.budget
+
+    small, large = section("advice", 2, priority=1), section("objects", 200, priority=1)
+    rendered, report = ContextBudget(cost(large) // 2).fit([small, large])
+    assert report.dropped["advice"] == 0
+    assert report.dropped["objects"] > 0
+    assert report.used > 0.9 * report.budget
+
+def test_smaller_budgets_can_be_given():
+    logs = section("logs", 50)
+    budget = ContextBudget(10000)
+    assert budget.fit([logs])[1].dropped.get("logs", 0) == 0
+    assert budget.fit([logs], budget=cost(logs) // 2)[1].dropped["logs"] > 0
+
+def test_reserved_tokens_add_messages_and_functions():
+    schema = {"name": "pick_up_object", "description": "Pick up an object.",
+              "parameters": {"type": "object", "properties": {"object_name": {"type": "string"}}}}
+    assert ContextBudget.reserved_tokens([]) == 2
+    assert ContextBudget.reserved_tokens([10, 20]) == 32
+    assert ContextBudget.reserved_tokens([10], [schema]) == 12 + schema_tokens(schema)
+
+def test_sections_are_created_from_loaded_texts():
+    created = ContextSection.from_text("logs", "Task History:\nfirst\nsecond\n", 3)
+    assert (created.header, created.entries, created.priority) == ("Task History:\n", ["first\n", "second\n"], 3)
+    assert ContextSection.from_text("logs", "").entries == []
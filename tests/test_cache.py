@@ -0,0 +1,100 @@
+from gpt_controller.cognition import cache as cache_module
+from gpt_controller.cognition.cache import CompletionCache
+from gpt_controller.cognition.backend import OfflineBackend, text_completion
+from gpt_controller.cognition.machine import Machine
+from gpt_controller.playground.environment import Environment
+from gpt_controller.util.labels import UserInputLabel
+import pytest
+
+# Clock of the cache, moved forward by the tests instead of sleeping
+class Clock():
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache_module.time, "time", clock)
+    return clock
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = CompletionCache(path=None, max_entries=2, ttl=None)
+    cache.put("a", text_completion("A"))
+    cache.put("b", text_completion("B"))
+    assert cache.get("a") is not None
+    cache.put("c", text_completion("C"))
+
+    assert cache.get("b") is None
+    assert cache.get("a")["choices"][0]["message"]["content"] == "A"
+    assert cache.get("c")["choices"][0]["message"]["content"] == "C"
+    assert cache.evictions == 1
+    assert len(cache.memory) == 2
+
+def test_entries_expire_after_their_time_to_live(clock):
+    cache = CompletionCache(path=None, max_entries=10, ttl=60)
+    cache.put("a", text_completion("A"))
+    clock.now += 59
+    assert cache.get("a") is not None
+    clock.now += 2
+    assert cache.get("a") is None
+    assert "a" not in cache.memory
+    assert cache.stats()["misses"] == 1
+
+def test_returned_completions_are_copies(clock):
+    cache = CompletionCache(path=None, ttl=None)
+    cache.put("a", text_completion("A"))
+    cache.get("a")["choices"][0]["message"]["content"] = "changed"
+    assert cache.get("a")["choices"][0]["message"]["content"] == "A"
+
+def test_disk_tier_survives_a_restart(clock, tmp_path):
+    cache = CompletionCache(path=str(tmp_path), max_entries=1, max_disk_entries=10, ttl=None)
+    cache.put("a", text_completion("A"))
+    cache.put("b", text_completion("B"))
+
+    restarted = CompletionCache(path=str(tmp_path), max_entries=1, max_disk_entries=10, ttl=None)
+    assert restarted.get("a")["choices"][0]["message"]["content"] == "A"
+    assert restarted.disk_hits == 1
+    assert "a" in restarted.memory
+
+def test_disk_tier_evicts_the_oldest_entries(clock, tmp_path):
+    cache = CompletionCache(path=str(tmp_path), max_entries=1, max_disk_entries=2, ttl=None)
+    for index, key in enumerate(("a", "b", "c")):
+        clock.now += index
+        cache.put(key, text_completion(key))
+
+    assert sorted(cache.disk_index) == ["b", "c"]
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["b.json", "c.json"]
+
+def test_expired_disk_entries_are_removed(clock, tmp_path):
+    cache = CompletionCache(path=str(tmp_path), max_entries=1, ttl=60)
+    cache.put("a", text_completion("A"))
+    cache.put("b", text_completion("B"))
+    clock.now += 61
+    assert cache.get("a") is None
+    assert not (tmp_path / "a.json").exists()
+
+def test_keys_depend_on_model_messages_and_functions():
+    messages = [{"role": "user", "content": "Pick up the tomato"}]
+    key = CompletionCache.key("model", messages)
+    assert key == CompletionCache.key("model", [dict(message) for message in messages])
+    assert key != CompletionCache.key("other", messages)
+    assert key != CompletionCache.key("model", messages, [{"name": "pick_up_object"}])
+
+# Only completions accepted by their validator are cached, so an invalid label is requested again
+def test_machine_caches_only_valid_labels(workdir):
+    backend = OfflineBackend()
+    backend.script(text_completion("NONSENSE"), times=1)
+    backend.script(text_completion("TASK"))
+    machine = Machine(Environment("kitchen"), backend=backend, cache=CompletionCache(path=None, ttl=None))
+    machine.classifier = None
+
+    machine.request_label("hello robot", UserInputLabel)
+    assert len(machine.cache.memory) == 0
+    assert machine.request_label("hello robot", UserInputLabel)[0] == UserInputLabel.TASK
+    assert machine.request_label("hello robot", UserInputLabel)[0] == UserInputLabel.TASK
+    assert len(machine.cache.memory) == 1
+    assert backend.calls == 2
@@ -0,0 +1,62 @@
+from gpt_controller.cognition import machine as machine_module
+from gpt_controller.cognition.classifier import FastLabelClassifier
+from gpt_controller.cognition.backend import OfflineBackend, text_completion, function_call_completion
+from gpt_controller.cognition.machine import Machine
+from gpt_controller.playground.environment import Environment
+from gpt_controller.util.labels import UserInputLabel, TaskLabel
+import pytest
+
+def test_rules_label_trivial_inputs():
+    classifier = FastLabelClassifier(threshold=0.9)
+    assert classifier.fast_label("Pick up the tomato", UserInputLabel) == UserInputLabel.TASK
+    assert classifier.fast_label("Where is the knife?", UserInputLabel) == UserInputLabel.QUESTION_ENV_KNOWLEDGE
+    assert classifier.fast_label("Stop!", UserInputLabel) == UserInputLabel.ABORT
+    assert classifier.fast_label("Go to the fridge", TaskLabel) == TaskLabel.NAVIGATION
+
+# Inputs no rule trusts are left to the language model
+def test_uncertain_inputs_are_not_labelled():
+    classifier = FastLabelClassifier(threshold=0.9)
+    assert classifier.fast_label("Hello there", UserInputLabel) is None
+    assert classifier.fast_label("What is on the table?", UserInputLabel) is None
+    assert classifier.stats()["consulted"] == {"UserInputLabel": 2}
+    assert classifier.stats()["bypass_rate"] == 0.0
+
+def test_learned_examples_vote_for_similar_inputs():
+    classifier = FastLabelClassifier(threshold=0.5, neighbours=3)
+    classifier.learn("the robot may use the blue knife", UserInputLabel.METHODOLOGY)
+    label, confidence = classifier.classify("the robot may use the knife", UserInputLabel)
+    assert label == UserInputLabel.METHODOLOGY
+    assert 0.5 < confidence <= 1.0
+
+# An example contradicting a rule lowers the confidence of the rule below the threshold
+def test_conflicting_examples_lower_the_confidence():
+    classifier = FastLabelClassifier(threshold=0.9)
+    classifier.learn("pick a colour for the cup", UserInputLabel.QUESTION_GEN_KNOWLEDGE)
+    label, confidence = classifier.classify("pick a colour for the cup", UserInputLabel)
+    assert label == UserInputLabel.QUESTION_GEN_KNOWLEDGE
+    assert classifier.fast_label("pick a colour for the cup", UserInputLabel) is None
+
+def test_examples_are_kept_per_label_type():
+    classifier = FastLabelClassifier(memory_size=2)
+    for index in range(3):
+        classifier.learn("example {}".format(index), TaskLabel.COGNITION)
+    assert len(classifier.examples["TaskLabel"]) == 2
+    assert classifier.classify_with_neighbours("example 1", UserInputLabel) == (None, 0.0)
+
+# Inputs declined by the classifier in label_all are not classified again when they are sent to the language model
+@pytest.mark.parametrize("batching", [True, False])
+def test_machine_consults_the_classifier_once_per_input(workdir, monkeypatch, batching):
+    monkeypatch.setattr(machine_module, "LABEL_BATCHING", batching)
+    backend = OfflineBackend()
+    backend.script(function_call_completion("assign_labels", {"labels": [{"index": 0, "label": "UNCERTAIN"},
+                                                                        {"index": 1, "label": "UNCERTAIN"}]}),
+                   match=lambda messages, functions: functions is not None)
+    backend.script(text_completion("UNCERTAIN"))
+    machine = Machine(Environment("kitchen"), backend=backend, cache=None)
+    machine.cache = None
+    inputs = ["Pick up the tomato", "Hello there", "Nice weather today"]
+
+    labels = machine.label_all(inputs, UserInputLabel)
+    assert labels == [UserInputLabel.TASK, UserInputLabel.UNCERTAIN, UserInputLabel.UNCERTAIN]
+    assert machine.classifier.consulted == {"UserInputLabel": len(inputs)}
+    assert machine.classifier.stats()["bypass_rate"] == pytest.approx(1 / 3)
@@ -0,0 +1,148 @@
+from gpt_controller.cognition import machine as machine_module
+from gpt_controller.cognition.backend import OfflineBackend, text_completion, function_call_completion
+from gpt_controller.cognition.machine import Machine
+from gpt_controller.playground.environment import Environment
+from gpt_controller.util.models import Task, TaskStatus, Message, Role, Object
+from gpt_controller.util.labels import TaskLabel, UserInputLabel
+import pytest
+import time
+
+# Function that returns whether a request offers the named function
+def offers(name: str):
+    return lambda messages, functions: functions is not None and any(function["name"] == name for function in functions)
+
+# Function that returns the function results sent back to the language model
+def function_messages(machine: Machine) -> list[dict]:
+    return [message.content for conversation in machine.conversations for message in conversation.messages
+            if isinstance(message.content, dict) and message.content.get("role") == "function"]
+
+@pytest.fixture
+def backend():
+    return OfflineBackend()
+
+@pytest.fixture
+def machine(workdir, backend):
+    machine = Machine(Environment("kitchen"), backend=backend, cache=None)
+    machine.cache = None
+    return machine
+
+# Arguments of a recalled function are passed by name, so any of them can be given alone
+def test_recall_passes_the_arguments_by_name(machine, backend):
+    for index in range(3):
+        task = Task(TaskLabel.COGNITION, "Task {}".format(index))
+        task.complete("Finished task {}".format(index), True)
+        machine.task_stack.append(task)
+    backend.script(function_call_completion("load_activity_logs", {"frame_size": 1}), match=offers("load_activity_logs"))
+    backend.script(text_completion("The last task was Task 2"))
+
+    assert machine.recall("What did I do last?") == TaskStatus.COMPLETED
+    history = function_messages(machine)[-1]["content"]
+    assert "Finished task 2" in history
+    assert "Finished task 0" not in history and "Finished task 1" not in history
+
+# System prompts are counted with the token count indexed with the prompt, which matches counting the message
+@pytest.mark.parametrize("name", ["act.txt", "decision_making.txt", "label_input.txt"])
+def test_prompt_messages_reuse_the_indexed_token_count(machine, name):
+    message = machine.prompt_message(name)
+    assert message.content == {"role": "system", "content": machine.load_prompt(name)}
+    assert message.token_count == Message(Role.SYSTEM, machine.load_prompt(name)).token_count
+
+# The recall task pushed while acting on a perception task is popped, so only the perception task is logged
+def test_recall_tasks_popped_by_act_are_not_logged(machine, backend):
+    task = Task(TaskLabel.PERCEPTION, "What am I holding?")
+    machine.task_stack.append(task)
+    backend.script(function_call_completion("load_body_status", {}), match=offers("load_body_status"))
+    backend.script(text_completion("I am holding nothing"))
+
+    assert machine.act() == TaskStatus.COMPLETED
+    assert machine.task_stack == [task]
+    assert machine.activity_log.window() == [task]
+    assert machine.activity_log_entries() == ["The robot concluded the following: I am holding nothing\n"]
+
+# The only feasible action is called without asking the language model when the goal names its object
+def test_act_calls_the_only_feasible_action_directly(machine, backend, monkeypatch):
+    monkeypatch.setattr(machine_module, "SCHEMA_PRUNING", True)
+    machine.object_knowledge.add(Object({"name": "tomato"}))
+    machine.task_stack.append(Task(TaskLabel.MANIPULATION, "Pick up the tomato"))
+
+    assert machine.act() == TaskStatus.COMPLETED
+    assert backend.calls == 0
+    assert machine.robot.actuator.object_held.name == "tomato"
+    assert function_messages(machine)[-1]["name"] == "pick_up_object"
+
+# Only the actions feasible with the known objects are offered to the language model
+def test_act_offers_only_the_feasible_actions(machine, backend, monkeypatch):
+    monkeypatch.setattr(machine_module, "SCHEMA_PRUNING", True)
+    machine.object_knowledge.add(Object({"name": "tomato"}))
+    machine.object_knowledge.add(Object({"name": "wall_cabinet"}))
+    offered = []
+    def respond(messages, functions):
+        offered.append([function["name"] for function in functions])
+        return function_call_completion("open_container", {"container_name": "wall_cabinet"})
+    backend.script(respond)
+    machine.task_stack.append(Task(TaskLabel.MANIPULATION, "Open the cabinet"))
+
+    assert machine.act() == TaskStatus.COMPLETED
+    assert offered == [["pick_up_object", "open_container"]]
+    assert function_messages(machine)[-1]["name"] == "open_container"
+
+# Labels come back in the order of the inputs, whichever request completes first
+def test_concurrent_labels_keep_the_order_of_the_inputs(machine, backend, monkeypatch):
+    monkeypatch.setattr(machine_module, "LABEL_CONCURRENCY", 4)
+    labels = [UserInputLabel.TASK, UserInputLabel.QUESTION_ENV_KNOWLEDGE, UserInputLabel.ABORT, UserInputLabel.UNCERTAIN]
+    inputs = ["Input number {}".format(index) for index in range(len(labels))]
+    for index, label in enumerate(labels):
+        backend.script(text_completion(label.name), contains=inputs[index], latency=0.05 * (len(labels) - index))
+
+    start_time = time.monotonic()
+    assert machine.label_concurrently(inputs, UserInputLabel, False) == labels
+    assert time.monotonic() - start_time < 0.05 * sum(range(1, len(labels) + 1))
+    assert [conversation.messages[3].content["content"] for conversation in machine.conversations] == inputs
+
+@pytest.fixture
+def fused(machine, monkeypatch):
+    monkeypatch.setattr(machine_module, "FUSED_DECISION", True)
+    machine.classifier = None
+    machine.task_stack.append(Task(TaskLabel.MANIPULATION, "Put the tomato in the fridge"))
+    return machine
+
+def test_fused_decisions_signal_done(fused, backend):
+    backend.script(function_call_completion("decide", {"done": True}), match=offers("decide"))
+
+    assert fused.make_decision(0) == TaskStatus.COMPLETED
+    assert fused.task_stack[0].status == TaskStatus.COMPLETED
+    assert len(fused.task_stack) == 1
+    assert backend.calls == 1
+
+# A decision coming with its label is pushed without a labelling request
+def test_fused_decisions_carry_their_label(fused, backend):
+    backend.script(function_call_completion("decide", {"done": False, "decision": "Open the fridge", "label": "MANIPULATION"}),
+                   match=offers("decide"))
+
+    assert fused.make_decision(0) == TaskStatus.COMPLETED
+    assert (fused.task_stack[-1].type, fused.task_stack[-1].goal) == (TaskLabel.MANIPULATION, "Open the fridge")
+    assert backend.calls == 1
+
+# Decisions without a valid label are labelled by a separate request
+@pytest.mark.parametrize("label", [None, "USER_INPUT", "DANCING"])
+def test_fused_decisions_without_a_valid_label_are_labelled(fused, backend, label):
+    arguments = {"done": False, "decision": "Open the fridge"}
+    if label is not None:
+        arguments["label"] = label
+    backend.script(function_call_completion("decide", arguments), match=offers("decide"))
+    backend.script(text_completion("NAVIGATION"))
+
+    assert fused.make_decision(0) == TaskStatus.COMPLETED
+    assert fused.task_stack[-1].type == TaskLabel.NAVIGATION
+    assert backend.calls == 2
+
+# Function that returns the message of a fused decision, as validated by the machine
+def decision(arguments: dict | str) -> dict:
+    return function_call_completion("decide", arguments)["choices"][0]["message"]
+
+def test_valid_decisions_are_done_or_hold_a_decision():
+    assert Machine.valid_decision(decision({"done": True}))
+    assert Machine.valid_decision(decision({"done": False, "decision": "Open the fridge"}))
+    assert not Machine.valid_decision(decision({"done": False, "decision": ""}))
+    assert not Machine.valid_decision(decision("{\"done\": tru"))
+    assert not Machine.valid_decision(text_completion("DONE")["choices"][0]["message"])
@@ -0,0 +1,83 @@
+from gpt_controller.util.models import Object, Capability
+from gpt_controller.util.store import ObjectStore
+import random
+import math
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from gpt_controller.playground.environment import Environment
+from gpt_controller.playground.robot import Manipulator
+
+CAPABILITIES = [Capability.VISIBLE, Capability.FIXED, Capability.CUTTABLE, Capability.CONTAINER]
+
+@pytest.fixture
+def environment():
+    environment = Environment("kitchen")
+    if environment.objects.table is None:
+        pytest.skip("the object table is disabled")
+    generator = random.Random(13)
+    supports = [object.name for object in environment.objects]
+    for index in range(200):
+        environment.create_object({"name": "object_{}".format(index),
+                                   "location": tuple(generator.uniform(-5, 5) for _ in range(3)),
+                                   "capabilities": Capability(sum(generator.sample(CAPABILITIES, generator.randrange(3)))),
+                                   "support_surface": generator.choice(supports)})
+    for index in generator.sample(range(200), 30):
+        environment.remove_object("object_{}".format(index))
+    return environment
+
+def names(environment: Environment, mask) -> set[str]:
+    return {object.name for object in environment.object_table().select(mask)}
+
+def test_distances_match_a_scan(environment):
+    location = (1.0, -2.0, 0.5)
+    distances = environment.distances(location)
+    table = environment.object_table()
+    for row in range(table.size):
+        object = table.objects[row]
+        if object is None:
+            assert distances[row] == np.inf
+        else:
+            assert distances[row] == pytest.approx(math.dist(location, (object.x, object.y, object.z)))
+
+def test_reach_masks_match_a_scan(environment):
+    for location in ((0, 0, 0), (3, 3, 3), (-4, 1, 2)):
+        for distance in (0.5, 2.0, 6.0):
+            expected = {object.name for object in environment.objects
+                        if math.dist(location, (object.x, object.y, object.z)) <= distance}
+            assert names(environment, environment.reach_mask(location, distance)) == expected
+
+def test_capability_and_reference_masks_match_a_scan(environment):
+    for capability in CAPABILITIES + [Capability.VISIBLE | Capability.CUTTABLE]:
+        expected = {object.name for object in environment.objects if object.check_capability(capability)}
+        assert names(environment, environment.capability_mask(capability)) == expected
+    for support in ("table", "counter", "floor"):
+        expected = {object.name for object in environment.objects if object.support_surface == support}
+        assert names(environment, environment.support_mask(support)) == expected
+
+# The batched preconditions of the manipulator select the same objects as its object lists
+def test_manipulator_masks_match_its_object_lists(environment):
+    manipulator = Manipulator(environment)
+    known = ObjectStore([Object({"name": object.name}) for object in list(environment.objects)[::2]])
+    generator = random.Random(17)
+    for _ in range(10):
+        manipulator.ee_location_x, manipulator.ee_location_y, manipulator.ee_location_z = (generator.uniform(-5, 5) for _ in range(3))
+        for restriction in (None, known):
+            assert names(environment, manipulator.reach_mask(restriction)) == {object.name for object in manipulator.objects_in_reach(restriction)}
+            assert names(environment, manipulator.pickable_mask(restriction)) == {object.name for object in manipulator.pickable_in_reach(restriction)}
+            assert names(environment, manipulator.cuttable_mask(restriction)) == {object.name for object in manipulator.cuttable_in_reach(restriction)}
+            assert names(environment, manipulator.container_mask(restriction)) == {object.name for object in manipulator.containers_in_reach(restriction)}
+
+# The mask of the known objects is reused until the knowledge or the objects of the environment change
+def test_known_masks_follow_the_knowledge(environment):
+    manipulator = Manipulator(environment)
+    manipulator.max_reach_distance = 100
+    known = ObjectStore([Object({"name": "object_0"})])
+    first = manipulator.known_mask(known)
+    assert manipulator.known_mask(known) is first
+    assert names(environment, manipulator.reach_mask(known)) == {"object_0"} & {object.name for object in environment.objects}
+    known.add(Object({"name": "table"}))
+    assert names(environment, manipulator.reach_mask(known)) == {"object_0", "table"} & {object.name for object in environment.objects}
+    environment.remove_object("table")
+    assert "table" not in names(environment, manipulator.reach_mask(known))
@@ -0,0 +1,112 @@
+from gpt_controller.util.persistence import SQLiteMemory
+from gpt_controller.util.activity import TaskStack
+from gpt_controller.util.store import ObjectStore
+from gpt_controller.util.models import *
+import pytest
+
+# State of a machine persisted by the memory
+class MachineState():
+
+    def __init__(self):
+        self.object_knowledge = ObjectStore()
+        self.task_stack = TaskStack()
+        self.advices : list[Advice] = []
+        self.conversations : list[Conversation] = []
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "memory.db")
+
+# Function that returns a machine state loaded from the database
+def reload(path: str, task_window: int = 50) -> tuple[SQLiteMemory, MachineState]:
+    memory = SQLiteMemory(path, task_window=task_window)
+    state = MachineState()
+    memory.load(state)
+    return memory, state
+
+def finished_task(goal: str, success: bool = True) -> Task:
+    task = Task(TaskLabel.MANIPULATION, goal)
+    task.start()
+    task.complete("Done" if success else "Error", success)
+    return task
+
+def test_objects_advice_tasks_and_conversations_round_trip(path):
+    memory, state = reload(path)
+    state.object_knowledge.add(Object({"name": "tomato", "color": "red", "shape": "spherical", "material": "organic",
+                                       "location": (1, 2, 3), "capabilities": Capability.CUTTABLE, "support_surface": "table"}))
+    state.object_knowledge.add(Object({"name": "fridge", "contains": ["milk"], "capabilities": Capability.CONTAINER | Capability.FIXED}))
+    state.advices.append(Advice(AdviceLabel.LIMITATION, "Never touch the knife"))
+    state.task_stack.append(finished_task("Pick up the tomato"))
+    state.task_stack.append(Task(TaskLabel.NAVIGATION, "Go to the fridge"))
+    conversation = Conversation(ConversationType.CHAT)
+    conversation.messages.append(Message(Role.USER, "Hello"))
+    conversation.finish()
+    state.conversations.append(conversation)
+    memory.save(state)
+    memory.close()
+
+    memory, loaded = reload(path)
+    tomato = loaded.object_knowledge.get("tomato")
+    assert (tomato.color, tomato.shape, tomato.material) == ("red", Shape.SPHERICAL, Material.ORGANIC)
+    assert (tomato.x, tomato.y, tomato.z, tomato.support_surface) == (1, 2, 3, "table")
+    assert tomato.capabilities == Capability.VISIBLE | Capability.CUTTABLE
+    assert tomato.id == state.object_knowledge.get("tomato").id
+    assert loaded.object_knowledge.get("fridge").contains == ("milk",)
+    assert [advice.content for advice in loaded.advices] == ["Never touch the knife"]
+    assert [(task.id, task.goal, task.status) for task in loaded.task_stack] == \
+        [(task.id, task.goal, task.status) for task in state.task_stack]
+    assert [task.goal for task in loaded.task_stack.log.window()] == ["Pick up the tomato", "Go to the fridge"]
+    assert loaded.conversations == []
+    stored = memory.conversations_of(ConversationType.CHAT)
+    assert [message.content for message in stored[0].messages] == [conversation.messages[0].content]
+    assert [object.name for object in memory.objects_where(color="red")] == ["tomato"]
+
+def test_only_changes_are_written_again(path):
+    memory, state = reload(path)
+    tomato = state.object_knowledge.add(Object({"name": "tomato", "color": "red"}))
+    state.object_knowledge.add(Object({"name": "knife", "color": "grey"}))
+    memory.save(state)
+    tomato.color = "green"
+    state.object_knowledge.remove("knife")
+    memory.save(state)
+    memory.close()
+
+    memory, loaded = reload(path)
+    assert [(object.name, object.color) for object in loaded.object_knowledge] == [("tomato", "green")]
+
+# Finished tasks beyond the window are dropped from memory but stay in the database, unfinished tasks are kept
+def test_trim_evicts_finished_tasks_beyond_the_window(path):
+    memory = SQLiteMemory(path, task_window=5)
+    state = MachineState()
+    pending = Task(TaskLabel.USER_INPUT, "Make a salad")
+    state.task_stack.append(pending)
+    failed = finished_task("Cut the tomato", success=False)
+    state.task_stack.append(failed)
+    for index in range(20):
+        state.task_stack.append(finished_task("Task {}".format(index)))
+        memory.save(state)
+
+    assert len(state.task_stack) == 5
+    assert state.task_stack[0] is pending
+    assert failed not in state.task_stack
+    assert [task.goal for task in state.task_stack[1:]] == ["Task {}".format(index) for index in range(16, 20)]
+    assert len(memory.tasks_between(datetime.now() - timedelta(hours=1), limit=100)) == 22
+    memory.close()
+
+    memory, loaded = reload(path, task_window=5)
+    assert [task.goal for task in loaded.task_stack] == [task.goal for task in state.task_stack]
+    positions = memory.connection.execute("SELECT position FROM tasks").fetchall()
+    assert len(set(positions)) == len(positions)
+
+# A task moved in the stack gets a new position, so the stack is loaded in the order it was saved
+def test_reordered_tasks_keep_their_order(path):
+    memory, state = reload(path)
+    first, second = Task(TaskLabel.USER_INPUT, "First"), Task(TaskLabel.USER_INPUT, "Second")
+    state.task_stack.extend([first, second])
+    memory.save(state)
+    state.task_stack[:] = [second, first]
+    memory.save(state)
+    memory.close()
+
+    memory, loaded = reload(path)
+    assert [task.goal for task in loaded.task_stack] == ["Second", "First"]
@@ -0,0 +1,72 @@
+from gpt_controller.cognition.ratelimit import RateLimiter, fcntl
+import threading
+import pytest
+import time
+
+# Function that empties the buckets of a limiter, as of `age` seconds ago
+def drain(limiter: RateLimiter, age: float = 0.0):
+    with limiter.shared_state() as state:
+        for name in limiter.capacities:
+            state[name] = [0, time.time() - age]
+
+def test_buckets_refill_in_proportion_to_the_elapsed_time():
+    limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=600, path=None)
+    drain(limiter, age=30)
+    assert limiter.take(100) == 0
+    levels = limiter.stats()["levels"]
+    assert levels["requests"] == pytest.approx(29, abs=0.1)
+    assert levels["tokens"] == pytest.approx(200, abs=1)
+
+def test_buckets_never_exceed_their_capacity():
+    limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=600, path=None)
+    drain(limiter, age=600)
+    assert limiter.take(0) == 0
+    assert limiter.stats()["levels"] == {"requests": 59, "tokens": 600}
+
+# The wait is the time until both buckets hold enough for the request
+def test_take_returns_the_time_until_the_request_fits():
+    limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=600, path=None)
+    drain(limiter)
+    assert limiter.take(60) == pytest.approx(6, abs=0.01)
+    assert limiter.take(0) == pytest.approx(1, abs=0.01)
+    assert limiter.stats()["levels"]["requests"] == pytest.approx(0, abs=0.1)
+
+def test_adjust_returns_unused_tokens():
+    limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=600, path=None)
+    assert limiter.acquire(500)
+    limiter.adjust(-400)
+    assert limiter.stats()["levels"]["tokens"] == pytest.approx(500, abs=1)
+
+def test_acquire_times_out_when_the_buckets_are_empty():
+    limiter = RateLimiter(requests_per_minute=6, tokens_per_minute=600, path=None)
+    drain(limiter)
+    assert not limiter.acquire(10, timeout=0.05)
+    assert limiter.stats()["queued"] == 0
+
+# Waiting requests are served by priority, then in arrival order
+def test_waiting_requests_are_served_by_priority():
+    limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=10 ** 6, path=None)
+    drain(limiter)
+    served = []
+    def request(name: str, priority: int):
+        limiter.acquire(1, priority=priority, timeout=5)
+        served.append(name)
+    threads = []
+    for name, priority in (("background", 5), ("first", 1), ("second", 1)):
+        threads.append(threading.Thread(target=request, args=(name, priority)))
+        threads[-1].start()
+        while limiter.stats()["queued"] < len(threads):
+            time.sleep(0.001)
+    for thread in threads:
+        thread.join()
+    assert served == ["first", "second", "background"]
+
+@pytest.mark.skipif(fcntl is None, reason="file locks are not available")
+def test_processes_share_the_buckets_of_a_file(tmp_path):
+    path = str(tmp_path / "ratelimit.json")
+    first = RateLimiter(requests_per_minute=60, tokens_per_minute=600, path=path)
+    second = RateLimiter(requests_per_minute=60, tokens_per_minute=600, path=path)
+    assert first.acquire(300)
+    assert second.stats()["levels"]["tokens"] == pytest.approx(300, abs=1)
+    assert second.acquire(300)
+    assert first.stats()["levels"]["tokens"] == pytest.approx(0, abs=1)
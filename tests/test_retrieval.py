@@ -0,0 +1,41 @@
+from gpt_controller.cognition.retrieval import ObjectRetriever
+from gpt_controller.util.models import Object, Capability
+from gpt_controller.util.store import ObjectStore
+
+def kitchen() -> ObjectStore:
+    return ObjectStore([Object({"name": "tomato", "color": "red", "support_surface": "table"}),
+                        Object({"name": "table", "color": "brown", "capabilities": Capability.FIXED}),
+                        Object({"name": "knife", "color": "grey", "support_surface": "counter"}),
+                        Object({"name": "counter", "color": "white", "capabilities": Capability.FIXED}),
+                        Object({"name": "milk", "container": "fridge"}),
+                        Object({"name": "fridge", "capabilities": Capability.CONTAINER | Capability.FIXED})])
+
+def test_goals_naming_no_object_retrieve_nothing():
+    retriever = ObjectRetriever(kitchen(), k=3)
+    assert retriever.retrieve("Hello there") == []
+    assert retriever.rank("Thermometer") == []
+
+def test_named_objects_come_with_their_supports_and_containers():
+    retriever = ObjectRetriever(kitchen(), k=1)
+    assert [object.name for object in retriever.retrieve("Pick up the tomato")] == ["tomato", "table"]
+    assert [object.name for object in retriever.retrieve("Pour the milk")] == ["milk", "fridge"]
+
+def test_objects_are_ranked_by_relevance():
+    retriever = ObjectRetriever(kitchen(), k=3)
+    ranked = [name for name, score in retriever.rank("Cut the red tomato with the knife")]
+    assert set(ranked) == {"tomato", "knife"}
+    assert ranked[0] == "tomato"
+
+def test_index_follows_the_store():
+    store = kitchen()
+    retriever = ObjectRetriever(store, k=3)
+    assert retriever.retrieve("Grab the spoon") == []
+    store.add(Object({"name": "spoon"}))
+    assert [object.name for object in retriever.retrieve("Grab the spoon")] == ["spoon"]
+
+def test_recall_counts_relevant_objects_retrieved():
+    retriever = ObjectRetriever(kitchen(), k=1)
+    assert retriever.recall("Pick up the tomato", ["tomato", "table"]) == 1.0
+    assert retriever.recall("Pick up the tomato", ["knife"]) == 0.0
+    retriever.observe(["tomato", "knife", "unknown"])
+    assert (retriever.hits, retriever.misses) == (1, 1)
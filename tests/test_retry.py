@@ -0,0 +1,166 @@
+from gpt_controller.cognition import retry as retry_module
+from gpt_controller.cognition.retry import RetryPolicy
+from gpt_controller.cognition.backend import OfflineBackend, text_completion
+from gpt_controller.cognition.machine import Machine
+from gpt_controller.cognition.telemetry import Telemetry
+from gpt_controller.playground.environment import Environment
+from gpt_controller.util.models import Message, Role, Conversation, ConversationType
+import threading
+import openai
+import pytest
+import time
+
+@pytest.mark.parametrize("error", [
+    openai.error.RateLimitError("rate limited"),
+    openai.error.APIConnectionError("connection reset"),
+    openai.error.Timeout("timed out"),
+    TimeoutError("deadline"),
+    ConnectionError("refused")
+])
+def test_transient_errors_are_retryable(error):
+    assert RetryPolicy.is_retryable(error)
+
+@pytest.mark.parametrize("error", [
+    openai.error.InvalidRequestError("context too long", "messages"),
+    openai.error.AuthenticationError("invalid key"),
+    ValueError("bad value")
+])
+def test_permanent_errors_are_not_retryable(error):
+    assert not RetryPolicy.is_retryable(error)
+
+# Delays double with every attempt up to the maximum, and the jitter only shortens them
+def test_delays_back_off_exponentially(monkeypatch):
+    policy = RetryPolicy(base_delay=1, max_delay=10, jitter=0.5)
+    monkeypatch.setattr(retry_module.random, "random", lambda: 0.0)
+    assert [policy.delay(attempt) for attempt in range(5)] == [1, 2, 4, 8, 10]
+    monkeypatch.setattr(retry_module.random, "random", lambda: 1.0)
+    assert [policy.delay(attempt) for attempt in range(5)] == [0.5, 1, 2, 4, 5]
+
+def test_hedge_delay_needs_enough_samples():
+    policy = RetryPolicy(hedge_percentile=90, hedge_min_samples=10)
+    policy.latencies.extend(range(9))
+    assert policy.hedge_delay() is None
+    policy.latencies.extend(range(9, 100))
+    assert policy.hedge_delay() == 90
+    assert RetryPolicy(hedge_percentile=None, hedge_min_samples=0).hedge_delay() is None
+
+def test_unhedged_requests_run_in_the_calling_thread():
+    policy = RetryPolicy(hedge_percentile=None)
+    assert policy.call(lambda: threading.current_thread().name) == threading.current_thread().name
+    assert policy.executor is None
+    assert len(policy.latencies) == 1
+
+def test_slow_requests_are_hedged_and_the_first_response_wins():
+    policy = RetryPolicy(hedge_percentile=50, hedge_min_samples=1)
+    policy.latencies.extend([0.01] * 5)
+    calls = []
+    def request():
+        calls.append(None)
+        if len(calls) == 1:
+            time.sleep(0.3)
+            return "slow"
+        return "fast"
+    assert policy.call(request, remaining=5) == "fast"
+    assert policy.hedges == 1
+
+def test_expired_deadlines_raise_timeouts():
+    policy = RetryPolicy(hedge_percentile=50, hedge_min_samples=1)
+    policy.latencies.extend([0.01] * 5)
+    with pytest.raises(TimeoutError):
+        policy.call(lambda: time.sleep(0.3), remaining=0.05)
+    with pytest.raises(TimeoutError):
+        policy.call(lambda: None, remaining=0)
+
+# A deadline shorter than the hedge delay ends the call without sending a hedge
+def test_deadlines_before_the_hedge_delay_do_not_hedge():
+    policy = RetryPolicy(hedge_percentile=50, hedge_min_samples=1)
+    policy.latencies.extend([0.2] * 5)
+    calls = []
+    def request():
+        calls.append(None)
+        time.sleep(0.3)
+    with pytest.raises(TimeoutError):
+        policy.call(request, remaining=0.05)
+    time.sleep(0.2)
+    assert policy.hedges == 0
+    assert len(calls) == 1
+
+# Function that returns a scripted response failing with `error` the first `failures` times
+def failing(error: Exception, failures: int):
+    calls = []
+    def respond(messages, functions):
+        calls.append(None)
+        if len(calls) <= failures:
+            raise error
+        return text_completion("Done")
+    return respond
+
+def test_machine_retries_transient_errors(workdir):
+    backend = OfflineBackend()
+    backend.script(failing(openai.error.APIConnectionError("connection reset"), 2))
+    machine = Machine(Environment("kitchen"), backend=backend, retry_policy=RetryPolicy(max_retries=3, base_delay=0))
+    machine.cache = None
+    assert machine.process([Message(Role.USER, "Hello")])["content"] == "Done"
+    assert backend.calls == 3
+
+def test_machine_gives_up_on_permanent_errors(workdir):
+    backend = OfflineBackend()
+    backend.script(failing(openai.error.InvalidRequestError("context too long", "messages"), 1))
+    machine = Machine(Environment("kitchen"), backend=backend, retry_policy=RetryPolicy(max_retries=3, base_delay=0))
+    machine.cache = None
+    assert machine.process([Message(Role.USER, "Hello")]) is None
+    assert backend.calls == 1
+    assert machine.last_error.retryable is False
+    assert machine.last_error.attempts == 1
+
+# The request losing a hedge is billed once it completes, even though its response is not used
+def test_machine_bills_losing_hedges(workdir):
+    completion = text_completion("Done")
+    completion["usage"] = {"prompt_tokens": 10, "completion_tokens": 5}
+    backend = OfflineBackend()
+    backend.script(completion, latency=0.2)
+    policy = RetryPolicy(deadline=5, hedge_percentile=50, hedge_min_samples=1)
+    policy.latencies.extend([0.01] * 5)
+    machine = Machine(Environment("kitchen"), backend=backend, retry_policy=policy)
+    machine.cache = None
+    machine.telemetry = Telemetry(path=None)
+    conversation = Conversation(ConversationType.CHAT)
+
+    assert machine.process([Message(Role.USER, "Hello")], conversation=conversation)["content"] == "Done"
+    policy.executor.shutdown(wait=True)
+    assert policy.hedges == 1
+    assert conversation.token_quota == 30
+    assert machine.governor.used == 30
+    assert sorted(record.finish_reason for record in machine.telemetry.records) == ["abandoned", "stop"]
+
+# A stream still sending chunks at the deadline is abandoned rather than read to its end
+def test_machine_stops_streams_at_the_deadline(workdir):
+    backend = OfflineBackend(chunk_latency=0.05)
+    backend.script(text_completion("A long answer that takes a while to stream"))
+    machine = Machine(Environment("kitchen"), backend=backend, retry_policy=RetryPolicy(max_retries=1, deadline=0.2))
+    machine.cache = None
+    chunks = []
+    start_time = time.monotonic()
+    assert machine.process([Message(Role.USER, "Hello")], stream=True, on_content=chunks.append) is None
+    assert time.monotonic() - start_time < 0.4
+    assert 0 < len(chunks) < 11
+    assert machine.last_error.retryable is True
+
+# Errors of completions requested by other threads do not overwrite the error of the calling thread
+def test_machine_keeps_the_last_error_per_thread(workdir):
+    backend = OfflineBackend()
+    backend.script(failing(openai.error.InvalidRequestError("context too long", "messages"), 1), contains="Fail")
+    backend.script(text_completion("Done"))
+    machine = Machine(Environment("kitchen"), backend=backend, retry_policy=RetryPolicy(max_retries=3, base_delay=0))
+    machine.cache = None
+    errors = []
+    def fail():
+        machine.process([Message(Role.USER, "Fail")])
+        errors.append(machine.last_error)
+    thread = threading.Thread(target=fail)
+    thread.start()
+    thread.join()
+
+    assert errors[0].retryable is False
+    assert machine.process([Message(Role.USER, "Hello")])["content"] == "Done"
+    assert machine.last_error is None
@@ -0,0 +1,73 @@
+from gpt_controller.util.spatial import SpatialGrid, position
+from gpt_controller.util.store import ObjectStore
+from gpt_controller.util.models import Object
+import random
+import math
+import pytest
+
+def scene(count: int, seed: int = 3, extent: float = 20.0) -> list[Object]:
+    generator = random.Random(seed)
+    return [Object({"name": "object_{}".format(index),
+                    "location": tuple(generator.uniform(-extent, extent) for _ in range(3))}) for index in range(count)]
+
+def centers(seed: int = 5, count: int = 20) -> list[tuple[float, float, float]]:
+    generator = random.Random(seed)
+    return [tuple(generator.uniform(-25, 25) for _ in range(3)) for _ in range(count)]
+
+# Brute-force scans the queries of the grid are checked against
+def scan_within(objects: list[Object], center: tuple, radius: float) -> list[Object]:
+    return sorted((object for object in objects if math.dist(center, position(object)) <= radius),
+                  key=lambda object: math.dist(center, position(object)))
+
+def scan_nearest(objects: list[Object], center: tuple, k: int, radius: float = None) -> list[Object]:
+    return [object for object in sorted(objects, key=lambda object: math.dist(center, position(object)))
+            if radius is None or math.dist(center, position(object)) <= radius][:k]
+
+@pytest.fixture(params=[0.5, 2.0, 50.0])
+def grid(request):
+    return SpatialGrid(cell_size=request.param)
+
+def test_within_matches_a_scan(grid):
+    objects = scene(300)
+    for object in objects:
+        grid.insert(object)
+    for center in centers():
+        for radius in (0.0, 1.0, 4.0, 15.0, 100.0):
+            assert grid.within(center, radius) == scan_within(objects, center, radius)
+
+def test_nearest_matches_a_scan(grid):
+    objects = scene(300)
+    for object in objects:
+        grid.insert(object)
+    for center in centers():
+        for k in (1, 5, 40):
+            assert grid.nearest(center, k) == scan_nearest(objects, center, k)
+            assert grid.nearest(center, k, radius=6.0) == scan_nearest(objects, center, k, 6.0)
+    assert grid.nearest((0, 0, 0), 0) == []
+    assert SpatialGrid().nearest((0, 0, 0), 3) == []
+
+def test_box_matches_a_scan(grid):
+    objects = scene(300)
+    for object in objects:
+        grid.insert(object)
+    for minimum, maximum in (((-5, -5, -5), (5, 5, 5)), ((0, -20, 3), (20, 0, 4)), ((-30, -30, -30), (30, 30, 30))):
+        expected = {object.name for object in objects
+                    if all(low <= coordinate <= high for low, coordinate, high in zip(minimum, position(object), maximum))}
+        assert {object.name for object in grid.box(minimum, maximum)} == expected
+
+# Objects of a store holding the grid are moved in it as their positions change
+def test_grid_follows_moves_and_removals():
+    grid = SpatialGrid(cell_size=1.0)
+    objects = scene(100)
+    store = ObjectStore(objects, spatial=grid)
+    generator = random.Random(11)
+    for object in generator.sample(objects, 40):
+        object.x, object.y = generator.uniform(-20, 20), generator.uniform(-20, 20)
+    for object in generator.sample(objects, 20):
+        store.remove(object.name)
+    remaining = list(store)
+    assert len(grid) == len(remaining)
+    assert grid.locations == {object: grid.cell(position(object)) for object in remaining}
+    for center in centers(count=10):
+        assert grid.within(center, 8.0) == scan_within(remaining, center, 8.0)
+        assert grid.nearest(center, 5) == scan_nearest(remaining, center, 5)
@@ -0,0 +1,113 @@
+from gpt_controller.util.models import Object, Capability, Material
+from gpt_controller.util.store import ObjectStore
+import random
+
+COLORS = ("red", "green", "blue")
+
+def make_object(name: str, color: str, capabilities: Capability = Capability.VISIBLE, **attributes) -> Object:
+    return Object(dict({"name": name, "color": color, "capabilities": capabilities}, **attributes))
+
+# Function that checks every index of a store against a scan of its objects
+def assert_consistent(store: ObjectStore):
+    objects = list(store.objects.values())
+    assert all(store.objects[object.name] is object for object in objects)
+    assert store.ids == {object.id: object for object in objects}
+    for attribute, index in store.indices.items():
+        expected = {}
+        for object in objects:
+            expected.setdefault(getattr(object, attribute), {})[object.name] = object
+        assert index == expected, attribute
+    expected = {}
+    for object in objects:
+        for capability in object.capabilities.members():
+            expected.setdefault(capability, {})[object.name] = object
+    assert store.capabilities == expected
+
+def test_find_matches_every_criterion():
+    store = ObjectStore([make_object("apple", "red", Capability.VISIBLE | Capability.CUTTABLE),
+                         make_object("cup", "red"),
+                         make_object("knife", "green", Capability.VISIBLE | Capability.CUTTABLE, material="metal")])
+    assert {object.name for object in store.find(color="red")} == {"apple", "cup"}
+    assert [object.name for object in store.find(Capability.CUTTABLE, color="red")] == ["apple"]
+    assert [object.name for object in store.find(material=Material.METAL)] == ["knife"]
+    assert store.find(color="purple") == []
+    assert len(store.find()) == 3
+
+def test_indices_follow_mutations_in_place():
+    store = ObjectStore([make_object("apple", "red"), make_object("cup", "blue")])
+    apple = store.get("apple")
+    apple.color = "green"
+    apple.container = "fridge"
+    apple.add_capability(Capability.CUTTABLE)
+    store.get("cup").remove_capability(Capability.VISIBLE)
+    assert [object.name for object in store.find(color="green", container="fridge")] == ["apple"]
+    assert store.find(color="red") == []
+    assert [object.name for object in store.find(Capability.VISIBLE)] == ["apple"]
+    assert_consistent(store)
+
+def test_renamed_objects_are_found_by_their_new_name():
+    store = ObjectStore([make_object("apple", "red")])
+    apple = store.get("apple")
+    apple.name = "green_apple"
+    assert "apple" not in store
+    assert store.get("green_apple") is apple
+    assert store.find(color="red") == [apple]
+    assert_consistent(store)
+
+def test_objects_keep_every_store_holding_them_current():
+    apple = make_object("apple", "red")
+    first, second = ObjectStore([apple]), ObjectStore([apple])
+    apple.color = "green"
+    assert first.find(color="green") == second.find(color="green") == [apple]
+    first.remove("apple")
+    apple.color = "blue"
+    assert second.find(color="blue") == [apple]
+    assert first.find(color="blue") == []
+    assert apple.stores == (second,)
+
+def test_replaced_and_removed_objects_leave_the_indices():
+    store = ObjectStore([make_object("apple", "red")])
+    store.add(make_object("apple", "green"))
+    assert store.find(color="red") == []
+    assert len(store) == 1
+    assert store.remove("apple")
+    assert not store.remove("apple")
+    assert store.indices == {attribute: {} for attribute in store.indices}
+    assert store.capabilities == {}
+
+def test_version_changes_with_every_change():
+    store = ObjectStore()
+    versions = [store.version]
+    apple = store.add(make_object("apple", "red"))
+    versions.append(store.version)
+    apple.color = "green"
+    versions.append(store.version)
+    apple.add_capability(Capability.CUTTABLE)
+    versions.append(store.version)
+    store.remove("apple")
+    versions.append(store.version)
+    assert len(set(versions)) == len(versions)
+
+def test_indices_stay_consistent_under_random_mutations():
+    generator = random.Random(7)
+    store = ObjectStore()
+    for _ in range(500):
+        name = "object_{}".format(generator.randrange(20))
+        operation = generator.randrange(5)
+        if operation == 0:
+            store.add(make_object(name, generator.choice(COLORS)))
+        elif name not in store:
+            continue
+        elif operation == 1:
+            store.get(name).color = generator.choice(COLORS)
+        elif operation == 2:
+            store.get(name).support_surface = generator.choice(("table", "counter", None))
+        elif operation == 3:
+            capability = generator.choice(list(Capability))
+            if generator.random() < 0.5:
+                store.get(name).add_capability(capability)
+            else:
+                store.get(name).remove_capability(capability)
+        else:
+            store.remove(name)
+    assert_consistent(store)
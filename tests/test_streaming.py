@@ -0,0 +1,57 @@
+from gpt_controller.cognition import machine as machine_module
+from gpt_controller.cognition.streaming import StreamAccumulator, FunctionDispatch
+from gpt_controller.cognition.backend import OfflineBackend, completion_chunks, text_completion, function_call_completion
+from gpt_controller.cognition.machine import Machine
+from gpt_controller.playground.environment import Environment
+from gpt_controller.util.models import Task, TaskStatus
+from gpt_controller.util.labels import TaskLabel
+import pytest
+
+# The function call is dispatched with the chunk closing its arguments, before the stream finishes
+def test_function_calls_are_dispatched_once_their_arguments_close():
+    calls = []
+    accumulator = StreamAccumulator(on_function_call=lambda name, arguments: calls.append((name, arguments)))
+    chunks = list(completion_chunks(function_call_completion("think", {"input": "a {brace} and \"}\""}), size=3))
+    for chunk in chunks[:-1]:
+        accumulator.feed(chunk)
+    assert calls == [("think", {"input": "a {brace} and \"}\""})]
+    accumulator.feed(chunks[-1])
+    assert calls == [("think", {"input": "a {brace} and \"}\""})]
+    assert accumulator.completion()["choices"][0]["finish_reason"] == "function_call"
+
+def test_content_is_forwarded_as_it_arrives():
+    tokens = []
+    accumulator = StreamAccumulator(on_content=tokens.append)
+    for chunk in completion_chunks(text_completion("Hello there"), size=4):
+        accumulator.feed(chunk)
+    assert tokens == ["Hell", "o th", "ere"]
+    assert accumulator.message() == {"role": "assistant", "content": "Hello there"}
+    assert not accumulator.dispatched
+
+def test_dispatch_executes_the_function_once():
+    calls = []
+    dispatch = FunctionDispatch({"think": lambda input: calls.append(input) or "Thought"})
+    dispatch("think", {"input": "early"})
+    assert dispatch.result("think", {"input": "late"}) == "Thought"
+    assert calls == ["early"]
+
+# A function dispatched while streaming is not executed again, even if the stream fails afterwards
+def test_machine_does_not_retry_dispatched_streams(workdir, monkeypatch):
+    monkeypatch.setattr(machine_module, "STREAM_COMPLETIONS", True)
+    backend = OfflineBackend()
+    backend.script(function_call_completion("think", {"input": "What now?"}))
+    streamed = backend.stream
+    def stream(*args, **kwargs):
+        chunks = list(streamed(*args, **kwargs))
+        yield from chunks[:-1]
+        raise ConnectionError("connection reset")
+    backend.stream = stream
+    machine = Machine(Environment("kitchen"), backend=backend, cache=None)
+    machine.cache = None
+    calls = []
+    machine.cognitive_functions["think"] = lambda input: calls.append(input) or "I thought about it"
+    machine.task_stack.append(Task(TaskLabel.COGNITION, "Think about what to do"))
+
+    assert machine.act() == TaskStatus.COMPLETED
+    assert calls == ["What now?"]
+    assert machine.task_stack[-1].conclusion == "I thought about it"
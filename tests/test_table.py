@@ -0,0 +1,73 @@
+from gpt_controller.util.models import Object, Capability, GEOMETRY_ATTRIBUTES
+from gpt_controller.util.store import ObjectStore
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from gpt_controller.util.table import ObjectTable
+
+def make_object(name: str, location: tuple = (0, 0, 0), **attributes) -> Object:
+    return Object(dict({"name": name, "location": location, "dimensions": (1, 2, 3)}, **attributes))
+
+def test_objects_carry_no_attribute_dictionary():
+    object = make_object("tomato")
+    assert not hasattr(object, "__dict__")
+    assert object.contains == ()
+    object.add_content("seed")
+    assert object.contains == ("seed",)
+
+def test_attached_geometry_lives_in_the_table():
+    table = ObjectTable(capacity=4)
+    object = make_object("tomato", (1, 2, 3))
+    table.attach(object)
+    assert [table.column(attribute)[object.row] for attribute in GEOMETRY_ATTRIBUTES] == [1, 2, 3, 1, 2, 3]
+    object.x = 7
+    assert table.column("x")[object.row] == 7
+    table.columns[GEOMETRY_ATTRIBUTES.index("y"), object.row] = 9
+    assert object.y == 9
+
+def test_detached_objects_keep_their_geometry_and_free_their_row():
+    table = ObjectTable(capacity=4)
+    first, second = make_object("tomato", (1, 2, 3)), make_object("knife", (4, 5, 6))
+    row = table.attach(first)
+    table.attach(second)
+    first.z = 8
+    table.detach(first)
+    assert (first.table, first.row) == (None, None)
+    assert (first.x, first.y, first.z, first.height) == (1, 2, 8, 3)
+    assert len(table) == 1
+    assert not table.occupied[row]
+    assert table.attach(make_object("cup")) == row
+
+def test_table_grows_when_full():
+    table = ObjectTable(capacity=1)
+    objects = [make_object("object_{}".format(index), (index, index, index)) for index in range(10)]
+    for object in objects:
+        table.attach(object)
+    assert len(table) == 10
+    assert [object.x for object in objects] == list(range(10))
+    assert table.select(table.capability_mask(Capability.VISIBLE)) == objects
+
+def test_objects_attach_to_a_single_table():
+    object = make_object("tomato")
+    ObjectTable().attach(object)
+    with pytest.raises(Exception):
+        ObjectTable().attach(object)
+
+# The references and capabilities mirrored in the table follow the changes of the objects of its store
+def test_store_mirrors_references_and_capabilities_in_the_table():
+    table = ObjectTable()
+    store = ObjectStore(table=table)
+    tomato = store.add(make_object("tomato", support_surface="table"))
+    knife = store.add(make_object("knife", support_surface="counter", capabilities=Capability.CUTTABLE))
+    assert table.select(table.support_mask("table")) == [tomato]
+    tomato.support_surface = "counter"
+    tomato.container = "bowl"
+    knife.remove_capability(Capability.VISIBLE)
+    assert table.select(table.support_mask("counter")) == [tomato, knife]
+    assert table.select(table.containment_mask("bowl")) == [tomato]
+    assert table.select(table.capability_mask(Capability.VISIBLE)) == [tomato]
+    assert table.select(table.capability_mask(Capability.CUTTABLE)) == [knife]
+    store.remove("knife")
+    assert table.select(table.support_mask("counter")) == [tomato]
+    assert not table.support_mask("nowhere").any()